@@ -3,17 +3,28 @@
 from collections import deque, namedtuple
 
 from apps.base_app import BaseApp
-from net.net import BROADCAST_ADDRESS, MY_ADDRESS, register_receiver, send
+from net.crypto import EC_SIGNATURE_LEN, KEY_EC
+from net.net import BROADCAST_ADDRESS, MY_ADDRESS, SEND_REJECTED, register_receiver, send
 from net.protocols import NetworkFrame, Protocol
+from net.textcodec import compress, decompress
 from ui.chat import Chat
 
 MAX_MESSAGE_LEN = 100
+MAX_SIGNED_RSA_LEN = 90  # Text field of SIGNED_TEXT_CHAT, the rest of the frame is the RSA signature
 TEXT_CHAT = Protocol(
     port=6, name="TEXT_CHAT", structdef=f"!H10s{MAX_MESSAGE_LEN}s"
 )  # Text (ASCII) message to a chat channel
 SIGNED_TEXT_CHAT = Protocol(
-    port=7, name="SIGNED_TEXT_CHAT", structdef=f"!H10s128s90s"
+    port=7, name="SIGNED_TEXT_CHAT", structdef=f"!H10s128s{MAX_SIGNED_RSA_LEN}s"
 )  # Text (ASCII) message to a chat channel with a signature to verify authenticity
+SIGNED_TEXT_CHAT_EC = Protocol(
+    port=9, name="SIGNED_TEXT_CHAT_EC", structdef=f"!H10s{EC_SIGNATURE_LEN}s{MAX_MESSAGE_LEN}s"
+)  # Same, signed with an elliptic curve key: half the signature, full length text
+
+# Set in the channel number of any of the chat protocols when the text is encoded with net.textcodec.
+# Channel numbers only go up to 5299, so the top bit is free. Badges without the codec file these
+# messages under a channel they never show, rather than showing garbled text.
+CHAT_COMPRESSED = 0x8000
 
 
 ChatMessage = namedtuple(
@@ -54,6 +65,8 @@ class ChatApp(BaseApp):
             self.chat_ttl = int(self.badge.config.get("chat_ttl", b"3"))
         except ValueError:
             self.chat_ttl = 2
+        self.chat_compress = self.badge.config.get("chat_compress", b"false").strip() in (b"1", b"true", b"True")
+        self.chat_sign = self.badge.config.get("chat_sign", b"false").strip() in (b"1", b"true", b"True")
 
     def _update_channel_messages(self, seek = None):
         if not self.channel_messages_updated:
@@ -80,25 +93,35 @@ class ChatApp(BaseApp):
         self.channel_messages_updated = False
 
     def receive_message(self, message: NetworkFrame):
-        if message.port == TEXT_CHAT.port:
-            channel_num, source_alias, text = message.payload
-            signed = False
-            # print(
-            #     f"Chat rx: {message.source:x} {source_alias}: {channel_num}: {text[:16]}"
-            # )
-        elif message.port == SIGNED_TEXT_CHAT.port:
-            channel_num, source_alias, signature, text = message.payload
-            # Only verifying the message, not packet headers. Risky?
-            signed = self.badge.crypto.verify(text, signature)
-            # print(
-            #     f"Signed Chat rx: {message.source:x} {source_alias}: {channel_num}: {text[:16]} verified: {signed}"
-            # )
-            if not signed:
+        channel_num, source_alias, text = message.payload
+        # print(
+        #     f"Chat rx: {message.source:x} {source_alias}: {channel_num}: {text[:16]}"
+        # )
+        self._add_message(message.source, channel_num, source_alias, text, False)
+
+    async def receive_signed_message(self, message: NetworkFrame):
+        channel_num, source_alias, signature, text = message.payload
+        # Only verifying the message, not packet headers. Risky?
+        signed = await self.badge.verifier.verify(text, signature)
+        # print(
+        #     f"Signed Chat rx: {message.source:x} {source_alias}: {channel_num}: {text[:16]} verified: {signed}"
+        # )
+        if signed:
+            self._add_message(message.source, channel_num, source_alias, text, True)
+
+    def _add_message(self, source: int, channel_num: int, source_alias: bytes, text: bytes, signed: bool):
+        text = text.strip(b"\0")
+        if channel_num & CHAT_COMPRESSED:
+            channel_num &= ~CHAT_COMPRESSED
+            try:
+                text = decompress(text)
+            except ValueError:
+                print(f"Bad compressed chat text from {source:x}")
                 return
         new_message = ChatMessage(
-            message.source,
+            source,
             source_alias.strip(b"\0").decode(),
-            text.strip(b"\0").decode(),
+            text.decode(),
             signed,
         )
         if channel_num in self.channels:
@@ -113,7 +136,9 @@ class ChatApp(BaseApp):
     def start(self):
         super().start()
         register_receiver(TEXT_CHAT, self.receive_message)
-        register_receiver(SIGNED_TEXT_CHAT, self.receive_message)
+        # Verifying signatures is slow, so signed messages are handled in their own task
+        register_receiver(SIGNED_TEXT_CHAT, self.receive_signed_message, mailbox_size=8)
+        register_receiver(SIGNED_TEXT_CHAT_EC, self.receive_signed_message, mailbox_size=8)
 
     def switch_to_foreground(self):
         super().switch_to_foreground()
@@ -153,9 +178,11 @@ class ChatApp(BaseApp):
             if self.badge.keyboard.f1():  # Send
                 if self.page.text_box.get_text():
                     message_text = self.page.close_text_box()
-                    self.send(message_text)
                     self.compose_active = False
-                    self.page.infobar_right.set_text("Hackaday Chat")
+                    if self.send(message_text) == SEND_REJECTED:
+                        self.page.infobar_right.set_text("Network busy, not sent")
+                    else:
+                        self.page.infobar_right.set_text("Hackaday Chat")
 
 
         if self.freq_picker_active:
@@ -265,7 +292,30 @@ class ChatApp(BaseApp):
         ) & self.refresh_counter_divider_factor
 
     def send(self, text):
-        chat_message = ChatMessage(MY_ADDRESS, self.my_alias, text, False)
+        channel_num = self.active_channel
+        encoded = text
+        if self.chat_compress:
+            # compress() gives up (None) when it wouldn't save anything, then the text goes raw
+            compressed = compress(text)
+            if compressed is not None:
+                channel_num |= CHAT_COMPRESSED
+                encoded = compressed
+        signed = self._signed(channel_num, encoded) if self.chat_sign else None
+        if signed:
+            protocol, payload = signed
+        else:
+            protocol, payload = TEXT_CHAT, (channel_num, self.my_alias[:10], encoded)
+        tx_message = NetworkFrame().set_fields(
+            protocol=protocol,
+            destination=BROADCAST_ADDRESS,
+            ttl=self.chat_ttl,
+            payload=payload,
+        )
+        status = send(tx_message)
+        if status == SEND_REJECTED:
+            # Transmit queue is full, don't show it in the channel as if it was sent
+            return status
+        chat_message = ChatMessage(MY_ADDRESS, self.my_alias, text, signed is not None)
         if self.active_channel in self.channels:
             self.channels[self.active_channel].append(chat_message)
         else:
@@ -273,10 +323,23 @@ class ChatApp(BaseApp):
                 [chat_message], self.channel_buffer_len
             )
         self.channel_messages_updated = True
-        tx_message = NetworkFrame().set_fields(
-            protocol=TEXT_CHAT,
-            destination=BROADCAST_ADDRESS,
-            ttl=self.chat_ttl,
-            payload=(self.active_channel, self.my_alias[:10], text),
-        )
-        send(tx_message)
+        return status
+
+    def _signed(self, channel_num: int, encoded):
+        """Protocol and payload of the message signed with the badge's key: SIGNED_TEXT_CHAT_EC for an
+        elliptic curve key, SIGNED_TEXT_CHAT for RSA. None if the keys aren't loaded yet, or the text
+        is too long for the RSA protocol's field, then it goes unsigned."""
+        crypto = self.badge.crypto
+        if not crypto.can_sign:
+            return None
+        if crypto.key_type == KEY_EC:
+            protocol, text_len = SIGNED_TEXT_CHAT_EC, MAX_MESSAGE_LEN
+        else:
+            protocol, text_len = SIGNED_TEXT_CHAT, MAX_SIGNED_RSA_LEN
+        if isinstance(encoded, str):
+            encoded = encoded.encode()
+        if len(encoded) > text_len:
+            return None
+        # Receivers verify the text field as it decodes, zero padded to its full length
+        text = encoded + bytes(text_len - len(encoded))
+        return protocol, (channel_num, self.my_alias[:10], crypto.sign(text), text)
@@ -3,7 +3,7 @@
 import struct
 from apps.base_app import BaseApp
 
-from net.net import register_receiver, send, BROADCAST_ADDRESS
+from net.net import register_receiver, send, BROADCAST_ADDRESS, MAILBOX_DROP_NEWEST, TX_CLASS_BULK
 from net.protocols import NetworkFrame, Protocol
 from ui.page import Page
 
@@ -22,10 +22,10 @@ class ConfigManager(BaseApp):
         self.cursor_pos: int = 0
         self.edit_active = False
 
-    def _override_config_value(self, message: NetworkFrame):
+    async def _override_config_value(self, message: NetworkFrame):
         signature, key, value = message.payload
         kv_bytes = key + value
-        signed = self.badge.crypto.verify(kv_bytes, signature)
+        signed = await self.badge.verifier.verify(kv_bytes, signature)
         print(f"Got config override message: {key}:{value} Signed: {signed}")
         if not signed:
             return
@@ -47,11 +47,14 @@ class ConfigManager(BaseApp):
                     destination=BROADCAST_ADDRESS,
                     ttl=15,
                     payload=(signature, key, value),
-                )
+                ),
+                TX_CLASS_BULK,
             )
 
     def start(self):
-        register_receiver(CONFIG_OVERRIDE, self._override_config_value)
+        # Verifying and saving to flash is slow, so overrides are handled in their own task.
+        # If a flood fills the mailbox, the overrides already waiting are kept and applied in order.
+        register_receiver(CONFIG_OVERRIDE, self._override_config_value, mailbox_size=4, overflow=MAILBOX_DROP_NEWEST)
         return super().start()
 
     def _reload_config(self):
@@ -87,7 +90,7 @@ class ConfigManager(BaseApp):
                 )
                 self.page.infobar_right.set_text("Go Home to Save, Reboot to Load")
                 self.edit_active = False
-            if self.badge.keyboard.f3() and self.badge.crypto.private_key is not None:  # Send override
+            if self.badge.keyboard.f3() and self.badge.crypto.can_sign:  # Send override
                 key = self.config[self.cursor_pos][0]
                 value = self.page.close_text_box()
                 self._send_override(key, value)
@@ -121,7 +124,7 @@ class ConfigManager(BaseApp):
                 try:
                     int(self.config[self.cursor_pos][1])
                     print("Not allowed to edit numeric configs, sorry")
-                    if self.badge.crypto.private_key is not None:
+                    if self.badge.crypto.can_sign:
                         raise ValueError(42)
                 except ValueError:
                     self.page.create_text_box(
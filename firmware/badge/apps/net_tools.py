@@ -4,7 +4,7 @@ from collections import deque
 import time
 
 from apps.base_app import BaseApp
-from net.net import register_receiver, send, MY_ADDRESS, BROADCAST_ADDRESS
+from net.net import badgenet, register_receiver, send, MY_ADDRESS, BROADCAST_ADDRESS, TX_CLASS_CONTROL
 from net.protocols import NetworkFrame, Protocol
 
 
@@ -56,7 +56,8 @@ class NetTools(BaseApp):
                         destination=message.payload[0],
                         ttl=7,
                         payload=(MY_ADDRESS, message.ttl, message.payload[1], self.last_rssi, self.last_snr),
-                    )
+                    ),
+                    TX_CLASS_CONTROL,
                 )
             elif message.port == PONG.port:
                 self.last_ping_responder, self.last_pings_ttl, self.pong_counter, self.last_pings_rssi, self.last_pings_snr = message.payload
@@ -93,6 +94,12 @@ class NetTools(BaseApp):
         self.last_pings_snr_label.set_text(f"Last Sent Ping Recevied SNR: {self.last_pings_snr}")
         self.last_pong_rssi_label.set_text(f"Last Ping Response RSSI: {self.last_pong_rssi}")
         self.last_pong_snr_label.set_text(f"Last Ping Response SNR: {self.last_pong_snr}")
+        neighbors = badgenet.neighbors
+        prr = neighbors.prr(self.last_ping_sender)
+        self.neighbors_label.set_text(
+            f"Neighbors: {len(neighbors)} heard, {len(neighbors.addresses(max_hops=0))} direct"
+            + (f"   Ping Source PRR: {int(prr * 100)}% Hops: {neighbors.hops(self.last_ping_sender)}" if prr is not None else "")
+        )
 
     def send_ping(self):
         # print("Sending a ping...")
@@ -121,4 +128,5 @@ class NetTools(BaseApp):
         self.last_pings_snr_label = self.badge.display.text(self.badge.display.CHAR_HEIGHT * 7, 0, "Last Sent Ping Recevied SNR:")
         self.last_pong_rssi_label = self.badge.display.text(self.badge.display.CHAR_HEIGHT * 8, 0, "Last Ping Response RSSI:")
         self.last_pong_snr_label = self.badge.display.text(self.badge.display.CHAR_HEIGHT * 9, 0, "Last Ping Response SNR:")
+        self.neighbors_label = self.badge.display.text(self.badge.display.CHAR_HEIGHT * 10, 0, "Neighbors:")
         return super().switch_to_foreground()
\ No newline at end of file
@@ -1,12 +1,14 @@
 import asyncio as aio
+import time
 from machine import I2C
 
 from hardware import board
 from hardware.datafile import Config
 from hardware.display import Display
 from hardware.keyboard import Keyboard
-from net.lora import LoraRadio
-from net.crypto import Crypto
+from net.lora import LoraRadio, POWER_CONTINUOUS, POWER_MODE_NAMES
+from net.crypto import Crypto, VerificationService
+from net import protocols
 
 
 badge_obj = None  # Singleton reference for use in the python shell for debugging
@@ -22,6 +24,9 @@ class Badge:
         if badge_obj is not None:
             return
         badge_obj = self
+        # Milliseconds each part of starting up took, in order, see boot_report()
+        self.boot_ms: list[tuple[str, int]] = []
+        start = time.ticks_ms()
 
         # Load badge config settings
         self.config = Config()
@@ -39,8 +44,24 @@ class Badge:
             self.config.set("radio_tx_power", b'9')
         if "chat_ttl" not in self.config.db.keys():
             self.config.set("chat_ttl", b'3')
+        if "chat_compress" not in self.config.db.keys():
+            self.config.set("chat_compress", b'false')
+        if "chat_sign" not in self.config.db.keys():
+            self.config.set("chat_sign", b'false')
+        if "trim_payloads" not in self.config.db.keys():
+            self.config.set("trim_payloads", b'false')
+        if "aggregate_frames" not in self.config.db.keys():
+            self.config.set("aggregate_frames", b'false')
+        if "route_unicasts" not in self.config.db.keys():
+            self.config.set("route_unicasts", b'false')
         if "send_cooldown_ms" not in self.config.db.keys():
             self.config.set("send_cooldown_ms", b'1')
+        if "radio_power_mode" not in self.config.db.keys():
+            self.config.set("radio_power_mode", b'continuous')  # continuous, duty_cycle or sleep
+        if "radio_low_power_mesh" not in self.config.db.keys():
+            self.config.set("radio_low_power_mesh", b'false')
+
+        start = self._boot_phase("config", start)
 
         print("Initializing badge hardware...")
         # Reserve controller 0 for the SAO header so it never collides with the keyboard bus.
@@ -53,16 +74,42 @@ class Badge:
             self.send_cooldown_ms = int(self.config.get("send_cooldown_ms"))
         except ValueError:
             self.send_cooldown_ms = 1
+        # Only once every badge around runs firmware that decodes trimmed frames
+        protocols.TRIM_PAYLOADS = self.config.get("trim_payloads") in (b"1", b"true", b"True")
         self.lora: LoraRadio = LoraRadio(board.DEBUG_LED, tx_power=tx_power)
+        power_mode = self.config.get("radio_power_mode").decode()
+        self.lora.set_power_mode(
+            POWER_MODE_NAMES.index(power_mode) if power_mode in POWER_MODE_NAMES else POWER_CONTINUOUS,
+            self.config.get("radio_low_power_mesh") in (b"1", b"true", b"True"),
+        )
+        start = self._boot_phase("radio", start)
         self.display: Display = Display()
         self.display.backlight.duty(500)
+        start = self._boot_phase("display", start)
         self.keyboard: Keyboard = Keyboard()
+        start = self._boot_phase("keyboard", start)
 
+        # Keys are loaded on first use, or in the background once the badge is up
         self.crypto = Crypto()
+        self.crypto_task = aio.create_task(self.crypto.validate_later())
+        # Apps check signatures on received messages through this, so repeats come from its cache
+        self.verifier = VerificationService(self.crypto)
+        self._boot_phase("crypto", start)
+        print(self.boot_report())
 
         # Create task to run to check hardware, and update singleton reference
         self.task = aio.create_task(self.run())
 
+    def _boot_phase(self, name: str, start: int) -> int:
+        """Record the time since `start` as boot phase `name`, returns the time now to start the next one."""
+        now = time.ticks_ms()
+        self.boot_ms.append((name, time.ticks_diff(now, start)))
+        return now
+
+    def boot_report(self) -> str:
+        phases = ", ".join(f"{name} {ms} ms" for name, ms in self.boot_ms)
+        return f"Badge hardware up in {sum(ms for _, ms in self.boot_ms)} ms: {phases}"
+
     async def run(self):
         print("Running badge task...")
         while True:
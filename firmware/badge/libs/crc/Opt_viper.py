@@ -67,7 +67,7 @@ def _crc64_tr(crc, data, n, tab):
     _crc64_h(acrc, data, n, tab)
     return acrc[0]
 
-import crc
+from libs import crc
 crc.Implementation = 'viper'
 crc._crc8_tr  = _crc8_tr
 crc._crc16_tr = _crc16_tr
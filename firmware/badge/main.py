@@ -23,9 +23,14 @@ except Exception as ex:
 
 
 async def main():
+    start = time.ticks_ms()
     print("Initializing main...")
     badge = Badge()
     badgenet.init(badge)
+    # Containers only once every badge around runs firmware that unpacks them
+    badgenet.aggregate_frames = badge.config.get("aggregate_frames") in (b"1", b"true", b"True")
+    # Off unless configured, most replies in a hall go to a badge in range and gain nothing from it
+    badgenet.route_unicasts = badge.config.get("route_unicasts") in (b"1", b"true", b"True")
     # Link them into the menu system here, for starters
     user_apps = [
         userA.App("User A", badge),
@@ -62,7 +67,7 @@ async def main():
 
     # To capture all network packets for debugging, set to True
     capture_all_packets(False)
-    print("Badge is up and running!")
+    print(f"Badge is up and running! {time.ticks_diff(time.ticks_ms(), start)} ms after main() started")
     print("If you want the Python REPL, try one Ctrl-C or one Ctrl-D")
 
     while True:
@@ -0,0 +1,24 @@
+# Viper CRC-16/XMODEM for net.crc16, in its own module so firmware built without the viper
+# emitter fails importing it instead of failing to compile net.crc16.
+
+
+# --- arguments ---
+# .. crc to continue from, 0 for a new one
+# .. data to be processed (only 8-bit address is used)
+# .. n length of data
+# .. tab, 4 lookup tables of 256 entries: a byte followed by 0, 1, 2 and 3 zero bytes
+@micropython.viper
+def crc16_s4(crc: int, data: ptr8, n: int, tab: ptr16) -> int:
+    i: int = 0
+    while i < n - 3:
+        crc = (
+            tab[768 + ((crc >> 8) ^ data[i])]
+            ^ tab[512 + ((crc & 0xFF) ^ data[i + 1])]
+            ^ tab[256 + data[i + 2]]
+            ^ tab[data[i + 3]]
+        )
+        i += 4
+    while i < n:
+        crc = ((crc << 8) & 0xFFFF) ^ tab[(crc >> 8) ^ data[i]]
+        i += 1
+    return crc
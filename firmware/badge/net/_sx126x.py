@@ -16,6 +16,7 @@ def yield_():
 
 SX126X_FREQUENCY_STEP_SIZE = 0.9536743164
 SX126X_MAX_PACKET_LENGTH = const(255)
+SX126X_SPI_BUFFER_SIZE = const(258)  # Longest SPI transaction, ReadBuffer: opcode, offset, status, 255 bytes
 SX126X_CRYSTAL_FREQ = 32.0
 SX126X_DIV_EXPONENT = const(25)
 SX126X_CMD_NOP = const(0x00)
@@ -0,0 +1,148 @@
+"""Airtime accounting and rate limiting for the shared LoRa channel.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+import time
+
+DEFAULT_PORT_DUTY_PCT = 2  # Sustained share of the channel any one protocol port may use from this badge
+DEFAULT_PORT_BURST_MS = 500  # Airtime a port can use at once after being quiet, ~10 chat messages
+DEFAULT_RELAY_DUTY_PCT = 25  # Sustained share of the channel for repeating other badges' messages
+DEFAULT_RELAY_BURST_MS = 2000
+UTILISATION_WINDOW_MS = 10000  # Channel utilisation is measured over the last 1-2 windows
+
+
+class TokenBucket:
+    """Token bucket holding milliseconds of airtime.
+    Refills at `duty_pct` percent of wall clock time, up to `burst_ms`."""
+
+    def __init__(self, duty_pct: float, burst_ms: int):
+        self.duty_pct = duty_pct
+        self.burst_ms = burst_ms
+        self.tokens_ms = burst_ms
+        self.last_refill = time.ticks_ms()
+        self.spent_ms = 0  # Airtime charged to this bucket
+        self.refused = 0  # Frames refused for lack of tokens
+
+    def _refill(self):
+        now = time.ticks_ms()
+        elapsed_ms = time.ticks_diff(now, self.last_refill)
+        if elapsed_ms > 0:
+            self.tokens_ms = min(self.burst_ms, self.tokens_ms + elapsed_ms * self.duty_pct / 100)
+            self.last_refill = now
+
+    def spend(self, airtime_ms: float) -> bool:
+        """Take `airtime_ms` from the bucket if there's enough, otherwise count a refusal and return False."""
+        self._refill()
+        if self.tokens_ms < airtime_ms:
+            self.refused += 1
+            return False
+        self.tokens_ms -= airtime_ms
+        self.spent_ms += airtime_ms
+        return True
+
+    def __repr__(self):
+        return (
+            f"TokenBucket({self.duty_pct}% burst:{self.burst_ms}ms tokens:{self.tokens_ms:.0f}ms "
+            f"spent:{self.spent_ms:.0f}ms refused:{self.refused})"
+        )
+
+
+class AirtimeAccountant:
+    """Charges frames their time on air against per-port and relay token buckets,
+    and keeps track of how busy the channel is.
+
+    `time_on_air_us` is the radio's time on air function for a frame length in bytes.
+    Results are cached per length, since asking the radio costs an SPI transaction.
+    """
+
+    def __init__(self, time_on_air_us=None):
+        self._time_on_air_us = time_on_air_us
+        self._time_on_air_ms: list = [None] * 256
+        self.port_buckets: dict[int, TokenBucket] = {}
+        self.port_limits: dict[int, tuple] = {}  # port: (duty_pct, burst_ms), if not the default
+        self.relay_bucket = TokenBucket(DEFAULT_RELAY_DUTY_PCT, DEFAULT_RELAY_BURST_MS)
+        self.tx_ms = 0.0  # Total airtime transmitted by this badge
+        self.rx_ms = 0.0  # Total airtime of frames received from other badges
+        # Airtime heard or sent in the current and previous utilisation windows
+        self._window_start = time.ticks_ms()
+        self._window_ms = 0.0
+        self._last_window_ms = 0.0
+        self._last_window_span_ms = 0
+
+    def set_radio(self, time_on_air_us):
+        """Use a new time on air function, e.g. after changing radio settings."""
+        self._time_on_air_us = time_on_air_us
+        self._time_on_air_ms = [None] * 256
+
+    def time_on_air_ms(self, length: int) -> float:
+        airtime_ms = self._time_on_air_ms[length]
+        if airtime_ms is None:
+            airtime_ms = self._time_on_air_us(length) / 1000 if self._time_on_air_us else 0.0
+            self._time_on_air_ms[length] = airtime_ms
+        return airtime_ms
+
+    def set_port_limit(self, port: int, duty_pct: float, burst_ms: int):
+        """Change the airtime allowed for one protocol port, e.g. to let a bulk transfer protocol burst more."""
+        self.port_limits[port] = (duty_pct, burst_ms)
+        self.port_buckets[port] = TokenBucket(duty_pct, burst_ms)
+
+    def _port_bucket(self, port: int) -> TokenBucket:
+        bucket = self.port_buckets.get(port)
+        if bucket is None:
+            duty_pct, burst_ms = self.port_limits.get(port, (DEFAULT_PORT_DUTY_PCT, DEFAULT_PORT_BURST_MS))
+            bucket = TokenBucket(duty_pct, burst_ms)
+            self.port_buckets[port] = bucket
+        return bucket
+
+    def admit(self, port: int, length: int) -> bool:
+        """Charge a locally originated frame to its port's budget. False if the port is over budget."""
+        return self._port_bucket(port).spend(self.time_on_air_ms(length))
+
+    def admit_relay(self, length: int) -> bool:
+        """Charge a relayed frame to the relay budget. False if this badge is relaying too much."""
+        return self.relay_bucket.spend(self.time_on_air_ms(length))
+
+    def _add_to_window(self, airtime_ms: float):
+        now = time.ticks_ms()
+        elapsed_ms = time.ticks_diff(now, self._window_start)
+        if elapsed_ms >= UTILISATION_WINDOW_MS:
+            if elapsed_ms < 2 * UTILISATION_WINDOW_MS:
+                self._last_window_ms = self._window_ms
+                self._last_window_span_ms = elapsed_ms
+            else:
+                # Nothing happened for a whole window, so the old one is too stale to count
+                self._last_window_ms = 0.0
+                self._last_window_span_ms = 0
+            self._window_ms = 0.0
+            self._window_start = now
+        self._window_ms += airtime_ms
+
+    def record_tx(self, length: int):
+        """Count a frame this badge transmitted."""
+        airtime_ms = self.time_on_air_ms(length)
+        self.tx_ms += airtime_ms
+        self._add_to_window(airtime_ms)
+
+    def record_rx(self, length: int):
+        """Count a frame heard from another badge."""
+        airtime_ms = self.time_on_air_ms(length)
+        self.rx_ms += airtime_ms
+        self._add_to_window(airtime_ms)
+
+    def channel_utilisation_pct(self) -> float:
+        """Percent of the recent past the channel was busy with frames this badge sent or heard.
+        Frames that collided or were too weak to decode aren't counted, so this is a lower bound."""
+        self._add_to_window(0.0)
+        elapsed_ms = time.ticks_diff(time.ticks_ms(), self._window_start)
+        span_ms = elapsed_ms + self._last_window_span_ms
+        if span_ms <= 0:
+            return 0.0
+        return min(100.0, 100 * (self._window_ms + self._last_window_ms) / span_ms)
+
+    def __repr__(self):
+        return (
+            f"AirtimeAccountant(utilisation:{self.channel_utilisation_pct():.1f}% tx:{self.tx_ms:.0f}ms "
+            f"rx:{self.rx_ms:.0f}ms relay:{self.relay_bucket} ports:{self.port_buckets})"
+        )
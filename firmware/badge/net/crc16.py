@@ -0,0 +1,90 @@
+"""CRC-16/XMODEM of frames, computed by the fastest implementation this Python has.
+
+crc16_xmodem(buf) takes bytes, a bytearray or a memoryview and keeps no state between calls. At
+import, the first of these that gives the right CRC for the standard check string is picked:
+- "binascii": binascii.crc_hqx() with an initial value of 0 is the same CRC, in C. CPython has it,
+  Micropython only if the port enables it.
+- "viper": slice-by-4 table lookup, compiled to machine code by Micropython's viper emitter. It
+  takes 4 bytes per step with 2KB of tables.
+- "bytecode": one table lookup per byte in plain Python.
+`BACKENDS` has every implementation that passed, for benchmarking them (`bench_net.py crc`).
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+from array import array
+
+CRC16_XMODEM_POLY = 0x1021
+CRC16_XMODEM_CHECK = 0x31C3  # CRC of b"123456789"
+
+
+def _make_tables() -> array:
+    """Lookup tables for a byte followed by 0, 1, 2 and 3 zero bytes, one after the other."""
+    tab = array("H", (0 for _ in range(1024)))
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC16_XMODEM_POLY if crc & 0x8000 else crc << 1) & 0xFFFF
+        tab[i] = crc
+    for i in range(256, 1024):
+        crc = tab[i - 256]
+        tab[i] = ((crc << 8) & 0xFFFF) ^ tab[crc >> 8]
+    return tab
+
+
+_TABLES = _make_tables()
+# The first table byte swapped, so the bytecode loop can keep the CRC byte swapped and save a mask per byte
+_SWAPPED = array("H", ((crc >> 8) | (crc & 0xFF) << 8 for crc in _TABLES[:256]))
+
+
+def _crc16_bytecode(buf) -> int:
+    tab = _SWAPPED
+    crc = 0
+    for byte in buf:
+        crc = (crc >> 8) ^ tab[(crc & 0xFF) ^ byte]
+    return (crc >> 8) | (crc & 0xFF) << 8
+
+
+def selftest(crc_function) -> bool:
+    """Whether `crc_function` computes CRC-16/XMODEM, checked on the standard check string."""
+    try:
+        # Frames are checked through memoryviews that don't start at the beginning of their buffer
+        offset = memoryview(b"x123456789")[1:]
+        return crc_function(b"123456789") == CRC16_XMODEM_CHECK and crc_function(offset) == CRC16_XMODEM_CHECK
+    except Exception:
+        return False
+
+
+BACKEND_ORDER = ("binascii", "viper", "bytecode")  # Fastest first
+BACKENDS = {}  # name: crc function
+
+try:
+    from binascii import crc_hqx
+
+    def _crc16_binascii(buf) -> int:
+        return crc_hqx(buf, 0)
+
+    BACKENDS["binascii"] = _crc16_binascii
+except ImportError:
+    pass
+
+try:
+    from net._crc16_viper import crc16_s4
+
+    def _crc16_viper(buf) -> int:
+        return crc16_s4(0, buf, len(buf), _TABLES)
+
+    BACKENDS["viper"] = _crc16_viper
+except (ImportError, NameError, SyntaxError):
+    pass
+
+BACKENDS["bytecode"] = _crc16_bytecode
+
+for _name in list(BACKENDS):
+    if not selftest(BACKENDS[_name]):
+        print(f"crc16: {_name} implementation failed its self test, not using it")
+        del BACKENDS[_name]
+
+CRC16_BACKEND = [name for name in BACKEND_ORDER if name in BACKENDS][0]
+crc16_xmodem = BACKENDS[CRC16_BACKEND]
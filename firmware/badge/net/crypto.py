@@ -1,42 +1,382 @@
 """Helper logic for dealing with signed messages"""
 
+from collections import deque
+import hashlib
+import sys
+import time
+import asyncio as aio  # type: ignore
+
 from cryptography import hashes, padding, serialization
 
+from net.stats import LatencyStats
+from net.verdicts import VerdictCache, verdict_key, DEFAULT_VERDICT_CACHE_SIZE
+
+KEY_RSA = "rsa"
+KEY_EC = "ec"
+EC_SIGNATURE_LEN = 64  # r and s of a P-256 ECDSA signature, 32 bytes each
+VALIDATE_DELAY_MS = 5000  # How long after boot Crypto.validate_later() loads the keys
+
+# Algorithm OIDs as they appear in DER key files (tag, length, value)
+_OID_RSA_ENCRYPTION = b"\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x01\x01"  # 1.2.840.113549.1.1.1
+_OID_EC_PUBLIC_KEY = b"\x06\x07\x2a\x86\x48\xce\x3d\x02\x01"  # 1.2.840.10045.2.1
+_OID_P256 = b"\x06\x08\x2a\x86\x48\xce\x3d\x03\x01\x07"  # 1.2.840.10045.3.1.7, prime256v1
+
+# DER tags
+_INTEGER = 0x02
+_OCTET_STRING = 0x04
+_OID = 0x06
+_SEQUENCE = 0x30
+_EC_PARAMETERS = 0xA0  # [0], the curve of a SEC1 private key
+
+
+def _der_element(der: bytes, start: int, tag: int) -> tuple[int, int]:
+    """(start of the value, end) of the DER element at `start`, which must have this tag."""
+    if start + 2 > len(der) or der[start] != tag:
+        raise ValueError("Unexpected DER structure in key")
+    length = der[start + 1]
+    pos = start + 2
+    if length & 0x80:  # Long form, the next (length & 0x7F) bytes are the length
+        count = length & 0x7F
+        length = int.from_bytes(der[pos : pos + count], "big")
+        pos += count
+    if pos + length > len(der):
+        raise ValueError("Truncated DER key")
+    return pos, pos + length
+
+
+def _algorithm(der: bytes, start: int) -> str:
+    """Key type of the AlgorithmIdentifier, SEQUENCE { OID, parameters }, at `start`."""
+    pos, end = _der_element(der, start, _SEQUENCE)
+    _, oid_end = _der_element(der, pos, _OID)
+    oid = der[pos:oid_end]
+    if oid == _OID_RSA_ENCRYPTION:
+        return KEY_RSA
+    if oid == _OID_EC_PUBLIC_KEY:
+        # The parameters name the curve
+        if der[oid_end:end] != _OID_P256:
+            raise ValueError("Only P-256 elliptic curve keys are supported")
+        return KEY_EC
+    raise ValueError("Unsupported key algorithm")
+
+
+def key_type(der: bytes) -> str:
+    """KEY_RSA or KEY_EC, for a DER public key (SubjectPublicKeyInfo) or private key (PKCS#1,
+    SEC1 or PKCS#8), read from the fields that say so in each format:
+    - SubjectPublicKeyInfo: SEQUENCE { AlgorithmIdentifier, BIT STRING }
+    - PKCS#8: SEQUENCE { INTEGER 0, AlgorithmIdentifier, OCTET STRING }
+    - SEC1: SEQUENCE { INTEGER 1, OCTET STRING, [0] curve OID, ... }
+    - PKCS#1: SEQUENCE { INTEGER 0, INTEGER n, ... }, which doesn't name its algorithm but is only RSA
+    """
+    pos, _ = _der_element(der, 0, _SEQUENCE)
+    if pos < len(der) and der[pos] == _SEQUENCE:
+        return _algorithm(der, pos)
+    _, pos = _der_element(der, pos, _INTEGER)  # Version
+    if pos < len(der) and der[pos] == _SEQUENCE:
+        return _algorithm(der, pos)
+    if pos < len(der) and der[pos] == _INTEGER:
+        return KEY_RSA
+    _, pos = _der_element(der, pos, _OCTET_STRING)  # The SEC1 private key itself
+    curve, end = _der_element(der, pos, _EC_PARAMETERS)
+    if der[curve:end] != _OID_P256:
+        raise ValueError("Only P-256 elliptic curve keys are supported")
+    return KEY_EC
+
+
+class RsaPss:
+    """RSA signatures with PSS padding and SHA-256, as long as the key (128 bytes for RSA-1024)."""
+
+    def __init__(self):
+        # The padding and hash only describe the algorithm, so one of each serves every sign and verify
+        self._hash = hashes.SHA256()
+        self._padding = padding.PSS(mgf=padding.MGF1(self._hash), salt_length=self._hash.digest_size)
+
+    def sign(self, private_key, message) -> bytes:
+        return private_key.sign(message, self._padding, self._hash)
+
+    def verify(self, public_key, message, signature):
+        """Raises an exception if the signature doesn't match."""
+        public_key.verify(signature, message, self._padding, self._hash)
+
+
+class EcdsaP256:
+    """ECDSA signatures on the P-256 curve with SHA-256. The library gives DER encoded signatures of
+    70-72 bytes, they're sent as just r and s, EC_SIGNATURE_LEN bytes."""
+
+    def __init__(self):
+        # Firmware built without elliptic curves can still use RSA keys
+        from cryptography import ec, utils
+
+        self._ecdsa = ec.ECDSA(hashes.SHA256())
+        self._utils = utils
+
+    def sign(self, private_key, message) -> bytes:
+        r, s = self._utils.decode_dss_signature(private_key.sign(message, self._ecdsa))
+        return r.to_bytes(32, "big") + s.to_bytes(32, "big")
+
+    def verify(self, public_key, message, signature):
+        """Raises an exception if the signature doesn't match. Signatures in fields sized for RSA
+        arrive zero padded, anything but zeros after the first EC_SIGNATURE_LEN bytes is rejected,
+        so there's only one signature field that verifies for each signature."""
+        if len(signature) < EC_SIGNATURE_LEN:
+            raise ValueError("Signature too short")
+        if any(signature[EC_SIGNATURE_LEN:]):
+            raise ValueError("Signature has extra bytes")
+        r = int.from_bytes(signature[:32], "big")
+        s = int.from_bytes(signature[32:EC_SIGNATURE_LEN], "big")
+        public_key.verify(self._utils.encode_dss_signature(r, s), message, self._ecdsa)
+
+
+SIGNATURE_SCHEMES = {KEY_RSA: RsaPss, KEY_EC: EcdsaP256}
+
+
 class Crypto:
+    """Signs and verifies with the badge's key pair, RSA or elliptic curve depending on the key files.
 
-    def __init__(self, key_name=None):
+    Keys are loaded on first use, not at construction: the public key by the first verify(), the
+    private key by the first sign(). `can_sign` only reports what loading found, so the UI can ask
+    without waiting for it. A private key is only used once a sign then verify self check has passed. The result is saved next to the keys under a hash of both key
+    files, so the check only runs again when the keys change. validate_later() loads both keys in
+    the background after boot. `load_ms` has the time each step took.
+    """
+
+    def __init__(self, key_name=None, key_dir: str = "/data"):
         key_name = key_name or "supercon"
-        with open(f"/data/{key_name}_public.der", "rb") as public_key_file:
-            self.public_key = serialization.load_der_public_key(public_key_file.read())
+        self._public_path = f"{key_dir}/{key_name}_public.der"
+        self._private_path = f"{key_dir}/{key_name}_private.der"
+        self._check_path = f"{key_dir}/{key_name}_selfcheck"  # Hash of the key files + result
+        self._key_type = None
+        self._scheme = None
+        self._public_key = None
+        self._public_hash = None
+        self._private_key = None
+        self._private_ok = None  # Whether there's a usable private key, None until loaded
+        self.load_ms = {}  # ms by step: "public", "private" and "self_check" (not run if cached)
+
+    @property
+    def key_type(self) -> str | None:
+        """KEY_RSA or KEY_EC, None if there's no usable public key."""
         try:
-            with open(f"/data/{key_name}_private.der", "rb") as private_key_file:
-                self.private_key = serialization.load_der_private_key(private_key_file.read(), None)
-            if not self.verify("key self check", self.sign("key self check")):
-                self.private_key = None
+            self._load_public()
+        except (OSError, ValueError):
+            return None
+        return self._key_type
+
+    @property
+    def scheme(self):
+        self._load_public()
+        return self._scheme
+
+    @property
+    def public_key(self):
+        self._load_public()
+        return self._public_key
+
+    @property
+    def private_key(self):
+        self._load_private()
+        return self._private_key
+
+    @property
+    def can_sign(self) -> bool:
+        """Whether sign() will work. False until the keys have been loaded, by validate_later() a few
+        seconds after boot, or validate() or sign(), so asking never stalls on loading them."""
+        return self._private_ok is True
+
+    def _load_public(self):
+        if self._public_key is not None:
+            return
+        start = time.ticks_ms()
+        with open(self._public_path, "rb") as public_key_file:
+            public_der = public_key_file.read()
+        self._key_type = key_type(public_der)
+        self._scheme = SIGNATURE_SCHEMES[self._key_type]()
+        self._public_hash = hashlib.sha256(public_der).digest()
+        self._public_key = serialization.load_der_public_key(public_der)
+        self.load_ms["public"] = time.ticks_diff(time.ticks_ms(), start)
+
+    def _load_private(self) -> bool:
+        """Load the private key if there's one that passes the self check. Returns whether there is."""
+        if self._private_ok is not None:
+            return self._private_ok
+        try:
+            self._load_public()
+        except (OSError, ValueError) as ex:
+            print(f"No usable public key, unable to cryptographically sign: {ex}")
+            self._private_ok = False
+            return False
+        start = time.ticks_ms()
+        try:
+            with open(self._private_path, "rb") as private_key_file:
+                private_der = private_key_file.read()
         except OSError:
             # print("No private key on this badge, unable to cryptographically sign")
-            self.private_key = None
+            self._private_ok = False
+            return False
+        if key_type(private_der) != self._key_type:
+            print("Private key isn't the same type as the public key, unable to cryptographically sign")
+            self._private_ok = False
+            return False
+        digest = hashlib.sha256(self._public_hash)
+        digest.update(private_der)
+        digest = digest.digest()
+        checked = self._cached_check(digest)
+        if checked is False:
+            self._private_ok = False
+            return False
+        private_key = serialization.load_der_private_key(private_der, None)
+        self.load_ms["private"] = time.ticks_diff(time.ticks_ms(), start)
+        if checked is None:
+            start = time.ticks_ms()
+            message = b"key self check"
+            checked = self.verify(message, self._scheme.sign(private_key, message))
+            self.load_ms["self_check"] = time.ticks_diff(time.ticks_ms(), start)
+            self._save_check(digest, checked)
+        self._private_key = private_key if checked else None
+        self._private_ok = checked
+        return checked
+
+    def _cached_check(self, digest: bytes):
+        """The saved self check result for key files with this hash, None if there isn't one."""
+        try:
+            with open(self._check_path, "rb") as check_file:
+                saved = check_file.read()
+        except OSError:
+            return None
+        if len(saved) != len(digest) + 1 or saved[: len(digest)] != digest:
+            return None
+        return saved[-1] == 1
+
+    def _save_check(self, digest: bytes, passed: bool):
+        try:
+            with open(self._check_path, "wb") as check_file:
+                check_file.write(digest + (b"\x01" if passed else b"\x00"))
+        except OSError as ex:
+            print(f"Unable to save the key self check: {ex}")
+
+    def validate(self) -> bool:
+        """Load both keys and self check the private one now. Returns whether signing works."""
+        return self._load_private()
+
+    async def validate_later(self, delay_ms: int = VALIDATE_DELAY_MS):
+        """validate() once the badge has finished booting, so the first signature doesn't wait for it."""
+        await aio.sleep_ms(delay_ms)
+        try:
+            self.validate()
+        except Exception as ex:
+            print("Exception loading keys")
+            sys.print_exception(ex)
+        print(f"Keys loaded in the background: {self.load_ms}")
 
     def sign(self, message):
-        if self.private_key is None:
+        if not self._load_private():
             raise ValueError("No private key on this badge, unable to cryptographically sign.")
-        signature = self.private_key.sign(
-            message,
-            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), 
-                        salt_length=hashes.SHA256().digest_size),
-            hashes.SHA256()
-        )
+        signature = self._scheme.sign(self._private_key, message)
         return signature
 
     def verify(self, message, signature):
         try:
-            self.public_key.verify(
-                signature,
-                message,
-                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), 
-                            salt_length=hashes.SHA256().digest_size),
-                hashes.SHA256()
-            )
+            self._load_public()
+            self._scheme.verify(self._public_key, message, signature)
             return True
         except:
             return False
+
+
+class VerificationService:
+    """Verifies signatures in a background task, remembering the results.
+
+    A signature only needs checking once: copies of the same signed message relayed by other
+    badges are answered from the cache. New signatures are queued for the worker task, so a
+    burst of signed messages is verified one at a time between other tasks, and callers await
+    the result (or get a callback) instead of blocking whoever received the frame.
+    """
+
+    def __init__(self, crypto: Crypto, cache_size: int = DEFAULT_VERDICT_CACHE_SIZE, queue_size: int = 16):
+        self.crypto = crypto
+        self.cache = VerdictCache(cache_size)
+        self.queue_size = queue_size
+        self.queue: deque = deque([], queue_size)
+        self._waiting: dict[bytes, list] = {}  # key: callbacks for a signature queued or being verified
+        self.verify_ms = LatencyStats()  # Time for each real verification
+        self.queued = 0
+        self.shared = 0  # Requests answered by a verification already queued for the same signature
+        self.inline = 0  # Verified in the caller because the queue was full
+        self._ready = aio.Event()
+        self.task = aio.create_task(self._worker())
+
+    def cached(self, message, signature):
+        """The verdict if this signature was checked recently, otherwise None."""
+        return self.cache.get(verdict_key(message, signature))
+
+    def verify_now(self, message, signature) -> bool:
+        """Verify in the caller, using and filling the cache."""
+        key = verdict_key(message, signature)
+        verdict = self.cache.get(key)
+        if verdict is None:
+            verdict = self._verify(key, message, signature)
+        return verdict
+
+    def submit(self, message, signature, callback) -> bool:
+        """Call `callback(verdict)` once the signature is checked, right away if the verdict is cached.
+        Returns False, without calling back, if the queue is full."""
+        key = verdict_key(message, signature)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            callback(verdict)
+            return True
+        callbacks = self._waiting.get(key)
+        if callbacks is not None:
+            self.shared += 1
+            callbacks.append(callback)
+            return True
+        if len(self.queue) >= self.queue_size:
+            return False
+        self._waiting[key] = [callback]
+        self.queue.append((key, message, signature))
+        self.queued += 1
+        self._ready.set()
+        return True
+
+    async def verify(self, message, signature) -> bool:
+        """Verify in the background task and return the verdict."""
+        result = []
+        done = aio.Event()
+
+        def finished(verdict):
+            result.append(verdict)
+            done.set()
+
+        if not self.submit(message, signature, finished):
+            self.inline += 1
+            return self.verify_now(message, signature)
+        if not result:
+            await done.wait()
+        return result[0]
+
+    def _verify(self, key: bytes, message, signature) -> bool:
+        start = time.ticks_ms()
+        verdict = self.crypto.verify(message, signature)
+        self.verify_ms.add(time.ticks_diff(time.ticks_ms(), start))
+        self.cache.put(key, verdict)
+        return verdict
+
+    async def _worker(self):
+        while True:
+            if not self.queue:
+                self._ready.clear()
+                await self._ready.wait()
+            key, message, signature = self.queue.popleft()
+            verdict = self._verify(key, message, signature)
+            for callback in self._waiting.pop(key, ()):
+                try:
+                    callback(verdict)
+                except Exception as ex:
+                    print("Exception in signature verification callback")
+                    sys.print_exception(ex)
+            await aio.sleep(0)
+
+    def __repr__(self):
+        return (
+            f"VerificationService(queue:{len(self.queue)}/{self.queue_size} queued:{self.queued} "
+            f"shared:{self.shared} inline:{self.inline} verify:{self.verify_ms} {self.cache})"
+        )
@@ -0,0 +1,97 @@
+"""Duplicate suppression for relayed badgenet frames.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+import time
+
+
+def frame_key(frame) -> int:
+    """Identify a frame by its checksum, sequence number, port and source, packed into 30 bits so the
+    key is a small int on Micropython and looking a frame up doesn't allocate.
+    The checksum and seq are kept whole. The port shares the low 6 bits with a fold of the source,
+    so frames from one badge are told apart by seq and port (ports 0-63) without relying on the
+    checksum, and frames from different badges mostly by the checksum, which covers the addresses too.
+    The TTL is left out, so the same message is recognized on every hop it's relayed."""
+    source = frame[10] ^ frame[11] ^ frame[12] ^ frame[13]
+    return frame[2] << 22 | frame[3] << 14 | frame[15] << 6 | (frame[14] ^ source) & 0x3F
+
+
+class SeenCache:
+    """Fixed size cache counting how many times each message has been seen recently.
+
+    Entries are kept in `generations` dicts, newest first. New entries go into the newest one,
+    and every `expiration_s / generations` seconds (or once the newest one is full) the oldest
+    generation is thrown out whole and a new empty one started. Expiring entries is a cheap check
+    on each access instead of a periodic sweep, entries live between (generations - 1) / generations
+    and all of `expiration_s`, and at most `capacity` entries are ever stored.
+    """
+
+    def __init__(self, capacity: int = 2048, expiration_s: int = 6000, generations: int = 4):
+        if generations < 2:
+            raise ValueError(f"SeenCache needs at least 2 generations, got {generations}")
+        self.capacity = capacity
+        self.expiration_s = expiration_s
+        self.generation_capacity = max(1, capacity // generations)
+        self.generation_s = max(1, expiration_s // generations)
+        self.generations: list[dict[int, int]] = [{} for _ in range(generations)]
+        self.generation_start = time.time()
+        self.evicted = 0  # Entries dropped early because the cache was full
+
+    def __len__(self):
+        return sum(len(generation) for generation in self.generations)
+
+    def _expire(self):
+        """Drop the generations that are past their time."""
+        now = time.time()
+        elapsed = now - self.generation_start
+        if elapsed < self.generation_s:
+            return
+        for _ in range(min(len(self.generations), elapsed // self.generation_s)):
+            self.generations.pop()
+            self.generations.insert(0, {})
+        self.generation_start = now
+
+    def _add(self, key: int, count: int):
+        newest = self.generations[0]
+        if len(newest) >= self.generation_capacity:
+            # Full before its time was up, so the oldest entries go early
+            self.evicted += len(self.generations.pop())
+            newest = {}
+            self.generations.insert(0, newest)
+            self.generation_start = time.time()
+        newest[key] = count
+
+    def get(self, key: int) -> int:
+        """How many times `key` has been seen, 0 if never or expired."""
+        if time.time() - self.generation_start >= self.generation_s:
+            self._expire()
+        for generation in self.generations:
+            count = generation.get(key)
+            if count is not None:
+                return count
+        return 0
+
+    def increment(self, key: int) -> int:
+        """Count another sighting of `key`. Returns how many times it was seen before this one."""
+        if time.time() - self.generation_start >= self.generation_s:
+            self._expire()
+        for generation in self.generations:
+            count = generation.get(key)
+            if count is not None:
+                # Keep it in its generation, so it expires relative to when it was first seen
+                generation[key] = count + 1
+                return count
+        self._add(key, 1)
+        return 0
+
+    def set(self, key: int, count: int):
+        """Set the count for `key`, keeping its original age if already present."""
+        if time.time() - self.generation_start >= self.generation_s:
+            self._expire()
+        for generation in self.generations:
+            if key in generation:
+                generation[key] = count
+                return
+        self._add(key, count)
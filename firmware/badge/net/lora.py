@@ -3,8 +3,11 @@ import binascii
 import collections
 import random
 import sys
+import time
 
-from net.sx1262 import SX1262, CHANNEL_FREE, LORA_DETECTED, ERR_UNKNOWN
+from net.sx1262 import SX1262, CHANNEL_FREE, LORA_DETECTED, ERR_NONE, ERR_UNKNOWN
+from net.rxring import RxRing, RX_BUFFER_SIZE
+from net.stats import LatencyStats
 from hardware import board
 
 
@@ -23,8 +26,41 @@ from hardware import board
 # Meshtastic Short Fast Freq Slot 68 918.875 MHz, aka ~ST 34
 # Meshtastic Short Slow Freq Slot 75 920.625 MHz, aka ~ST 38
 
+# Radio power modes, what the radio does while it isn't transmitting
+POWER_CONTINUOUS = 0  # Always receiving
+POWER_DUTY_CYCLE = 1  # Sleeps, waking briefly to check for a preamble. Needs senders to use LOW_POWER_PREAMBLE.
+POWER_SLEEP = 2  # Not receiving at all, sending still works
+POWER_MODE_NAMES = ("continuous", "duty_cycle", "sleep")
+# Preamble that duty cycled receivers can't miss: the radio sleeps for all but the last 16 symbols
+# of it between checks. 64 symbols is 16 ms at SF7 500kHz, 12 ms more than the normal preamble on
+# every frame sent, about 40% more time on air for a chat message.
+LOW_POWER_PREAMBLE = 64
+
+# SX1262 supply current in mA (datasheet table 3-5, DC-DC regulator), for estimates
+RX_CURRENT_MA = 5.3  # LoRa 500kHz, boosted gain off
+STANDBY_CURRENT_MA = 1.0  # STDBY_RC with the TCXO running, while waking up for a duty cycled check
+SLEEP_CURRENT_MA = 0.0006  # Warm start, configuration kept
+TCXO_WAKE_US = 6000  # TCXO startup delay set by begin() plus the 1ms the driver allows to leave sleep
+
+# Channel access (CSMA). Before sending, CAD checks for LoRa on the channel. While it's busy the
+# radio goes back to receiving and waits a random backoff, in a window that doubles with every busy
+# CAD up to csma_max_backoff_ms, so badges queued behind the same frame spread out instead of all
+# checking again at once.
+CSMA_MIN_BACKOFF_MS = 10  # Backoff window after the first busy CAD
+CSMA_MAX_BACKOFF_MS = 40  # Default cap on the window, see `bench_net.py csma`
+CAD_TIMEOUT_MS = 50  # CAD takes about a millisecond, give up waiting for DIO1 after this
+IRQ_DRAIN_PASSES = 4  # Times the IRQ status is read again while DIO1 stays high, before waiting for the next edge
+
 
 class LoraRadio:
+    """The badge's SX1262, owned by the event loop.
+
+    The DIO1 interrupt only notes that something happened. _service_irq() then reads and handles
+    every event latched since, in one go, from a task. So all SPI traffic to the radio comes from
+    event loop code that doesn't await in the middle of it, and one radio operation can't land in
+    the middle of another.
+    """
+
     def __init__(self, tx_led=None, tx_power=9):
         # Settings
         # https://meshtastic.org/docs/overview/radio-settings/
@@ -38,6 +74,10 @@ class LoraRadio:
             7  # 1<<x num chirps per symbol, each step doubles airtime, adds 2.5dB: 7-12
         )
         self.preamble_length = 16
+        self.power_mode = POWER_CONTINUOUS
+        # Send with LOW_POWER_PREAMBLE even in continuous mode, set on every badge while some of the
+        # mesh is duty cycling, so they hear this one
+        self.low_power_mesh = False
         self.crc = True
         self.tx_power = tx_power
         self.sync_word = 0x12
@@ -48,8 +88,23 @@ class LoraRadio:
         self.last_rssi: float = 0.0
         self._message_ready = asyncio.ThreadSafeFlag()  # type: ignore
         self._ready_for_tx = asyncio.ThreadSafeFlag()  # type: ignore
-        self._rx_queue: collections.deque = collections.deque([], 30)
+        self._cad_done = asyncio.ThreadSafeFlag()  # type: ignore
+        self._cad_status = ERR_UNKNOWN
+        self.csma_max_backoff_ms = CSMA_MAX_BACKOFF_MS
+        self.cad_attempts = 0
+        self.cad_busy = 0
+        self.cad_errors = 0
+        self.access_delay = LatencyStats()  # From send() to the start of transmitting
+        self._irq_pending = asyncio.ThreadSafeFlag()  # type: ignore
+        self._irq_us = None  # time.ticks_us() of the first DIO1 interrupt not handled yet
+        self.irq_count = 0  # DIO1 interrupts
+        self.irq_services = 0  # Runs of _service_irq(), interrupts close together share one
+        self.irq_latency = LatencyStats()  # From the interrupt to its events handled
+        self._rx_ring = RxRing()
+        # Frames that arrive while every ring buffer is in use are read in here and dropped
+        self._rx_discard = memoryview(bytearray(RX_BUFFER_SIZE))
         self.tx_led = tx_led
+        self.tx_done_callback = None  # Called on TX_DONE, set by the network stack
 
         try:
             print("Initializing SX1262...")
@@ -78,60 +133,91 @@ class LoraRadio:
             self.radio.setPaConfig(
                 *self.rf_power_levels[self.power_level]
             )  ## datasheet p. 76
-            self.radio.setBlockingCallback(False, self._handle_events)
+            self.radio.setDeferredCallback(self._irq)
+            self.irq_task = asyncio.create_task(self._service_irq())
         except Exception as ex:
             print(f"Failed to configure radio: {ex}")
             sys.print_exception(ex)
             self.radio = None
             self.fake_rx_buffer = collections.deque([], 3)
 
+    def _irq(self, pin):
+        # DIO1 interrupt. No SPI here, it could land in the middle of a transaction the event
+        # loop is making. Interrupts before _service_irq() runs are handled together.
+        self.irq_count += 1
+        if self._irq_us is None:
+            self._irq_us = time.ticks_us()
+        self._irq_pending.set()
+
+    async def _service_irq(self):
+        while True:
+            await self._irq_pending.wait()
+            irq_us = self._irq_us
+            self._irq_us = None
+            self.irq_services += 1
+            try:
+                for _ in range(IRQ_DRAIN_PASSES):
+                    self._handle_events(self.radio.getIrqStatus())
+                    if not self.radio.irqPending():
+                        break
+            except Exception as ex:
+                print(f"Radio event error: {ex}")
+                sys.print_exception(ex)
+            if irq_us is not None:
+                self.irq_latency.add(time.ticks_diff(time.ticks_us(), irq_us) / 1000)
+
     def _handle_events(self, events):
+        # Events may have piled up since the interrupt, so handle every one that's set
+        if events & SX1262.CAD_DONE:
+            self._cad_status = self.radio.getChannelScanResult(events)
+            self._cad_done.set()
         if events & SX1262.RX_DONE:
-            msg, err = self.radio.recv()
+            # Read straight into a ring buffer, the radio's packet has to be read out either way
+            buf = self._rx_ring.reserve()
+            length, err = self.radio.recvInto(self._rx_discard if buf is None else buf)
             self._ready_for_tx.set()  # Done with an Rx operations, so allow Tx
-            error = SX1262.STATUS[err]
-            if error != "ERR_NONE":
-                # print(f"Lora Error: {error}")
-                return
-            self.last_rssi = self.radio.getRSSI()
-            self.last_snr = self.radio.getSNR()
-            self._rx_queue.append(msg)
-            self._message_ready.set()
-        elif events & SX1262.TX_DONE:
+            if err == ERR_NONE and buf is not None:
+                self.last_rssi, self.last_snr = self.radio.getPacketSignal()
+                self._rx_ring.commit(length)
+                self._message_ready.set()
+            # else:
+            #     print(f"Lora Error: {SX1262.STATUS[err]}")
+        if events & SX1262.TX_DONE:
+            self.radio.resumeReceive()
             if self.tx_led:
                 self.tx_led.value(0)
             self._rf_sw_rx()
             self._ready_for_tx.clear()
+            if self.tx_done_callback:
+                self.tx_done_callback()
 
-    async def recv(self) -> bytes | None:
+    async def recv(self) -> memoryview | None:
+        """The next received frame, a view of a ring buffer. Call release_rx() once done with it."""
         if self.radio:
-            await self._message_ready.wait()
-            data = self._rx_queue.popleft()
+            # The flag is only set once for several frames queued before the wait, so check the ring
+            while not self._rx_ring.pending():
+                self._rx_ring.adapt()  # Emptied, a good time to size it for the last burst
+                await self._message_ready.wait()
+            data = self._rx_ring.pop()
             # print(f"RX:<{binascii.b2a_base64(data, newline=False).decode()}>")
             return data
         return None
 
+    def release_rx(self):
+        """Give back the buffer of the oldest frame from recv(), it mustn't be used after this."""
+        self._rx_ring.release()
+
     async def send(self, packet: bytes):
         # print(f"TX:<{binascii.b2a_base64(packet, newline=False).decode()}>")
         if self.radio:
-            # Detect a free RF channel before transmitting
-            channel_status = LORA_DETECTED
-            while channel_status != CHANNEL_FREE:
-                # try:
-                #     # Don't interrupt Rx
-                #     await asyncio.wait_for(self._ready_for_tx.wait(), 2)
-                # except asyncio.TimeoutError:
-                #     # Unless nothing is being received, then go ahead and Tx
-                #     pass
-                channel_status = self.radio.scanChannel()
-                if channel_status == ERR_UNKNOWN:
-                    print("SX126X error scanning channel")
-                if channel_status == LORA_DETECTED:
-                    print(".", end="")
-                else:
-                    # If busy, sleep a random 0-10ms
-                    await asyncio.sleep(random.random() / 100)
-                # channel_status = CHANNEL_FREE
+            # Wait for a free RF channel before transmitting
+            start = time.ticks_ms()
+            window_ms = CSMA_MIN_BACKOFF_MS
+            while await self._scan_channel() != CHANNEL_FREE:
+                # print(".", end="")
+                await asyncio.sleep_ms(random.getrandbits(16) % window_ms + 1)
+                window_ms = min(window_ms * 2, self.csma_max_backoff_ms)
+            self.access_delay.add(time.ticks_diff(time.ticks_ms(), start))
             print(">", end="")
             self._rf_sw_tx()
             if self.tx_led:
@@ -139,6 +225,117 @@ class LoraRadio:
             self.radio.send(packet)
         return None
 
+    async def _scan_channel(self) -> int:
+        """Channel activity detection, waiting for DIO1 instead of spinning on it.
+        A packet already arriving counts as busy without running CAD, which would abort its reception,
+        and is left to finish. After a CAD that didn't find the channel free, the radio is put back
+        to receiving from standby, so the frame that's on the air isn't missed while backing off."""
+        self.cad_attempts += 1
+        if self.rx_busy():
+            self.cad_busy += 1
+            return LORA_DETECTED
+        self._cad_done.clear()
+        status = self.radio.startChannelScan()
+        if status == ERR_NONE:
+            try:
+                await asyncio.wait_for_ms(self._cad_done.wait(), CAD_TIMEOUT_MS)
+                status = self._cad_status
+            except asyncio.TimeoutError:
+                status = ERR_UNKNOWN
+        if status != CHANNEL_FREE:
+            self.radio.resumeReceive()
+        if status == LORA_DETECTED:
+            self.cad_busy += 1
+        elif status != CHANNEL_FREE:
+            self.cad_errors += 1
+            print("SX126X error scanning channel")
+        return status
+
+    def rx_overruns(self) -> int:
+        """Received frames dropped because every receive buffer was full."""
+        return self._rx_ring.overruns
+
+    def rx_stats(self) -> str:
+        return repr(self._rx_ring)
+
+    def irq_stats(self) -> str:
+        return f"IRQ(interrupts:{self.irq_count} services:{self.irq_services} latency:{self.irq_latency})"
+
+    def csma_stats(self) -> str:
+        busy_pct = 100 * self.cad_busy // self.cad_attempts if self.cad_attempts else 0
+        return (
+            f"CSMA(cad:{self.cad_attempts} busy:{self.cad_busy} ({busy_pct}%) errors:{self.cad_errors} "
+            f"max backoff:{self.csma_max_backoff_ms}ms access delay:{self.access_delay})"
+        )
+
+    def set_power_mode(self, mode: int, low_power_mesh: bool | None = None):
+        """Switch the radio between POWER_CONTINUOUS, POWER_DUTY_CYCLE and POWER_SLEEP, e.g. when the screen goes off.
+        Frames are sent with LOW_POWER_PREAMBLE while this badge isn't continuously receiving or
+        `low_power_mesh` is set."""
+        if low_power_mesh is not None:
+            self.low_power_mesh = low_power_mesh
+        self.power_mode = mode
+        if self.radio:
+            long_preamble = self.low_power_mesh or mode != POWER_CONTINUOUS
+            self.radio.setTxPreambleLength(LOW_POWER_PREAMBLE if long_preamble else 0)
+            # Only RX_DUTY_CYCLE uses the sender preamble
+            self.radio.setReceiveMode(
+                (SX1262.RX_CONTINUOUS, SX1262.RX_DUTY_CYCLE, SX1262.RX_SLEEP)[mode], LOW_POWER_PREAMBLE
+            )
+
+    def _duty_cycle_us(self) -> tuple:
+        """(Rx, wake up, sleep) time of one duty cycle period in us, as SX126X.startReceiveDutyCycleAuto() works them out."""
+        symbol_us = (1000 << self.spreading_factor) / self.bandwidth
+        min_symbols = 8
+        sleep_us = symbol_us * (LOW_POWER_PREAMBLE - 2 * min_symbols)
+        rx_us = max((symbol_us * (LOW_POWER_PREAMBLE + 1) - (sleep_us - 1000)) / 2, symbol_us * (min_symbols + 1))
+        return rx_us, TCXO_WAKE_US, sleep_us - TCXO_WAKE_US
+
+    def estimated_current_ma(self, mode: int | None = None) -> float:
+        """Average radio supply current while idle (not transmitting) in a power mode, the current one by default."""
+        if mode is None:
+            mode = self.power_mode
+        if mode == POWER_SLEEP:
+            return SLEEP_CURRENT_MA
+        if mode == POWER_DUTY_CYCLE:
+            rx_us, wake_us, sleep_us = self._duty_cycle_us()
+            if sleep_us <= 0:
+                return RX_CURRENT_MA  # Preamble too short to sleep, the driver falls back to continuous Rx
+            charge = rx_us * RX_CURRENT_MA + wake_us * STANDBY_CURRENT_MA + sleep_us * SLEEP_CURRENT_MA
+            return charge / (rx_us + wake_us + sleep_us)
+        return RX_CURRENT_MA
+
+    def latency_penalty_ms(self, mode: int | None = None) -> float:
+        """Extra delay per frame in a power mode over continuous Rx with the normal preamble.
+        Duty cycling costs the longer preamble on every hop, the receiver wakes up within it.
+        Asleep, nothing is received at all."""
+        if mode is None:
+            mode = self.power_mode
+        if mode == POWER_SLEEP:
+            return float("inf")
+        if mode == POWER_DUTY_CYCLE or self.low_power_mesh:
+            symbol_ms = (1 << self.spreading_factor) / self.bandwidth
+            return symbol_ms * (LOW_POWER_PREAMBLE - self.preamble_length)
+        return 0.0
+
+    def rx_pending(self) -> int:
+        """Received frames waiting for recv()."""
+        return self._rx_ring.pending()
+
+    def rx_busy(self) -> bool:
+        """True while a packet is arriving, from its LoRa header until RX_DONE.
+        Only known in continuous Rx: reading the status over SPI wakes a sleeping or duty cycling
+        radio, which would end its duty cycled Rx, so those modes always say False."""
+        if self.radio and self.power_mode == POWER_CONTINUOUS:
+            return bool(self.radio.getIrqStatus() & SX1262.HEADER_VALID)
+        return False
+
+    def time_on_air_us(self, length: int) -> int:
+        """Time on air of a `length` byte packet with the current radio settings."""
+        if self.radio:
+            return self.radio.getTimeOnAir(length)
+        return 0
+
     def get_rssi(self) -> float:
         if self.radio:
             return self.last_rssi
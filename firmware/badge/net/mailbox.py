@@ -0,0 +1,89 @@
+"""Receive mailboxes, for apps whose message handlers are too slow to run inline in recv_all().
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+from collections import deque
+import sys
+import time
+import asyncio as aio  # type: ignore
+
+from net.stats import LatencyStats
+
+# What to do with a new message when a mailbox is full
+MAILBOX_DROP_OLDEST = 0  # Make room by dropping the oldest waiting message, for when only recent messages matter
+MAILBOX_DROP_NEWEST = 1  # Drop the new message, for when the ones already waiting matter more
+
+
+class Mailbox:
+    """Bounded queue of received messages for one handler, drained by its own task.
+
+    recv_all() calls the mailbox like a callback, which only queues the message, so the radio,
+    relaying and other apps keep going while the handler works through its backlog. The handler
+    may be a normal function or an async one, so long jobs can await between steps.
+
+    If `idle` is given, the handler only runs while that event is set. BadgeNet sets it while
+    recv_all() has nothing waiting, so a burst of frames is all relayed before slow handlers start.
+    """
+
+    def __init__(self, handler, size: int = 8, overflow: int = MAILBOX_DROP_OLDEST, idle=None):
+        if overflow not in (MAILBOX_DROP_OLDEST, MAILBOX_DROP_NEWEST):
+            raise ValueError(f"Unknown mailbox overflow policy {overflow}")
+        self.handler = handler
+        self.size = size
+        self.overflow = overflow
+        self.queue: deque = deque([], size)
+        self.max_depth = 0  # Most messages ever waiting at once
+        self.received = 0
+        self.dropped = 0
+        self.handled = 0
+        self.handler_ms = LatencyStats()  # Time spent in the handler per message
+        self._ready = aio.Event()
+        self._idle = idle
+        self.task = aio.create_task(self._drain())
+
+    def __call__(self, message):
+        self.received += 1
+        if len(self.queue) >= self.size:
+            self.dropped += 1
+            if self.overflow == MAILBOX_DROP_NEWEST:
+                return
+            self.queue.popleft()
+        self.queue.append(message)
+        if len(self.queue) > self.max_depth:
+            self.max_depth = len(self.queue)
+        self._ready.set()
+
+    def depth(self) -> int:
+        return len(self.queue)
+
+    async def _drain(self):
+        while True:
+            if not self.queue:
+                self._ready.clear()
+                await self._ready.wait()
+            if self._idle is not None:
+                await self._idle.wait()
+            if not self.queue:
+                continue
+            message = self.queue.popleft()
+            start = time.ticks_ms()
+            try:
+                result = self.handler(message)
+                if hasattr(result, "send"):
+                    # An async handler, let it run
+                    await result
+            except Exception as ex:
+                print(f"Exception in mailbox handler for port {message.port}")
+                sys.print_exception(ex)
+            self.handled += 1
+            self.handler_ms.add(time.ticks_diff(time.ticks_ms(), start))
+            # Let recv_all() and everything else have a turn between messages
+            await aio.sleep(0)
+
+    def __repr__(self):
+        return (
+            f"Mailbox(depth:{len(self.queue)}/{self.size} max:{self.max_depth} received:{self.received} "
+            f"dropped:{self.dropped} handled:{self.handled} handler:{self.handler_ms})"
+        )
@@ -0,0 +1,169 @@
+"""Table of the other badges this one hears, with how well and how far away.
+
+Every frame received updates the entry for its source:
+- RSSI and SNR, averaged (EWMA) over frames heard directly from that badge. A relayed copy was
+  transmitted by the relaying badge, so its signal says nothing about the source.
+- Packet reception ratio, from gaps in the source's sequence numbers. Each badge numbers all of
+  its frames with one 8 bit counter, so a gap of n means n - 1 frames were missed.
+- When it was last heard.
+- Hops away, from the TTL the frame arrived with. Frames don't carry the TTL they were sent
+  with, so the highest TTL heard from that source stands in for it. Apps mostly send with the
+  same TTL, so that's right once one frame has arrived directly or over the fewest hops.
+
+The table is bounded and evicts the badges heard least recently when full. Entries are lists of
+small ints (signal levels in 1/16 dB fixed point), so an update doesn't allocate. Micropython
+dicts aren't ordered, so eviction scans the table for the oldest entries, only when adding to a
+full one, and frees a batch at a time.
+
+Memory on the badge (32 bit Micropython): each entry is a list of 8 ints (16 byte object + 32 byte
+item array), the address key is a boxed int for addresses above 2^30 (about 32 bytes), and the
+dict has 8 bytes per slot with some spare. The default 64 neighbours take about 64 * 80 + 1K,
+roughly 6KB of heap, enough for the badges in radio range and a few hops past them. At the most,
+500, it's about 500 * 80 + 6K, roughly 46KB. `bench_net.py neighbors` measures the CPython
+equivalent.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+import time
+
+DEFAULT_NEIGHBOR_TABLE_SIZE = 64
+MAX_NEIGHBOR_TABLE_SIZE = 500  # About 46KB on the badge, bigger tables are cut down to this
+NO_SIGNAL = -0x8000  # Signal level of a badge that's only been heard through relays
+SIGNAL_SCALE = 16  # Signal levels are stored in 1/16 dB
+EWMA_SHIFT = 3  # Each frame moves the average 1/8 of the way to the new value
+PRR_WINDOW = 64  # Expected frames counted before the counts are halved, so old losses fade
+PRR_MAX_GAP = 64  # Bigger sequence jumps are a reboot or a long absence, not lost frames
+EVICT_DIVISOR = 16  # A full table makes room for this fraction of its size at once
+
+# Fields of a table entry
+_RSSI = 0
+_SNR = 1
+_HEARD_MS = 2
+_HOPS = 3
+_MAX_TTL = 4
+_SEQ = 5
+_RECEIVED = 6
+_EXPECTED = 7
+
+
+class NeighborTable:
+    """Link quality and distance of recently heard badges, by address."""
+
+    def __init__(self, size: int = DEFAULT_NEIGHBOR_TABLE_SIZE):
+        self.size = min(size, MAX_NEIGHBOR_TABLE_SIZE)
+        self._entries: dict[int, list] = {}  # address: [rssi, snr, heard ms, hops, max ttl, seq, received, expected]
+        self.updates = 0
+        self.evicted = 0
+
+    def heard(self, source: int, seq: int, ttl: int, rssi: float, snr: float, direct: bool | None = None):
+        """Record a frame from `source` received with `rssi` and `snr`.
+        `direct` says whether it came straight from the source, None works it out from the TTL."""
+        now = time.ticks_ms()
+        self.updates += 1
+        entry = self._entries.get(source)
+        if entry is None:
+            if len(self._entries) >= self.size:
+                self._evict(now)
+            entry = [NO_SIGNAL, NO_SIGNAL, now, 0, ttl, seq, 1, 1]
+            self._entries[source] = entry
+        else:
+            entry[_HEARD_MS] = now
+            gap = (seq - entry[_SEQ]) & 0xFF
+            entry[_SEQ] = seq
+            entry[_RECEIVED] += 1
+            entry[_EXPECTED] += gap if 0 < gap <= PRR_MAX_GAP else 1
+            if entry[_EXPECTED] >= PRR_WINDOW:
+                entry[_RECEIVED] >>= 1
+                entry[_EXPECTED] >>= 1
+            if ttl > entry[_MAX_TTL]:
+                entry[_MAX_TTL] = ttl
+        if direct is None:
+            direct = ttl >= entry[_MAX_TTL]
+        # A relayed frame is at least one hop away, even before a direct one has shown the full TTL
+        entry[_HOPS] = 0 if direct else max(entry[_MAX_TTL] - ttl, 1)
+        if direct:
+            rssi = int(rssi * SIGNAL_SCALE)
+            snr = int(snr * SIGNAL_SCALE)
+            if entry[_RSSI] == NO_SIGNAL:
+                entry[_RSSI] = rssi
+                entry[_SNR] = snr
+            else:
+                entry[_RSSI] += (rssi - entry[_RSSI]) >> EWMA_SHIFT
+                entry[_SNR] += (snr - entry[_SNR]) >> EWMA_SHIFT
+
+    def _evict(self, now: int):
+        """Drop the least recently heard 1/EVICT_DIVISOR of the table, so a hall full of new
+        badges costs one scan per several of them instead of one each."""
+        entries = self._entries
+        count = max(len(entries) // EVICT_DIVISOR, 1)
+        ages = sorted(time.ticks_diff(now, entry[_HEARD_MS]) for entry in entries.values())
+        cutoff = ages[-count]
+        oldest = [address for address, entry in entries.items() if time.ticks_diff(now, entry[_HEARD_MS]) >= cutoff]
+        for address in oldest[:count]:
+            del entries[address]
+        self.evicted += count
+
+    def rssi(self, address: int) -> float | None:
+        """Average RSSI of frames heard directly from `address`, None if it never has been."""
+        entry = self._entries.get(address)
+        if entry is None or entry[_RSSI] == NO_SIGNAL:
+            return None
+        return entry[_RSSI] / SIGNAL_SCALE
+
+    def snr(self, address: int) -> float | None:
+        """Average SNR of frames heard directly from `address`, None if it never has been."""
+        entry = self._entries.get(address)
+        if entry is None or entry[_SNR] == NO_SIGNAL:
+            return None
+        return entry[_SNR] / SIGNAL_SCALE
+
+    def prr(self, address: int) -> float | None:
+        """Fraction of the frames `address` sent recently that reached this badge."""
+        entry = self._entries.get(address)
+        if entry is None:
+            return None
+        return entry[_RECEIVED] / entry[_EXPECTED]
+
+    def hops(self, address: int) -> int | None:
+        """Relays between `address` and this badge on the last frame heard from it, 0 for a direct neighbour."""
+        entry = self._entries.get(address)
+        return None if entry is None else entry[_HOPS]
+
+    def route(self, address: int, max_age_ms: int, min_prr: float = 0.0) -> int | None:
+        """hops() for routing: None unless `address` was heard in the last `max_age_ms`, with at
+        least `min_prr` of its frames arriving. The first copy of a frame usually comes the shortest
+        way, so this is close to the fewest hops to it."""
+        entry = self._entries.get(address)
+        if (
+            entry is None
+            or time.ticks_diff(time.ticks_ms(), entry[_HEARD_MS]) > max_age_ms
+            or entry[_RECEIVED] < min_prr * entry[_EXPECTED]
+        ):
+            return None
+        return entry[_HOPS]
+
+    def age_ms(self, address: int) -> int | None:
+        """Milliseconds since `address` was last heard."""
+        entry = self._entries.get(address)
+        return None if entry is None else time.ticks_diff(time.ticks_ms(), entry[_HEARD_MS])
+
+    def addresses(self, max_hops: int = 15, max_age_ms: int = 0) -> list:
+        """Badges at most `max_hops` away, heard in the last `max_age_ms` (0 for any time)."""
+        now = time.ticks_ms()
+        return [
+            address
+            for address, entry in self._entries.items()
+            if entry[_HOPS] <= max_hops and (not max_age_ms or time.ticks_diff(now, entry[_HEARD_MS]) <= max_age_ms)
+        ]
+
+    def __contains__(self, address: int) -> bool:
+        return address in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        direct = sum(1 for entry in self._entries.values() if not entry[_HOPS])
+        return f"NeighborTable({len(self._entries)}/{self.size} direct:{direct} updates:{self.updates} evicted:{self.evicted})"
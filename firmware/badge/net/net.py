@@ -2,73 +2,263 @@
 
 from collections import deque
 import machine  # type: ignore
-import struct
+import random
 import sys
 import time
 import asyncio as aio  # type: ignore
 
+from net.airtime import AirtimeAccountant
+from net.dedup import SeenCache, frame_key
+from net.mailbox import Mailbox, MAILBOX_DROP_OLDEST, MAILBOX_DROP_NEWEST
+from net.neighbors import NeighborTable
+from net.stats import LatencyStats
 from net.protocols import (
     Protocol,
     NetworkFrame,
+    AGGREGATE_PROTO,
     HEADER_LEN,
     MAX_FRAME_LEN,
+    MAX_ROUTE,
     NULL_PROTO,
-    CHECKSUM_OFFSET,
+    ROUTE_FLOOD,
+    ROUTE_MASK,
+    ROUTE_SHIFT,
+    SYNCWORD,
+    compile_protocol,
+    frame_pool,
 )
 
 # For an event the size of supercon, there's ~50% chance of address collision with a 2-byte address. 4 is virtually 0.
 MY_ADDRESS = int.from_bytes(machine.unique_id()[2:6], "big")
 BROADCAST_ADDRESS = 0xFFFFFFFF  # Broadcast address for all nodes
 RECENT_MESSAGE_EXPIRATION_S = 6000
+RECENT_MESSAGE_CACHE_SIZE = 2048  # Max messages remembered for duplicate suppression
+
+# Transmit traffic classes, each with its own queue
+TX_CLASS_CONTROL = 0  # Small replies and acknowledgements, e.g. PONG
+TX_CLASS_LOCAL = 1  # Messages from apps on this badge, the default for send()
+TX_CLASS_RELAY = 2  # Other badges' messages being repeated
+TX_CLASS_BULK = 3  # Large floods that can wait, e.g. CONFIG_OVERRIDE
+TX_CLASS_NAMES = ("control", "local", "relay", "bulk")
+TX_CLASS_DEPTHS = (8, 10, 10, 4)  # Max queued messages per class
+TX_CLASS_WEIGHTS = (8, 4, 2, 1)  # Share of transmissions per class while several classes are waiting
+
+# send() results
+SEND_REJECTED = 0  # That class's queue is full, the message was dropped. Try again later.
+SEND_ACCEPTED = 1  # Queued with nothing ahead of it, goes out next
+SEND_QUEUED = 2  # Queued behind other messages
+
+# Relay suppression. A new frame to repeat is held for a backoff before being queued, and dropped if
+# other badges are heard repeating it in the meantime. The backoff is counted in slots, each the frame's
+# time on air: badges that heard the frame weakly (far from the sender) wait the least, so the relays
+# that cover the most new ground go first, and nearby badges that hear them can stay quiet.
+# Cancel a held relay after hearing this many copies repeated by other badges. Keep it at 1 in a hall:
+# with 2, many badges hear only one repeat before their own backoff ends, so far fewer are
+# cancelled (`bench_net.py relay_suppression`, 300 badges: 31.6 transmissions per message with 1,
+# 113.6 with 2, 300 relaying straight away). Higher only makes sense where badges are spread thin.
+RELAY_CANCEL_COPIES = 1
+RELAY_WINDOW_SLOTS = 8  # Backoff of the badge nearest the sender. 0 queues relays straight away.
+RELAY_JITTER_SLOTS = 1  # Random extra backoff, so badges at the same distance don't all go at once
+RELAY_MIN_SLOT_MS = 20  # Slot length if the radio can't say how long the frame takes to send
+RELAY_HOLD_SIZE = 16  # Max relays waiting out their backoff, new ones are dropped when full
+RELAY_BUSY_RECHECK_MS = 10  # When a relay's backoff ends while a frame is arriving, look again after this
+# Signal strength mapped to the backoff, from a badge at the edge of range to one right next to the sender
+RELAY_RSSI_FAR_DBM = -100
+RELAY_RSSI_NEAR_DBM = -50
+RELAY_SNR_FAR_DB = -10
+RELAY_SNR_NEAR_DB = 10
+
+# When several frames are waiting to be sent, pack as many as fit into one AGGREGATE container frame.
+# Every transmission costs the preamble and LoRa header on top of the frame, a few bytes' worth of
+# airtime at SF7, so small frames like PONGs and relays of short messages go out for much less
+# together. Badges from before this drop containers, so it's off until every badge can read them
+# (config "aggregate_frames").
+AGGREGATE_FRAMES = False
+
+# Unicast routing. A frame for one badge is marked with how many hops the sender is from the
+# destination, learned from the neighbour table when the destination was last heard, and only badges
+# closer to the destination repeat it, each marking it with its own distance. So a reply finds its way
+# back along the path the request came by, instead of being repeated by the whole room. Without a
+# recent route, or from badges that don't route, unicasts are flooded like broadcasts. Off by default,
+# turned on with the "route_unicasts" config: it only saves airtime on replies to badges more than a
+# hop away, and in a hall most are in range (`bench_net.py routing`).
+ROUTE_UNICASTS = False
+ROUTE_MAX_AGE_MS = 60000  # Routes to badges not heard from for longer are stale, flood instead
+ROUTE_MIN_PRR = 0.5  # Don't route to badges this badge hears less than this share of frames from
+# Destinations fewer hops away are flooded. A frame routed to a direct neighbour is repeated by no one,
+# so a collision loses it, and flooding it costs the least
+ROUTE_MIN_HOPS = 1
+
+# recv_all() handles every frame waiting when it wakes up, for at most this long before letting
+# other tasks (the UI) run, then carries on with the rest
+RX_SLICE_MS = 20
+
+
+def _closeness(value: float, far: float, near: float) -> float:
+    """Where `value` falls between `far` (0.0) and `near` (1.0), clamped to that range."""
+    if value <= far:
+        return 0.0
+    if value >= near:
+        return 1.0
+    return (value - far) / (near - far)
+
+
+class TransmitScheduler:
+    """Transmit queue with one bounded queue per traffic class.
+
+    Dequeueing is smooth weighted round robin: while several classes have messages waiting, each gets
+    a share of transmissions proportional to its weight, interleaved rather than in bursts, and
+    no class is starved. A full class rejects new messages instead of evicting queued ones, and
+    doesn't take space from the other classes.
+    """
+
+    def __init__(self, depths: tuple = TX_CLASS_DEPTHS, weights: tuple = TX_CLASS_WEIGHTS):
+        if len(depths) != len(weights):
+            raise ValueError(f"TransmitScheduler needs a depth and weight per class, got {depths} and {weights}")
+        self.depths = depths
+        self.weights = weights
+        self.queues: list[deque[NetworkFrame]] = [deque([], depth) for depth in depths]
+        self._credits = [0] * len(depths)
+        self.queued = [0] * len(depths)  # Messages accepted per class
+        self.drops = [0] * len(depths)  # Messages rejected per class because the queue was full
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues)
+
+    def push(self, message: NetworkFrame, tx_class: int) -> int:
+        """Queue a message in its class. Returns SEND_ACCEPTED, SEND_QUEUED or SEND_REJECTED."""
+        queue = self.queues[tx_class]
+        if len(queue) >= self.depths[tx_class]:
+            self.drops[tx_class] += 1
+            return SEND_REJECTED
+        status = SEND_QUEUED if len(self) else SEND_ACCEPTED
+        queue.append(message)
+        self.queued[tx_class] += 1
+        return status
+
+    def pop(self, max_len: int = 0) -> NetworkFrame | None:
+        """Take the next message to send. Raises IndexError if nothing is queued, like deque.popleft().
+        With a max_len, returns None and leaves the queue as it was if the next message's frame is longer."""
+        best = -1
+        total_weight = 0
+        for tx_class, queue in enumerate(self.queues):
+            if queue:
+                total_weight += self.weights[tx_class]
+                if best < 0 or self._credits[tx_class] + self.weights[tx_class] > self._credits[best] + self.weights[best]:
+                    best = tx_class
+        if best < 0:
+            raise IndexError("pop from empty TransmitScheduler")
+        if max_len and len(self.queues[best][0].serialize()) > max_len:
+            return None
+        for tx_class, queue in enumerate(self.queues):
+            if queue:
+                self._credits[tx_class] += self.weights[tx_class]
+            else:
+                # Idle classes don't bank credit to burst with later
+                self._credits[tx_class] = 0
+        self._credits[best] -= total_weight
+        return self.queues[best].popleft()
+
+    def depth(self, tx_class: int) -> int:
+        """Messages currently waiting in a class."""
+        return len(self.queues[tx_class])
+
+    def full(self, tx_class: int) -> bool:
+        """Whether push() would reject a message in this class."""
+        return len(self.queues[tx_class]) >= self.depths[tx_class]
+
+    def __repr__(self):
+        return "TransmitScheduler(" + " ".join(
+            f"{name}:{len(queue)}/{depth} drops:{drops}"
+            for name, queue, depth, drops in zip(TX_CLASS_NAMES, self.queues, self.depths, self.drops)
+        ) + ")"
 
 
 class BadgeNet:
     """Badge Network Stack"""
 
-    def __init__(self):
-        self.transmit_queue_max_len = 20
-        self.transmit_queue: deque[NetworkFrame] = deque([], self.transmit_queue_max_len)
-        self.receive_callbacks: dict[int, list] = {}
-        self.protocols: dict[int, Protocol] = {0: NULL_PROTO}
-        self.seen_nodes: dict[int, str] = {}
+    def __init__(self, address: int = MY_ADDRESS, recent_message_cache_size: int = RECENT_MESSAGE_CACHE_SIZE):
+        self.address = address
+        self.transmit_queue = TransmitScheduler()
+        # Indexed by port, so dispatching a received frame is a list lookup
+        self.receive_callbacks: list = [None] * 256  # list of callbacks or None
+        self.codecs: list = [None] * 256  # ProtocolCodec or None
+        self.codecs[NULL_PROTO.port] = compile_protocol(NULL_PROTO)
+        self.codecs[AGGREGATE_PROTO.port] = compile_protocol(AGGREGATE_PROTO)
+        self.mailboxes: list[Mailbox] = []
+        self.rx_idle = aio.Event()  # Set while recv_all() has no received frames waiting, gates mailbox handlers
+        self.protocols: dict[int, Protocol] = {0: NULL_PROTO, AGGREGATE_PROTO.port: AGGREGATE_PROTO}
+        self.neighbors = NeighborTable()  # Signal, reception ratio and hops of the badges heard
         self.capture_all_packets: bool = False
         self.promiscuous_queue: deque[NetworkFrame] = deque([], 100)
-        self.last_tx_time = 0
-        self.transmit_cooldown_s = 0.1
-        self.recently_seen_messages: dict[
-            int, tuple[int, int]
-        ] = {}  # checksum: (count, timestamp)
+        self.last_tx_ms = time.ticks_ms()
+        self.transmit_cooldown_ms = 100
+        self.airtime = AirtimeAccountant()  # Time on air budgets per port and for relays
+        # frame_key(): times seen
+        self.recently_seen_messages = SeenCache(recent_message_cache_size, RECENT_MESSAGE_EXPIRATION_S)
         self.lora_rx_task: aio.Task
         self.lora_tx_task: aio.Task
+        self.rx_slice_ms = RX_SLICE_MS
+        self.rx_slices = 0  # Times recv_all() woke up and handled frames
+        self.rx_slices_cut = 0  # Slices that ran out of time with frames still waiting
+        self.rx_batch_max = 0  # Most frames handled in one slice
         self.send_cooldown_s: float = 0.001
-        self.flush_recently_seen_cache_task: aio.Task
+        self._transmit_ready = aio.Event()  # Set when a message is queued, so send_all() doesn't need to poll
+        self._transmitting: list | None = None  # Messages sent to the radio, waiting for TX_DONE
+        # Time from being queued to TX_DONE, for messages from this badge and relayed messages
+        self.send_latency = LatencyStats()
+        self.relay_latency = LatencyStats()
+        # Relays waiting out their backoff, (due ticks_ms, message, frame_key) sorted by due time
+        self.relay_cancel_copies = RELAY_CANCEL_COPIES
+        self.relay_window_slots = RELAY_WINDOW_SLOTS
+        self.relay_hold: list = []
+        self._relay_held = aio.Event()  # Set when a relay is held, to wake relay_all()
+        self.relays_held = 0
+        self.relays_cancelled = 0  # Relays dropped because enough other badges repeated the frame
+        self.relay_hold_drops = 0  # Relays dropped because the hold was full
+        self.aggregate_frames = AGGREGATE_FRAMES
+        self.containers_sent = 0
+        self.frames_aggregated = 0  # Frames sent inside containers
+        self.containers_received = 0
+        self.containers_dropped = 0  # Containers that couldn't be unpacked, or the rest of one past a bad frame
+        self.route_unicasts = ROUTE_UNICASTS
+        self.routed_sent = 0  # Unicasts from this badge sent with a route
+        self.route_drops = 0  # Routed relays not repeated, this badge wasn't closer to the destination
+        self.unicast_relays = 0  # Unicasts repeated for other badges, routed or flooded
 
     def init(self, badge):
         self.badge = badge
         self.send_cooldown_s = self.badge.send_cooldown_ms / 1000
+        self.badge.lora.tx_done_callback = self._tx_done
+        self.airtime.set_radio(self.badge.lora.time_on_air_us)
         self.lora_rx_task = aio.create_task(self.recv_all())
         self.lora_tx_task = aio.create_task(self.send_all())
-        self.flush_recently_seen_cache_task = aio.create_task(
-            self.flush_recently_seen()
-        )
+        self.relay_task = aio.create_task(self.relay_all())
+
+    def set_radio_power_mode(self, mode: int, low_power_mesh: bool | None = None):
+        """Switch the radio's power mode (see LoraRadio.set_power_mode()) at runtime.
+        The preamble length may change with it, so airtime is worked out again."""
+        self.badge.lora.set_power_mode(mode, low_power_mesh)
+        self.airtime.set_radio(self.badge.lora.time_on_air_us)
 
     def register_protocol(self, protocol: Protocol):
         """Register a protocol to be known by the network stack for debug decoding.
         Not required if registering the protocol with a callback function, this will happen automatically."""
         port = protocol.port
         if port not in self.protocols:
-            self.protocols[port] = protocol
             try:
-                payload_len = struct.calcsize(protocol.structdef)
+                codec = compile_protocol(protocol)
                 max_payload_len = MAX_FRAME_LEN - HEADER_LEN
-                if payload_len > max_payload_len:
+                if codec.payload_len > max_payload_len:
                     raise ValueError(
-                        f"Protocol {protocol.name} payload length is too large: {payload_len} bytes vs max of {max_payload_len} bytes."
+                        f"Protocol {protocol.name} payload length is too large: {codec.payload_len} bytes vs max of {max_payload_len} bytes."
                     )
             except ValueError as err:
                 raise ValueError(
                     f"Unable to use protocol {protocol.name}, illegal structdef: {err}"
                 )
+            self.protocols[port] = protocol
+            self.codecs[port] = codec
         else:
             if (
                 protocol.name != self.protocols[port].name
@@ -82,68 +272,347 @@ class BadgeNet:
                     f"Redefining protocol at port {port} from {self.protocols[port]} to {protocol}."
                 )
 
-    def register_receiver(self, protocol: Protocol, callback=None):
-        """Registers a function to be called when a message is received for this badge in the specified protocol."""
+    def register_receiver(
+        self, protocol: Protocol, callback=None, mailbox_size: int = 0, overflow: int = MAILBOX_DROP_OLDEST
+    ) -> Mailbox | None:
+        """Registers a function to be called when a message is received for this badge in the specified protocol.
+        With a mailbox_size, messages are queued in a Mailbox and the callback runs in its own task
+        instead of inside recv_all(). Returns the Mailbox, for its stats."""
+        self.register_protocol(protocol)
         port = protocol.port
+        mailbox = None
         if callback is not None:
-            if port not in self.receive_callbacks:
+            if mailbox_size:
+                mailbox = Mailbox(callback, mailbox_size, overflow, self.rx_idle)
+                self.mailboxes.append(mailbox)
+                callback = mailbox
+            if self.receive_callbacks[port] is None:
                 self.receive_callbacks[port] = []
             self.receive_callbacks[port].append(callback)
-        self.register_protocol(protocol)
+        return mailbox
+
+    def send(self, message: NetworkFrame, tx_class: int = TX_CLASS_LOCAL, flood: bool = False) -> int:
+        """Queue a message to be sent to the network.
+        Unicasts are routed if there's a recent route to the destination, unless `flood`.
+        Returns SEND_ACCEPTED or SEND_QUEUED if it was queued, or SEND_REJECTED if the queue for tx_class is full
+        or the message's port has used up its airtime budget."""
+        if message.source == 0:  # Not set yet
+            message.source = self.address
+        # A full queue rejects the message before its airtime is charged, so it costs no budget
+        if self.transmit_queue.full(tx_class):
+            self.transmit_queue.drops[tx_class] += 1
+            return SEND_REJECTED
+        # Serialized now, so the airtime charged is for the frame as sent, trimmed or not
+        if not self.airtime.admit(message.port, len(message.serialize())):
+            return SEND_REJECTED
+        if message.destination != BROADCAST_ADDRESS and message.ttl:
+            route = ROUTE_FLOOD if flood else self._route(message.destination)
+            frame = message.frame
+            if route != frame[4] >> ROUTE_SHIFT:
+                frame = bytearray(frame)
+                frame[4] = frame[4] & ~ROUTE_MASK | route << ROUTE_SHIFT
+                message.frame = frame
+            if route != ROUTE_FLOOD:
+                self.routed_sent += 1
+        return self._queue_transmit(message, tx_class)
+
+    def _route(self, destination: int) -> int:
+        """The route field for a frame from this badge to `destination`: 1 + the relays between them, or ROUTE_FLOOD."""
+        if not self.route_unicasts:
+            return ROUTE_FLOOD
+        hops = self.neighbors.route(destination, ROUTE_MAX_AGE_MS, ROUTE_MIN_PRR)
+        if hops is None or hops < ROUTE_MIN_HOPS or hops >= MAX_ROUTE:
+            return ROUTE_FLOOD
+        return hops + 1
+
+    def _route_relay(self, relay: NetworkFrame) -> bool:
+        """Whether to repeat a unicast, marking it with this badge's distance to the destination.
+        Floods are repeated as they are. A routed frame is only repeated by badges closer to the destination
+        than the one it came from, badges that don't know the way leave it to those that do."""
+        route = relay.frame[4] >> ROUTE_SHIFT
+        if route != ROUTE_FLOOD:
+            own_route = self._route(relay.destination)
+            if own_route == ROUTE_FLOOD or own_route >= route:
+                self.route_drops += 1
+                return False
+            relay.frame[4] = relay.frame[4] & ~ROUTE_MASK | own_route << ROUTE_SHIFT
+        return True
+
+    def _queue_transmit(self, message: NetworkFrame, tx_class: int) -> int:
+        message.queued_ms = time.ticks_ms()
+        status = self.transmit_queue.push(message, tx_class)
+        if status != SEND_REJECTED:
+            self._transmit_ready.set()
+        return status
+
+    def _tx_done(self):
+        """Called by the radio when it finishes transmitting."""
+        messages = self._transmitting
+        if messages is None:
+            return
+        self._transmitting = None
+        now = time.ticks_ms()
+        for message in messages:
+            latency_ms = time.ticks_diff(now, message.queued_ms)
+            if message.source == self.address:
+                self.send_latency.add(latency_ms)
+            else:
+                self.relay_latency.add(latency_ms)
+                if message.destination != BROADCAST_ADDRESS:
+                    self.unicast_relays += 1
+                self._release_relay(message)
+
+    def _relay_delay_ms(self, length: int) -> int:
+        """Backoff before repeating a frame just received, shorter the weaker the frame was heard.
+        Either a low RSSI or a low SNR counts as far away."""
+        closeness = min(
+            _closeness(self.badge.lora.get_rssi(), RELAY_RSSI_FAR_DBM, RELAY_RSSI_NEAR_DBM),
+            _closeness(self.badge.lora.get_snr(), RELAY_SNR_FAR_DB, RELAY_SNR_NEAR_DB),
+        )
+        slot_ms = self.airtime.time_on_air_ms(length) or RELAY_MIN_SLOT_MS
+        jitter = random.getrandbits(8) / 256
+        return int(slot_ms * (self.relay_window_slots * closeness + RELAY_JITTER_SLOTS * jitter))
+
+    def _hold_relay(self, message: NetworkFrame, key: int, due: int | None = None):
+        """Keep a relay back for its backoff, relay_all() queues or cancels it when the time is up.
+        `due` is when it's up, by default after the backoff for this frame alone."""
+        if len(self.relay_hold) >= RELAY_HOLD_SIZE:
+            self.relay_hold_drops += 1
+            frame_pool.release(message)
+            return
+        self.relays_held += 1
+        if due is None:
+            due = time.ticks_add(time.ticks_ms(), self._relay_delay_ms(len(message.frame)))
+        self._insert_held(due, message, key)
+
+    def _insert_held(self, due: int, message: NetworkFrame, key: int):
+        index = len(self.relay_hold)
+        while index and time.ticks_diff(self.relay_hold[index - 1][0], due) > 0:
+            index -= 1
+        self.relay_hold.insert(index, (due, message, key))
+        self._relay_held.set()
+
+    def _queue_relay(self, message: NetworkFrame, key: int):
+        """Queue a relay unless other badges have already repeated it enough."""
+        # One sighting is the frame this relay came from, the rest are repeats by other badges
+        if self.recently_seen_messages.get(key) > self.relay_cancel_copies:
+            self.relays_cancelled += 1
+            frame_pool.release(message)
+            return
+        # Relays have their own queue, so a busy channel can't crowd out local messages
+        if not (
+            self.airtime.admit_relay(len(message.frame))
+            and self._queue_transmit(message, TX_CLASS_RELAY) != SEND_REJECTED
+        ):
+            frame_pool.release(message)
+
+    async def relay_all(self):
+        while True:
+            if not self.relay_hold:
+                self._relay_held.clear()
+                await self._relay_held.wait()
+                continue
+            wait_ms = time.ticks_diff(self.relay_hold[0][0], time.ticks_ms())
+            if wait_ms > 0:
+                # Wake early if a relay due sooner is held meanwhile
+                self._relay_held.clear()
+                try:
+                    await aio.wait_for_ms(self._relay_held.wait(), wait_ms)
+                except aio.TimeoutError:
+                    pass
+                continue
+            _, message, key = self.relay_hold.pop(0)
+            if self.badge.lora.rx_busy():
+                # Likely another badge's copy of it arriving. Hear it out, then decide.
+                self._insert_held(time.ticks_add(time.ticks_ms(), RELAY_BUSY_RECHECK_MS), message, key)
+                continue
+            self._queue_relay(message, key)
+
+    def _release_relay(self, message: NetworkFrame):
+        """Relays come from frame_pool in check_for_retransmit(), give them back once they're done with.
+        Messages from apps belong to the app, and badgeshark may still hold on to captured ones."""
+        if message.source != self.address and not self.capture_all_packets:
+            frame_pool.release(message)
 
     async def recv_all(self):
+        lora = self.badge.lora
         while True:
+            handled = 0
             try:
-                frame = await self.badge.lora.recv()
-                if frame is not None and len(frame) > 0:
-                    # print("frame: ", repr(frame))
-                    # rssi = self.badge.lora.get_rssi()
-                    # snr = self.badge.lora.get_snr()
-                    # print("rssi: ", rssi)
-                    # print("snr: ", snr)
+                if not lora.rx_pending():
+                    self.rx_idle.set()
+                frame = await lora.recv()
+                self.rx_idle.clear()
+                # Handle everything that's arrived in one go, until the slice's time is up
+                start = time.ticks_ms()
+                while frame is not None:
                     try:
-                        message = NetworkFrame().set_frame(frame).validate_frame()
-                        # print(f"Received frame {repr(message)}")
-                    except (ValueError, IndexError) as err:
-                        print(f"Failed validation {repr(frame)}: {err}")
-                        continue
-
-                    if self.capture_all_packets and len(message.frame):
-                        self.promiscuous_queue.append(message)
-                    # Check if messages haven't been seen before and add them to the transmit queue for repeating
-                    seen_checksum = struct.unpack(
-                        "!H", message.frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2]
-                    )[0]
-                    seen_count, seen_timestamp = self.recently_seen_messages.get(seen_checksum, (0, time.time()))
-                    self.recently_seen_messages[seen_checksum] = (seen_count + 1, seen_timestamp)
-                    # print(f"Seen {seen_checksum} @ {seen_timestamp} x {seen_count}")
-                    if seen_count == 0:
-                        # Check how many times this has been recently seen, and if not, add it to the tx queue
-                        retransmit_message = message.check_for_retransmit(MY_ADDRESS)
-                        if retransmit_message and len(self.transmit_queue) < self.transmit_queue_max_len // 2:
-                            # Decrement TTL and re-transmit if not expired (done in check_for_retransmit)
-                            self.transmit_queue.append(retransmit_message)
-                    else:
-                        # This message has been seen before, no need to reprocess it
-                        continue
-                    message.deserialize(self.protocols)
-                    # print(f"Decoded frame {repr(message)}")
-                    if message.check_for_me(MY_ADDRESS, BROADCAST_ADDRESS):
-                        if message.port in self.receive_callbacks and len(
-                            message.payload_bytes
-                        ) == struct.calcsize(message.protocol.structdef):
-                            # If multiple protocols are defined on the same port by different badges, only
-                            # send the message to the app if it matches the app's protocol definition for this port.
-                            for callback in self.receive_callbacks[message.port]:
-                                try:
-                                    callback(message)
-                                except Exception as ex:
-                                    print(f"Exception in callback for message in protocol {message.protocol.name}")
-                                    sys.print_exception(ex)
+                        if len(frame) > 0:
+                            self.airtime.record_rx(len(frame))
+                            # print("frame: ", repr(frame))
+                            # rssi = self.badge.lora.get_rssi()
+                            # snr = self.badge.lora.get_snr()
+                            # print("rssi: ", rssi)
+                            # print("snr: ", snr)
+                            self._receive_frame(frame)
+                    finally:
+                        # The frame is a view of the radio's receive buffer, anything kept has been copied
+                        lora.release_rx()
+                    handled += 1
+                    if not lora.rx_pending():
+                        break
+                    if time.ticks_diff(time.ticks_ms(), start) >= self.rx_slice_ms:
+                        self.rx_slices_cut += 1
+                        break
+                    frame = await lora.recv()  # Returns straight away, there's one waiting
+                self.rx_slices += 1
+                if handled > self.rx_batch_max:
+                    self.rx_batch_max = handled
             except Exception as exc:
                 print("Recv error:", exc)
                 raise
-            await aio.sleep(0.001)
+            # Let other tasks run between slices. Without a radio recv() doesn't wait, so don't spin.
+            await aio.sleep(0 if handled else 0.001)
+
+    def _receive_frame(self, frame, relay_due: int | None = None, container_source: int | None = None):
+        """Validate, relay and deliver one received frame.
+        Frames that came out of a container have the container's `relay_due` time and source."""
+        message = frame_pool.acquire()
+        try:
+            message.set_frame(frame).validate_frame()
+            # print(f"Received frame {repr(message)}")
+        except (ValueError, IndexError) as err:
+            print(f"Failed validation {repr(frame)}: {err}")
+            frame_pool.release(message)
+            return
+
+        captured = self.capture_all_packets
+        if captured:
+            self.promiscuous_queue.append(message.own_frame())
+        if message.port == AGGREGATE_PROTO.port:
+            # Containers aren't relayed or delivered, only the frames in them. Don't trust what's
+            # inside one that failed its checksum, and don't look for containers inside containers.
+            if message.validated_frame and relay_due is None:
+                # Containers are never relayed, so this one came straight from its source
+                self._heard(message, True)
+                self._unpack_aggregate(message.frame, message.source)
+            if not captured:
+                frame_pool.release(message)
+            return
+        # Check if messages haven't been seen before and add them to the transmit queue for repeating
+        key = frame_key(message.frame)
+        seen_count = self.recently_seen_messages.increment(key)
+        # print(f"Seen {key:x} x {seen_count}")
+        if seen_count == 0:
+            # Only the first copy, later ones are relays of a frame already counted
+            self._heard(message, None if container_source is None else message.source == container_source)
+            # Check how many times this has been recently seen, and if not, add it to the tx queue
+            retransmit_message = message.check_for_retransmit(self.address)
+            if retransmit_message and message.destination != BROADCAST_ADDRESS and not self._route_relay(retransmit_message):
+                frame_pool.release(retransmit_message)
+                retransmit_message = None
+            if retransmit_message:
+                # Decrement TTL and re-transmit if not expired (done in check_for_retransmit)
+                if self.relay_window_slots:
+                    self._hold_relay(retransmit_message, key, relay_due)
+                else:
+                    self._queue_relay(retransmit_message, key)
+        else:
+            # This message has been seen before, no need to reprocess it
+            if not captured:
+                frame_pool.release(message)
+            return
+        codec = self.codecs[message.port]
+        for_me = message.check_for_me(self.address, BROADCAST_ADDRESS)
+        callbacks = self.receive_callbacks[message.port] if for_me else None
+        if callbacks:
+            message.own_frame()  # Apps may keep the message
+        message.decode(codec)
+        # print(f"Decoded frame {repr(message)}")
+        delivered = False
+        if for_me:
+            if callbacks and codec.fits(message.frame):
+                # If multiple protocols are defined on the same port by different badges, only
+                # send the message to the app if it matches the app's protocol definition for this port.
+                # Apps may keep the message, so it's never returned to the pool.
+                delivered = True
+                for callback in callbacks:
+                    try:
+                        callback(message)
+                    except Exception as ex:
+                        print(f"Exception in callback for message in protocol {message.protocol.name}")
+                        sys.print_exception(ex)
+        if not delivered and not captured:
+            frame_pool.release(message)
+
+    def _heard(self, message: NetworkFrame, direct: bool | None):
+        if message.source != self.address:
+            self.neighbors.heard(
+                message.source, message.seq_num, message.ttl, self.badge.lora.get_rssi(), self.badge.lora.get_snr(), direct
+            )
+
+    def _unpack_aggregate(self, frame, source: int):
+        """Receive each frame packed in a container, in order.
+        Their relays share one backoff, so they come due together and go back out in one container too."""
+        codec = self.codecs[AGGREGATE_PROTO.port]
+        if not codec.fits(frame):
+            # Cut short without being trimmed, there's no telling where its frames end
+            print(f"Bad container length {len(frame)}")
+            self.containers_dropped += 1
+            return
+        self.containers_received += 1
+        relay_due = time.ticks_add(time.ticks_ms(), self._relay_delay_ms(len(frame)))
+        payload = codec.decode(frame)[0]
+        offset = 0
+        end = len(payload)
+        # The payload is padded with zeros after the last frame, which ends the loop at the syncword check
+        while offset + HEADER_LEN <= end and payload[offset] == SYNCWORD[0] and payload[offset + 1] == SYNCWORD[1]:
+            frame_len = payload[offset + 5]
+            if frame_len < HEADER_LEN or offset + frame_len > end:
+                print(f"Bad frame length {frame_len} at {offset} in container")
+                self.containers_dropped += 1
+                return
+            self._receive_frame(payload[offset : offset + frame_len], relay_due, source)
+            offset += frame_len
+
+    def _repeated(self, message: NetworkFrame, key: int) -> bool:
+        """Drop a message about to be sent if it's been heard too often since it was queued.
+        A local message is sent if it's never been seen, or once (it was sent). Relays get the
+        same check as when they were queued, other badges may have repeated them since."""
+        limit = 1 if message.source == self.address else self.relay_cancel_copies
+        if self.recently_seen_messages.get(key) <= limit:
+            return False
+        # print(
+        #     f"Dropping recently repeated message {key:x} before transmit."
+        # )
+        # print(self.recently_seen_messages)
+        if message.source != self.address:
+            self.relays_cancelled += 1
+        self._release_relay(message)
+        return True
+
+    def _fill_aggregate(self, messages: list, keys: list):
+        """Add queued messages to `messages` while they fit in one container with the ones already there."""
+        room = MAX_FRAME_LEN - HEADER_LEN - sum(len(message.frame) for message in messages)
+        while room >= HEADER_LEN and self.transmit_queue:
+            message = self.transmit_queue.pop(room)
+            if message is None:
+                return  # The next one doesn't fit, it goes in the next transmission
+            key = frame_key(message.frame)
+            if self._repeated(message, key):
+                continue
+            messages.append(message)
+            keys.append(key)
+            room -= len(message.frame)
+
+    def _pack_aggregate(self, messages: list) -> bytes:
+        container = NetworkFrame().set_fields(
+            protocol=AGGREGATE_PROTO,
+            destination=BROADCAST_ADDRESS,
+            payload=b"".join(message.frame for message in messages),
+            source=self.address,
+        )
+        return container.serialize()
 
     async def send_all(self):
         while True:
@@ -152,72 +621,70 @@ class BadgeNet:
                     # print(f"Tx queue len: {len(self.transmit_queue)}")
                     message = None
                     while message is None:
-                        message = self.transmit_queue.popleft()
+                        # Wait out the cooldown before picking the message, so the duplicate check below
+                        # counts every copy heard until the moment it's sent
+                        time_since_last_tx_ms = time.ticks_diff(time.ticks_ms(), self.last_tx_ms)
+                        if time_since_last_tx_ms < self.transmit_cooldown_ms:
+                            await aio.sleep_ms(self.transmit_cooldown_ms - time_since_last_tx_ms)
+                        message = self.transmit_queue.pop()
                         if message.source == 0:  # Not set yet
-                            message.source = MY_ADDRESS
+                            message.source = self.address
                         message.serialize()
-                        checksum = struct.unpack(
-                            "!H", message.frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2]
-                        )[0]
-                        if self.recently_seen_messages.get(checksum, (0, 0))[0] > 1:
-                            # If a message has been seen never or once, send it.
-                            # print(
-                            #     f"Dropping recently repeated message with checksum {checksum:x} before transmit."
-                            # )
-                            # print(self.recently_seen_messages)
-                            continue
-                        # else:
-                        #     print(f"New message from {message.source:x} with checksum {checksum:x}")
-                        # recent_checksums = [f"{cs:x}" for cs in self.recently_seen_messages]
-                        # print(f"{recent_checksums}")
-                        # Check if the Tx queue is too full, and if it is, stop relaying messages in favor of local messages
-                        # Throw out the relayed messages until the queue is more empty
-                        if len(self.transmit_queue) > self.transmit_queue_max_len // 2 and message.source != MY_ADDRESS:
+                        key = frame_key(message.frame)
+                        if message.source != self.address:
+                            # Hear out a frame that's arriving, it may be another badge's copy of this relay
+                            while self.badge.lora.rx_busy():
+                                await aio.sleep_ms(RELAY_BUSY_RECHECK_MS)
+                        if self._repeated(message, key):
                             message = None
                             continue
-                    time_since_last_tx = time.time() - self.last_tx_time
-                    if time_since_last_tx < self.transmit_cooldown_s:
-                        await aio.sleep(self.transmit_cooldown_s - time_since_last_tx)
-                    try:
-                        await self.badge.lora.send(message.frame)
-                    except Exception as err:
-                        print(f"Failed sending: {err}")
-                        continue
-                    self.last_tx_time = time.time()
-                    if self.capture_all_packets:
-                        self.promiscuous_queue.append(message)
-                    self.recently_seen_messages[message.checksum] = (
-                        2,
-                        self.last_tx_time,
-                    )  # type: ignore
+                        # else:
+                        #     print(f"New message from {message.source:x} with key {key:x}")
                 except IndexError:
-                    await aio.sleep(1)
+                    # Everything left in the queue was dropped
                     continue
+                messages = [message]
+                keys = [key]
+                if self.aggregate_frames and self.transmit_queue:
+                    self._fill_aggregate(messages, keys)
+                if len(messages) > 1:
+                    frame = self._pack_aggregate(messages)
+                    self.containers_sent += 1
+                    self.frames_aggregated += len(messages)
+                else:
+                    frame = message.frame
+                try:
+                    self._transmitting = messages  # Relays go back to the pool on TX_DONE
+                    await self.badge.lora.send(frame)
+                except Exception as err:
+                    self._transmitting = None
+                    print(f"Failed sending: {err}")
+                    for message in messages:
+                        self._release_relay(message)
+                    continue
+                self.last_tx_ms = time.ticks_ms()
+                self.airtime.record_tx(len(frame))
+                for message, key in zip(messages, keys):
+                    if self.capture_all_packets:
+                        self.promiscuous_queue.append(message)
+                    self.recently_seen_messages.set(key, 2)
                 await aio.sleep(self.send_cooldown_s)
             else:
-                await aio.sleep(1)
-
-    async def flush_recently_seen(self):
-        while True:
-            # print(
-            #     f"Badgenet: Purging messages from recently seen cache, initial len {len(self.recently_seen_messages)}"
-            # )
-            now = time.time()
-            self.recently_seen_messages = {
-                checksum: count_time_seen
-                for checksum, count_time_seen in self.recently_seen_messages.items()
-                if now - count_time_seen[1] < RECENT_MESSAGE_EXPIRATION_S
-            }
-            await aio.sleep(1)
+                # Sleep until send() queues something, no polling while idle
+                self._transmit_ready.clear()
+                await self._transmit_ready.wait()
 
 
 # Network Stack singleton
 badgenet = BadgeNet()
 
 
-def register_receiver(protocol: Protocol, callback=None):
-    """Register a callback for incoming messages on a specific port."""
-    badgenet.register_receiver(protocol, callback)
+def register_receiver(
+    protocol: Protocol, callback=None, mailbox_size: int = 0, overflow: int = MAILBOX_DROP_OLDEST
+) -> Mailbox | None:
+    """Register a callback for incoming messages on a specific port.
+    Give a mailbox_size for callbacks that are slow, so they run in their own task."""
+    return badgenet.register_receiver(protocol, callback, mailbox_size, overflow)
 
 
 def register_protocol(protocol: Protocol):
@@ -226,9 +693,16 @@ def register_protocol(protocol: Protocol):
     badgenet.register_protocol(protocol)
 
 
-def send(message: NetworkFrame):
-    """Send a message to the network"""
-    badgenet.transmit_queue.append(message)
+def send(message: NetworkFrame, tx_class: int = TX_CLASS_LOCAL, flood: bool = False) -> int:
+    """Send a message to the network. Unicasts follow a learned route to their destination unless `flood`.
+    Returns SEND_ACCEPTED or SEND_QUEUED if it was queued, or SEND_REJECTED if the transmit queue is full."""
+    return badgenet.send(message, tx_class, flood)
+
+
+def set_radio_power_mode(mode: int, low_power_mesh: bool | None = None):
+    """Switch the radio between net.lora.POWER_CONTINUOUS, POWER_DUTY_CYCLE and POWER_SLEEP,
+    e.g. duty cycle while the screen is off."""
+    badgenet.set_radio_power_mode(mode, low_power_mesh)
 
 
 def capture_all_packets(enabled: bool):
@@ -8,14 +8,7 @@ from collections import namedtuple
 import struct
 import time
 
-from libs.crc import Calculator, Crc16
-
-crc_calculator = Calculator(Crc16.xmodem)
-# On micropython, switch to the viper implementation for faster execution
-try:
-    from libs.crc import Opt_viper
-except (ImportError, NameError):
-    pass
+from net.crc16 import crc16_xmodem
 
 Protocol = namedtuple("Protocol", ("port", "name", "structdef"))
 
@@ -26,7 +19,8 @@ Protocol = namedtuple("Protocol", ("port", "name", "structdef"))
 #  0: 2 bytes: Header 0x07E9 (2025)
 #  2: 2 bytes: Checksum (everything in packet after TTL field)
 #  4: 1 byte: Flags and TTL
-## bits 7-4: Reserved
+## bits 7-5: Route, 0 if the frame is flooded, or 1 + how many relays the badge sending it is from its destination
+## bit 4: Trimmed, trailing zero bytes of the payload were left off (FLAG_TRIMMED)
 ## bits 3-0: TTL
 #  5: 1 byte: Packet length [16-250]
 #  6: 4 bytes: Destination Address
@@ -40,34 +34,74 @@ HEADER_LEN = struct.calcsize(FRAME_STRUCTURE) + 4
 assert HEADER_LEN == 16, "Packet Header struct incorrect size"
 MAX_FRAME_LEN = 250
 CHECKSUM_OFFSET = 2
+FLAG_TRIMMED = 0x10
+# Relays only repeat a routed frame if they're closer to its destination than the badge they heard
+# it from, see BadgeNet._route_relay(). Like the TTL, the route isn't covered by the checksum.
+ROUTE_SHIFT = 5
+ROUTE_MASK = 0xE0
+ROUTE_FLOOD = 0
+MAX_ROUTE = 7
+# Whether frames are sent without the zero bytes padding out the end of the payload, e.g. the rest
+# of a short chat message's text field. Receivers always put them back, but badges from before
+# trimming can't decode trimmed frames, so it's off until every badge can (config "trim_payloads").
+# Read on every encode, so it can be changed at any time.
+TRIM_PAYLOADS = False
 
 NULL_PROTO = Protocol(0, "UNKNOWN_PROTOCOL", f"!{MAX_FRAME_LEN - HEADER_LEN}s")
+# Container for several whole frames sent in one transmission, back to back in the payload. Each
+# frame's length byte says where the next one starts. Containers are never relayed themselves,
+# the frames inside are handled (and relayed) as if they had been received one by one.
+AGGREGATE_PROTO = Protocol(3, "AGGREGATE", f"!{MAX_FRAME_LEN - HEADER_LEN}s")
 
 global_sequence: int = 0
 
 
 class NetworkFrame:
+    # Keeps instances small on CPython. Micropython ignores __slots__, but setting an attribute
+    # that isn't listed here fails on the host, so add any new attributes here too.
+    __slots__ = (
+        "protocol",
+        "source",
+        "destination",
+        "port",
+        "seq_num",
+        "payload",
+        "payload_bytes",
+        "ttl",
+        "checksum",
+        "frame",
+        "timestamp",
+        "validated_frame",
+        "fields_set",
+        "queued_ms",
+    )
+
     def __init__(self):
-        self.protocol: Protocol
+        self.reset()
+
+    def reset(self):
+        """Clear every field, so the frame can be reused from a FramePool."""
+        self.protocol: Protocol | None = None
         self.source: int = 0
         self.destination: int = 0
         self.port: int = 0
         self.seq_num: int = 0
-        self.payload: tuple | list = []
-        self.payload_bytes: bytes = b""
+        self.payload: tuple | list = ()
+        self.payload_bytes: bytes | memoryview = b""
         self.ttl: int = 0
         self.checksum: int = 0
-        self.frame: bytes = b""
+        self.frame: bytes | bytearray | memoryview = b""
         self.timestamp: int = 0
         self.validated_frame: bool = False
         self.fields_set: bool = False
+        self.queued_ms: int = 0  # time.ticks_ms() when added to the transmit queue
 
     def __repr__(self):
         if self.fields_set:
             if self.payload:
                 payload = repr(self.payload)
             else:
-                payload = repr(self.payload_bytes)
+                payload = repr(bytes(self.payload_bytes))
             if self.protocol is not None:
                 return f"NetworkFrame({self.protocol.name}, dst:{self.destination:x}, src:{self.source:x}, ttl:{self.ttl} {payload}"
             return f"NetworkFrame([Unknown port [{self.port}]]), dst:{self.destination:x}, src:{self.source:x}, ttl:{self.ttl} {payload}"
@@ -104,17 +138,28 @@ class NetworkFrame:
         return self
 
     def set_frame(self, frame):
+        if len(frame) < HEADER_LEN:
+            raise ValueError(
+                f"Frame shorter [{len(frame)}] than required header [{HEADER_LEN}], Invalid."
+            )
         self.frame = frame
-        self.ttl = frame[4] & 0x0F
-        self.destination = int.from_bytes(frame[6:10], "big")
-        self.source = int.from_bytes(frame[10:14], "big")
-        self.port = frame[14]
-        self.seq_num = frame[15]
+        # One unpack of the whole header instead of slicing out each field
+        flags_ttl, _, self.destination, self.source, self.port, self.seq_num = struct.unpack_from(
+            FRAME_STRUCTURE, frame, 4
+        )
+        self.ttl = flags_ttl & 0x0F
         self.validated_frame = False
         if not self.timestamp:
             self.timestamp = time.time() # type: ignore
         return self
 
+    def own_frame(self):
+        """Copy a received frame out of the radio's receive buffer it's a view of, for messages
+        kept past the receive call (delivered to apps, captured). Call before decode()."""
+        if isinstance(self.frame, memoryview):
+            self.frame = bytes(self.frame)
+        return self
+
     def validate_frame(self):
         if self.validated_frame:
             return self
@@ -128,9 +173,9 @@ class NetworkFrame:
             raise ValueError(
                 f"Frame too long [{frame_actual_len}] for LoRa [{MAX_FRAME_LEN}]. Invalid."
             )
-        if frame[:2] != SYNCWORD:
+        if frame[0] != SYNCWORD[0] or frame[1] != SYNCWORD[1]:
             raise ValueError(
-                f"Frame does not start [{repr(frame[:2])}] with expected syncword [{repr(SYNCWORD)}]. Invalid."
+                f"Frame does not start [{repr(bytes(frame[:2]))}] with expected syncword [{repr(SYNCWORD)}]. Invalid."
             )
         frame_claimed_len = int(frame[5])
         # frame_theoretical_len = HEADER_LEN + struct.calcsize(self.protocol.structdef)
@@ -149,97 +194,67 @@ class NetworkFrame:
             print(
                 f"Warning: frame truncated due to being longer [{frame_actual_len}] than reported length [{frame_claimed_len}]."
             )
-        claimed_checksum = frame[2:4]
-        calced_checksum = crc_calculator.checksum(frame[5:])
+        claimed_checksum = frame[2] << 8 | frame[3]
+        calced_checksum = crc16_xmodem(memoryview(frame)[5:])
         self.validated_frame = claimed_checksum == calced_checksum
         return self
 
     def serialize(self) -> bytes:
         if self.frame:
             return self.frame
-        flags_ttl = 0 | self.ttl
+        codec = compile_protocol(self.protocol)
         if isinstance(self.payload, (tuple, list)) and self.payload:
-            payload = struct.pack(self.protocol.structdef, *self.payload)
+            payload = self.payload
         elif isinstance(self.payload_bytes, bytes):
-            payload_max_len = struct.calcsize(self.protocol.structdef)
-            payload_len = len(self.payload_bytes)
-            if payload_len > payload_max_len:
-                raise ValueError(
-                    f"Payload too long for protocol {self.protocol.name}: [{repr(self.payload_bytes)}]"
-                )
-            elif payload_len < payload_max_len:
-                payload = self.payload_bytes + (b"\0" * (payload_max_len - payload_len))
-            else:
-                payload = self.payload_bytes
+            payload = self.payload_bytes
         else:
             raise ValueError(
                 f"Unknown payload for protocol {self.protocol.name}: [{self.payload}][{self.payload_bytes}]"
             )
-        frame_length = len(payload) + HEADER_LEN
         try:
-            frame = (
-                struct.pack(
-                    FRAME_STRUCTURE,
-                    flags_ttl,
-                    frame_length,
-                    self.destination,
-                    self.source,
-                    self.protocol.port,
-                    self.seq_num & 0xFF,
-                )
-                + payload
-            )
+            self.frame, self.checksum = codec.encode(self.ttl, self.destination, self.source, self.seq_num, payload)
         except Exception as err:
             print(f"Serialization failed for message: {err}")
             print(
-                f"flags_ttl: {flags_ttl} frame_length: {frame_length} dst: {self.destination} src: {self.source} port: {self.protocol.port}, payload: {repr(payload)}"
+                f"ttl: {self.ttl} dst: {self.destination} src: {self.source} port: {self.protocol.port}, payload: {repr(payload)}"
             )
             raise
-        try:
-            self.checksum = crc_calculator.checksum(frame[5:])
-        except Exception as err:
-            print(f"Checksumming failed for message: {err}")
-            raise
-        self.frame = struct.pack(f"!2sH{len(frame)}s", SYNCWORD, self.checksum, frame)
-        # Debug: Check that the frame was valid after serialization
-        self.validate_frame()
-        return frame
+        self.validated_frame = True
+        return self.frame
 
     def deserialize(self, protocols: dict[int, Protocol]):
+        """Decode the payload with the protocol registered for this frame's port, if any."""
+        protocol = protocols.get(self.port)
+        return self.decode(compile_protocol(protocol) if protocol is not None else None)
+
+    def decode(self, codec):
+        """Decode the payload with a compiled ProtocolCodec, or None if the port's protocol is unknown."""
         # If already deserialized, return.
         if self.fields_set:
             return self
         # Validate if not done yet.
-        if self.validated_frame:
-            frame = self.frame
-        else:
+        if not self.validated_frame:
             try:
-                frame = self.validate_frame()
+                self.validate_frame()
             except ValueError as err:
                 print(f"Validation failed, could not deserialze: {err}")
                 raise
         frame = self.frame
-        self.ttl = frame[4] & 0x0F
-        self.destination = int.from_bytes(frame[6:10], "big")
-        self.source = int.from_bytes(frame[10:14], "big")
-        self.port = frame[14]
-        self.seq_num = frame[15]
-        self.payload_bytes = frame[HEADER_LEN:]
-        try:
-            self.protocol = protocols[self.port]
+        # Header fields were already parsed by set_frame(), and the payload is a view, not a copy
+        self.payload_bytes = memoryview(frame)[HEADER_LEN:]
+        if codec is not None:
+            self.protocol = codec.protocol
             try:
-                self.payload = struct.unpack_from(
-                    self.protocol.structdef, frame, HEADER_LEN
-                )
+                self.payload = codec.decode(frame)
             except ValueError as err:
                 print(
-                    f"Unable to decode payload for protocol {self.protocol.name}: {repr(self.payload_bytes)}: {err}"
+                    f"Unable to decode payload for protocol {codec.protocol.name}: {repr(bytes(self.payload_bytes))}: {err}"
                 )
-                self.payload = []
-        except KeyError as err:
-            # print(f"Unknown protocol on port {err}, can't decode payload.")
+                self.payload = ()
+        else:
+            # print(f"Unknown protocol on port {self.port}, can't decode payload.")
             self.protocol = None
-            self.payload = []
+            self.payload = ()
         self.fields_set = True
         return self
 
@@ -247,25 +262,142 @@ class NetworkFrame:
         """Checks if a message should be retransmitted.
         Don't retransmit if: this is the expected destination or the TTL has reached 0.
         Returns a new message with decremented TTL or None if it shouldn't be retransmitted.
+        The new message comes from frame_pool, release it there once it's been sent.
         """
-        destination = int.from_bytes(self.frame[6:10], "big")
-        if destination == exclude_destination:
+        if self.destination == exclude_destination:
             return None
         ttl = self.frame[4] & 0x0F
         if 0 < ttl < 16:
             # Only 4 bytes allowed for TTL, so check it's positive and hasn't overflowed.
-            new_ttl_byte = self.frame[4] & 0xF0 | (ttl - 1)
-            new_frame = self.frame[:4] + new_ttl_byte.to_bytes() + self.frame[5:]
+            # The TTL isn't covered by the checksum, so patch it in a copy of the frame
+            new_frame = bytearray(self.frame)
+            new_frame[4] = new_frame[4] & 0xF0 | (ttl - 1)
             # checksum = struct.unpack(
             #     "!H", new_frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2]
             # )[0]
             # print(f"Queueing {repr(new_frame)} for retransmit. TTL was {ttl} is {new_ttl_byte}. Checksum: {checksum:x}")
-            return NetworkFrame().set_frame(new_frame)
+            return frame_pool.acquire().set_frame(new_frame)
         return None
 
     def check_for_me(self, my_address: int, broadcast_address: int):
         """Checks a frame before its been deserialzed if it is meant for this badge."""
-        destination = int.from_bytes(self.frame[6:10], "big")
-        source = int.from_bytes(self.frame[10:14], "big")
-        # print(f"dest:{destination:x} me:{my_address:x} brd:{broadcast_address:x} from {source:x}")
-        return (destination in (my_address, broadcast_address)) and source != my_address
+        destination = self.destination
+        # print(f"dest:{destination:x} me:{my_address:x} brd:{broadcast_address:x} from {self.source:x}")
+        return (destination == my_address or destination == broadcast_address) and self.source != my_address
+
+
+class ProtocolCodec:
+    """A Protocol compiled for encoding and decoding frames.
+    The payload size and the pack format for the whole frame are worked out once,
+    and frames are packed into a preallocated buffer.
+
+    The structdef is the most the payload can hold. With `trim`, TRIM_PAYLOADS at encode time if it's
+    None, the zero bytes at the end of the packed payload aren't sent and the frame is marked
+    FLAG_TRIMMED, so a short string in a trailing "100s" field only costs its own length. Decoding pads trimmed frames back out with zeros, which
+    gives exactly what was packed. Untrimmed frames are the full length, as before."""
+
+    def __init__(self, protocol: Protocol, trim: bool | None = None):
+        self.protocol = protocol
+        self.port = protocol.port
+        self.structdef = protocol.structdef
+        self.payload_len = struct.calcsize(protocol.structdef)
+        self.frame_len = HEADER_LEN + self.payload_len
+        if protocol.structdef[0] in "!>":
+            # Big endian without padding, so the header and payload can be packed in one go
+            self.frame_format = FRAME_STRUCTURE + protocol.structdef[1:]
+        else:
+            self.frame_format = None
+        self._buffer = bytearray(self.frame_len)
+        self._buffer[0:2] = SYNCWORD
+        self.trim = trim
+        self._padded = bytearray(self.frame_len)  # Trimmed frames are padded back out here to decode
+        self._padded_view = memoryview(self._padded)
+        self._zeros = memoryview(bytes(self.frame_len))
+
+    def encode(self, ttl: int, destination: int, source: int, seq_num: int, payload: bytes | tuple | list) -> tuple:
+        """Pack a frame. Returns (frame bytes, checksum)."""
+        buffer = self._buffer
+        if isinstance(payload, (tuple, list)):
+            if self.frame_format:
+                struct.pack_into(
+                    self.frame_format, buffer, 4, ttl, self.frame_len, destination, source, self.port, seq_num & 0xFF, *payload
+                )
+            else:
+                struct.pack_into(FRAME_STRUCTURE, buffer, 4, ttl, self.frame_len, destination, source, self.port, seq_num & 0xFF)
+                struct.pack_into(self.structdef, buffer, HEADER_LEN, *payload)
+        else:
+            payload_len = len(payload)
+            if payload_len > self.payload_len:
+                raise ValueError(f"Payload too long for protocol {self.protocol.name}: [{repr(payload)}]")
+            struct.pack_into(FRAME_STRUCTURE, buffer, 4, ttl, self.frame_len, destination, source, self.port, seq_num & 0xFF)
+            buffer[HEADER_LEN : HEADER_LEN + payload_len] = payload
+            for i in range(HEADER_LEN + payload_len, self.frame_len):
+                buffer[i] = 0
+        if TRIM_PAYLOADS if self.trim is None else self.trim:
+            frame = bytes(buffer).rstrip(b"\0")
+            frame_len = len(frame)
+            if frame_len < HEADER_LEN:
+                frame_len = HEADER_LEN  # All zeros, the header can't be trimmed
+            if frame_len < self.frame_len:
+                buffer[4] = ttl | FLAG_TRIMMED
+                buffer[5] = frame_len
+            view = memoryview(buffer)[:frame_len]
+        else:
+            view = memoryview(buffer)
+        checksum = crc16_xmodem(view[5:])
+        buffer[2] = checksum >> 8
+        buffer[3] = checksum & 0xFF
+        return bytes(view), checksum
+
+    def fits(self, frame) -> bool:
+        """If a received frame is the right length for this protocol, full length or trimmed."""
+        frame_len = len(frame)
+        return frame_len == self.frame_len or (frame_len < self.frame_len and (frame[4] & FLAG_TRIMMED) != 0)
+
+    def decode(self, frame) -> tuple:
+        frame_len = len(frame)
+        if frame_len >= self.frame_len or not frame[4] & FLAG_TRIMMED:
+            return struct.unpack_from(self.structdef, frame, HEADER_LEN)
+        padded = self._padded_view
+        padded[:frame_len] = frame
+        padded[frame_len:] = self._zeros[frame_len:]
+        return struct.unpack_from(self.structdef, padded, HEADER_LEN)
+
+
+_codecs: dict = {}  # Protocol: ProtocolCodec
+
+
+def compile_protocol(protocol: Protocol) -> ProtocolCodec:
+    """Get the codec for a protocol, compiling it the first time it's used."""
+    codec = _codecs.get(protocol)
+    if codec is None:
+        codec = ProtocolCodec(protocol)
+        _codecs[protocol] = codec
+    return codec
+
+
+class FramePool:
+    """Recycles NetworkFrame objects, so handling a busy channel doesn't churn the heap.
+
+    Only release a frame once nothing else holds on to it. Frames handed to app callbacks
+    belong to the app and are never released.
+    """
+
+    def __init__(self, size: int = 16):
+        self.size = size
+        self._free = [NetworkFrame() for _ in range(size)]
+        self.misses = 0  # acquire() calls that found the pool empty and allocated
+
+    def acquire(self) -> NetworkFrame:
+        if self._free:
+            return self._free.pop()
+        self.misses += 1
+        return NetworkFrame()
+
+    def release(self, frame: NetworkFrame):
+        if len(self._free) < self.size:
+            frame.reset()
+            self._free.append(frame)
+
+
+frame_pool = FramePool()
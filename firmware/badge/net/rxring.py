@@ -0,0 +1,128 @@
+"""Fixed set of receive buffers, filled by the radio driver and lent to BadgeNet.
+
+Receiving a frame used to allocate a buffer for the driver to read into, a bytes copy of it for
+the receive queue, and more copies further up. The ring's buffers are allocated once: the radio's
+RX_DONE handler reserves one, the driver reads the packet straight into it, and recv() hands
+BadgeNet a memoryview of it. BadgeNet releases it once the frame is handled. Frames are only
+copied out of the ring when something keeps them, i.e. they're delivered to an app (see
+NetworkFrame.own_frame()), so the duplicates and relays that make up most of a busy channel cost
+only the view of their buffer.
+
+The radio's handler and the task calling recv() each only write their own counters, so neither
+can undo the other's update if one interrupts the other (adapt() resets `peak`, but only while
+the ring is empty). A frame arriving while every buffer is in use is dropped and counted in
+`overruns`.
+
+The number of buffers follows the bursts that actually arrive: adapt(), called whenever the ring
+has been emptied, grows it to twice the most frames that were waiting at once, and gives buffers
+back a half at a time after a long quiet spell.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+RX_RING_SLOTS = 16  # Buffers to start with, for frames waiting for recv() plus the one being handled
+RX_RING_MIN_SLOTS = 8
+RX_RING_MAX_SLOTS = 64  # 16KB of buffers
+RX_RING_SHRINK_AFTER = 64  # adapt() calls in a row with bursts under a quarter of the ring before it shrinks
+RX_BUFFER_SIZE = 255  # Longest LoRa packet the SX126x receives
+
+
+class RxRing:
+    """Receive buffers, filled in order by the radio and released in the same order once handled."""
+
+    def __init__(
+        self,
+        slots: int = RX_RING_SLOTS,
+        size: int = RX_BUFFER_SIZE,
+        min_slots: int = RX_RING_MIN_SLOTS,
+        max_slots: int = RX_RING_MAX_SLOTS,
+    ):
+        self.size = size
+        self.min_slots = min(min_slots, slots)
+        self.max_slots = max(max_slots, slots)
+        self._views = []
+        self._resize(slots)
+        self.overruns = 0
+        self.peak = 0  # Most buffers in use at once since the last adapt()
+        self.max_slots_used = slots  # Biggest the ring has been
+        self.resizes = 0
+        self._quiet = 0
+
+    def _resize(self, slots: int):
+        """Set the number of buffers, keeping the ones there are. Only while none are in use."""
+        views = self._views[:slots]
+        while len(views) < slots:
+            views.append(memoryview(bytearray(self.size)))
+        self._views = views
+        self.slots = slots
+        self._lengths = [0] * slots
+        # Counts of buffers filled, taken by pop() and released, modulo a multiple of the slot
+        # count so they stay small ints. Only the radio's handler writes _filled.
+        self._wrap = slots * 1024
+        self._filled = 0
+        self._taken = 0
+        self._released = 0
+
+    def adapt(self):
+        """Resize to the bursts seen since the last call, if no buffer is in use: grow to twice
+        the most buffers used at once straight away, or halve after RX_RING_SHRINK_AFTER calls
+        in a row that never used a quarter of them."""
+        if self._filled != self._released:
+            return
+        target = min(max(2 * self.peak, self.min_slots), self.max_slots)
+        self.peak = 0
+        if target > self.slots:
+            self._resize(target)
+            self.resizes += 1
+            self._quiet = 0
+            if target > self.max_slots_used:
+                self.max_slots_used = target
+        elif target <= self.slots // 2 and self.slots > self.min_slots:
+            self._quiet += 1
+            if self._quiet >= RX_RING_SHRINK_AFTER:
+                self._resize(max(self.slots // 2, self.min_slots))
+                self.resizes += 1
+                self._quiet = 0
+        else:
+            self._quiet = 0
+
+    def reserve(self) -> memoryview | None:
+        """The next buffer to receive into, None if all of them are in use.
+        It's only added to the ring by commit(), so a failed read can just not commit it."""
+        if (self._filled - self._released) % self._wrap >= self.slots:
+            self.overruns += 1
+            return None
+        return self._views[self._filled % self.slots]
+
+    def commit(self, length: int):
+        """Add the buffer from reserve(), holding a `length` byte frame, to the ring."""
+        self._lengths[self._filled % self.slots] = length
+        self._filled = (self._filled + 1) % self._wrap
+        in_use = (self._filled - self._released) % self._wrap
+        if in_use > self.peak:
+            self.peak = in_use
+
+    def pending(self) -> int:
+        """Frames received and not yet taken by pop()."""
+        return (self._filled - self._taken) % self._wrap
+
+    def pop(self) -> memoryview | None:
+        """View of the oldest frame waiting, valid until release() gives its buffer back."""
+        if self._taken == self._filled:
+            return None
+        slot = self._taken % self.slots
+        self._taken = (self._taken + 1) % self._wrap
+        return self._views[slot][: self._lengths[slot]]
+
+    def release(self):
+        """Give back the buffer of the oldest frame taken by pop()."""
+        if self._released != self._taken:
+            self._released = (self._released + 1) % self._wrap
+
+    def __repr__(self):
+        in_use = (self._filled - self._released) % self._wrap
+        return (
+            f"RxRing({in_use}/{self.slots} pending:{self.pending()} overruns:{self.overruns} "
+            f"most slots:{self.max_slots_used} resizes:{self.resizes})"
+        )
@@ -0,0 +1,31 @@
+"""Counters for measuring the network stack.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+
+class LatencyStats:
+    """Running count, mean, and max of a latency in milliseconds. Keeps no history, so it's cheap to update."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0
+        self.max_ms = 0
+        self.last_ms = 0
+
+    def add(self, latency_ms: int):
+        self.count += 1
+        self.total_ms += latency_ms
+        self.last_ms = latency_ms
+        if latency_ms > self.max_ms:
+            self.max_ms = latency_ms
+
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def reset(self):
+        self.__init__()
+
+    def __repr__(self):
+        return f"LatencyStats(count:{self.count} mean:{self.mean_ms():.1f}ms max:{self.max_ms}ms last:{self.last_ms}ms)"
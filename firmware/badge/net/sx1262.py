@@ -6,6 +6,8 @@ _SX126X_PA_CONFIG_SX1262 = const(0x00)
 class SX1262(SX126X):
     TX_DONE = SX126X_IRQ_TX_DONE
     RX_DONE = SX126X_IRQ_RX_DONE
+    HEADER_VALID = SX126X_IRQ_HEADER_VALID
+    CAD_DONE = SX126X_IRQ_CAD_DONE
     ADDR_FILT_OFF = SX126X_GFSK_ADDRESS_FILT_OFF
     ADDR_FILT_NODE = SX126X_GFSK_ADDRESS_FILT_NODE
     ADDR_FILT_NODE_BROAD = SX126X_GFSK_ADDRESS_FILT_NODE_BROADCAST
@@ -15,10 +17,16 @@ class SX1262(SX126X):
     PREAMBLE_DETECT_24 = SX126X_GFSK_PREAMBLE_DETECT_24
     PREAMBLE_DETECT_32 = SX126X_GFSK_PREAMBLE_DETECT_32
     STATUS = ERROR
+    # What the radio does while it isn't transmitting, see setReceiveMode()
+    RX_CONTINUOUS = 0
+    RX_DUTY_CYCLE = 1
+    RX_SLEEP = 2
 
     def __init__(self, spi_host, sck, mosi, miso, cs, irq, rst, gpio):
         super().__init__(spi_host, sck, mosi, miso, cs, irq, rst, gpio)
         self._callbackFunction = self._dummyFunction
+        self._rxMode = self.RX_CONTINUOUS
+        self._senderPreambleLength = 0
 
     def begin(self, freq=434.0, bw=125.0, sf=9, cr=7, syncWord=SX126X_SYNC_WORD_PRIVATE,
               power=14, currentLimit=60.0, preambleLength=8, implicit=False, implicitLen=0xFF,
@@ -148,17 +156,17 @@ class SX1262(SX126X):
     def setRxIq(self, rxIq):
         self._rxIq = rxIq
         if not self.blocking:
-            ASSERT(super().startReceive())
+            ASSERT(self._startReceive())
 
     def setPreambleDetectorLength(self, preambleDetectorLength):
         self._preambleDetectorLength = preambleDetectorLength
         if not self.blocking:
-            ASSERT(super().startReceive())
+            ASSERT(self._startReceive())
 
     def setBlockingCallback(self, blocking, callback=None):
         self.blocking = blocking
         if not self.blocking:
-            state = super().startReceive()
+            state = self._startReceive()
             ASSERT(state)
             if callback != None:
                 self._callbackFunction = callback
@@ -174,12 +182,54 @@ class SX1262(SX126X):
             super().clearDio1Action()
             return state
 
+    def setDeferredCallback(self, callback):
+        # Non-blocking mode where DIO1 calls `callback(pin)` straight away and nothing else. It
+        # mustn't touch the radio: the owner reads the events with getIrqStatus() later, from its
+        # own task, and restarts reception after TX_DONE itself (resumeReceive()).
+        self.blocking = False
+        state = self._startReceive()
+        ASSERT(state)
+        self._callbackFunction = self._dummyFunction
+        super().setDio1Action(callback)
+        return state
+
+    def irqPending(self):
+        # DIO1 stays high while any event routed to it is latched
+        return bool(self.irq.value())
+
+    def setReceiveMode(self, mode, senderPreambleLength=0):
+        # Non-blocking mode only. RX_DUTY_CYCLE sleeps between short checks for a preamble, which
+        # only catches packets whose preamble is at least senderPreambleLength symbols.
+        # RX_SLEEP doesn't receive at all, transmitting still works and goes back to sleep after.
+        self._rxMode = mode
+        self._senderPreambleLength = senderPreambleLength
+        if not self.blocking:
+            return self._startReceive()
+        return ERR_NONE
+
+    def resumeReceive(self):
+        # Back to receiving after something else (CAD, standby) left the radio idle
+        return self._startReceive()
+
+    def _startReceive(self):
+        # Back to whatever the radio does between transmissions
+        if self._rxMode == self.RX_DUTY_CYCLE:
+            return super().startReceiveDutyCycleAuto(self._senderPreambleLength)
+        if self._rxMode == self.RX_SLEEP:
+            return super().sleep()
+        return super().startReceive()
+
     def recv(self, len=0, timeout_en=False, timeout_ms=0):
         if not self.blocking:
             return self._readData(len)
         else:
             return self._receive(len, timeout_en, timeout_ms)
 
+    def recvInto(self, buf):
+        """Non-blocking receive of the packet waiting in the radio into `buf`, a memoryview of at
+        least the packet's length, instead of a new bytes object. Returns (length, status)."""
+        return self._readDataInto(buf)
+
     def send(self, data):
         if not self.blocking:
             return self._startTransmit(data)
@@ -240,7 +290,7 @@ class SX1262(SX126X):
         except AssertionError as e:
             state = list(ERROR.keys())[list(ERROR.values()).index(str(e))]
 
-        ASSERT(super().startReceive())
+        ASSERT(self._startReceive())
 
         if state == ERR_NONE or state == ERR_CRC_MISMATCH:
             return bytes(data), state
@@ -248,6 +298,27 @@ class SX1262(SX126X):
         else:
             return b'', state
 
+    def _readDataInto(self, buf):
+        state = ERR_NONE
+
+        length = super().getPacketLength()
+
+        if length > len(buf):
+            length = len(buf)
+
+        try:
+            state = super().readData(buf, length)
+        except AssertionError as e:
+            state = list(ERROR.keys())[list(ERROR.values()).index(str(e))]
+
+        ASSERT(self._startReceive())
+
+        if state == ERR_NONE or state == ERR_CRC_MISMATCH:
+            return length, state
+
+        else:
+            return 0, state
+
     def _startTransmit(self, data):
         if isinstance(data, bytes) or isinstance(data, bytearray):
             pass
@@ -263,5 +334,5 @@ class SX1262(SX126X):
     def _onIRQ(self, callback):
         events = self._events()
         if events & SX126X_IRQ_TX_DONE:
-            super().startReceive()
+            self._startReceive()
         self._callbackFunction(events)
@@ -46,6 +46,12 @@ class SX126X:
         
         ## end LVGL-Micropython specific stuff here
 
+        # Whole commands go out in one write_readinto() on these buffers, see SPItransferBulk()
+        self._spiBulk = hasattr(self.spi, 'write_readinto')
+        self._spiTx = memoryview(bytearray(SX126X_SPI_BUFFER_SIZE))
+        self._spiRx = memoryview(bytearray(SX126X_SPI_BUFFER_SIZE))
+        self._spiNop = memoryview(bytes([SX126X_CMD_NOP]) * SX126X_SPI_BUFFER_SIZE)
+
         self.cs = Pin(cs, mode=Pin.OUT)
         self.irq = Pin(irq, mode=Pin.IN)
         self.rst = Pin(rst, mode=Pin.OUT)
@@ -58,6 +64,7 @@ class SX126X:
         self._ldro = 0
         self._crcType = 0
         self._preambleLength = 0
+        self._txPreambleLength = 0
         self._tcxoDelay = 0
         self._headerType = 0
         self._implicitLen = 0
@@ -334,6 +341,17 @@ class SX126X:
         return ERR_UNKNOWN
 
     def scanChannel(self):
+        state = self.startChannelScan()
+        if state != ERR_NONE:
+            return state
+
+        while not self.irq.value():
+            yield_()
+
+        return self.getChannelScanResult()
+
+    def startChannelScan(self):
+        # Starts CAD and returns straight away, DIO1 rises when it's done. Then call getChannelScanResult()
         if self.getPacketType() != SX126X_PACKET_TYPE_LORA:
             return ERR_WRONG_MODEM
 
@@ -346,13 +364,12 @@ class SX126X:
         state = self.clearIrqStatus()
         ASSERT(state)
 
-        state = self.setCad()
-        ASSERT(state)
-
-        while not self.irq.value():
-            yield_()
+        return self.setCad()
 
-        cadResult = self.getIrqStatus()
+    def getChannelScanResult(self, cadResult=None):
+        # cadResult is the IRQ status if the caller already read it
+        if cadResult is None:
+            cadResult = self.getIrqStatus()
         if cadResult & SX126X_IRQ_CAD_DETECTED:
             self.clearIrqStatus()
             return LORA_DETECTED
@@ -409,7 +426,7 @@ class SX126X:
                 if len_ != self._implicitLen:
                     return ERR_INVALID_PACKET_LENGTH
                 
-            state = self.setPacketParams(self._preambleLength, self._crcType, len_, self._headerType, self._invertIQ)
+            state = self.setPacketParams(self._txPreambleLength or self._preambleLength, self._crcType, len_, self._headerType, self._invertIQ)
         elif modem == SX126X_PACKET_TYPE_GFSK:
             if self._packetType == SX126X_GFSK_PACKET_FIXED:
                 if len_ != self._packetLength:
@@ -511,7 +528,8 @@ class SX126X:
         return self.startReceiveDutyCycle(wakePeriod, sleepPeriod)
             
     def startReceiveCommon(self):
-        state = self.setDioIrqParams(SX126X_IRQ_RX_DONE | SX126X_IRQ_TIMEOUT | SX126X_IRQ_CRC_ERR | SX126X_IRQ_HEADER_ERR, SX126X_IRQ_RX_DONE)
+        # HEADER_VALID only latches in the IRQ status (not DIO1), so callers can poll whether a packet is arriving
+        state = self.setDioIrqParams(SX126X_IRQ_RX_DONE | SX126X_IRQ_TIMEOUT | SX126X_IRQ_CRC_ERR | SX126X_IRQ_HEADER_ERR | SX126X_IRQ_HEADER_VALID, SX126X_IRQ_RX_DONE)
         ASSERT(state)
         
         state = self.setBufferBaseAddress()
@@ -648,6 +666,12 @@ class SX126X:
 
         return ERR_UNKNOWN
 
+    def setTxPreambleLength(self, preambleLength):
+        # Preamble sent with packets, 0 for the same as the receive preamble. A longer one lets
+        # receivers in duty cycled Rx sleep between preamble checks and still catch the packet.
+        self._txPreambleLength = preambleLength
+        return ERR_NONE
+
     def setFrequencyDeviation(self, freqDev):
         if self.getPacketType() != SX126X_PACKET_TYPE_GFSK:
             return ERR_WRONG_MODEM
@@ -873,6 +897,14 @@ class SX126X:
         rssiPkt = int(packetStatus & 0xFF)
         return -1.0 * rssiPkt/2.0
 
+    def getPacketSignal(self):
+        # (RSSI, SNR) of the last LoRa packet from one GetPacketStatus, instead of one each
+        packetStatus = self.getPacketStatus()
+        snrPkt = int((packetStatus >> 8) & 0xFF)
+        if snrPkt >= 128:
+            snrPkt -= 256
+        return -1.0 * int(packetStatus & 0xFF)/2.0, snrPkt/4.0
+
     def getSNR(self):
         if self.getPacketType() != SX126X_PACKET_TYPE_LORA:
             return ERR_WRONG_MODEM
@@ -916,7 +948,7 @@ class SX126X:
 
             nPreCodedSymbols = int((bitCount + (sfDivisor - 1)) / sfDivisor)
 
-            nSymbol_x4 = int((self._preambleLength + 8) * 4 + sfCoeff1_x4 + nPreCodedSymbols * (self._cr + 4) * 4)
+            nSymbol_x4 = int(((self._txPreambleLength or self._preambleLength) + 8) * 4 + sfCoeff1_x4 + nPreCodedSymbols * (self._cr + 4) * 4)
 
             return int((symbolLength_us * nSymbol_x4) / 4)
         else:
@@ -1262,7 +1294,42 @@ class SX126X:
     def SPIreadCommand(self, cmd, cmdLen, data, numBytes, waitForBusy=True):
         return self.SPItransfer(cmd, cmdLen, False, [], data, numBytes, waitForBusy)
 
+    def SPItransferBulk(self, cmd, cmdLen, write, dataOut, dataIn, numBytes):
+        # The command and its data in one transaction, instead of a call (and a bytes object) per
+        # byte. The radio sends a status byte back for every byte it's sent, only the first one
+        # after the command is checked. Returns an SX126X_STATUS_* error, 0 if there's none.
+        tx = self._spiTx
+        rx = self._spiRx
+        for i in range(cmdLen):
+            tx[i] = cmd[i]
+        if write:
+            length = cmdLen + numBytes
+            if isinstance(dataOut, list):
+                for i in range(numBytes):
+                    tx[cmdLen + i] = dataOut[i]
+            elif numBytes:
+                tx[cmdLen:length] = memoryview(dataOut)[:numBytes]
+        else:
+            length = cmdLen + 1 + numBytes
+            tx[cmdLen:length] = self._spiNop[cmdLen:length]
+
+        self.spi.write_readinto(tx[:length], rx[:length])
+
+        if write and not numBytes:
+            return 0
+        in_ = rx[cmdLen]
+        if (in_ & 0b00001110) == SX126X_STATUS_CMD_TIMEOUT or\
+           (in_ & 0b00001110) == SX126X_STATUS_CMD_INVALID or\
+           (in_ & 0b00001110) == SX126X_STATUS_CMD_FAILED:
+            return in_ & 0b00001110
+        elif (in_ == 0x00) or (in_ == 0xFF):
+            return SX126X_STATUS_SPI_FAILED
+        if not write and numBytes:
+            dataIn[:numBytes] = rx[cmdLen + 1:length]
+        return 0
+
     def SPItransfer(self, cmd, cmdLen, write, dataOut, dataIn, numBytes, waitForBusy, timeout=5000):
+        bulk = False
         if implementation.name == 'micropython':
           self.cs.value(0)
 
@@ -1273,8 +1340,10 @@ class SX126X:
                   self.cs.value(1)
                   return ERR_SPI_CMD_TIMEOUT
 
-          for i in range(cmdLen):
-              self.spi.write(bytes([cmd[i]]))
+          bulk = self._spiBulk and cmdLen + 1 + numBytes <= SX126X_SPI_BUFFER_SIZE
+          if not bulk:
+            for i in range(cmdLen):
+                self.spi.write(bytes([cmd[i]]))
 
         if implementation.name == 'circuitpython':
           while not self.spi.try_lock():
@@ -1296,7 +1365,9 @@ class SX126X:
 
         status = 0
 
-        if write:
+        if bulk:
+            status = self.SPItransferBulk(cmd, cmdLen, write, dataOut, dataIn, numBytes)
+        elif write:
             for i in range(numBytes):
                 if implementation.name == 'micropython':
                     try:
@@ -0,0 +1,149 @@
+"""Compact encoding for short chat text, in the style of SMAZ.
+
+Each byte of the encoded text is a code: 1-253 stand for a string from the dictionary below,
+254 is followed by one byte copied as is and 255 by a count and that many bytes copied as is.
+Chat lines are mostly lower case English plus a few conference words, so common letters are
+one-byte entries (no worse than raw) and frequent pairs, words and phrases save the rest. Text the
+dictionary doesn't cover (upper case, UTF-8) still round trips, it just costs an extra byte or two.
+
+Encoded text never contains a zero byte, so it survives the zero padding of fixed length fields
+and frame trimming.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+CODE_BYTE = 254  # Next byte is copied as is
+CODE_RUN = 255  # Next byte is a count, then that many bytes copied as is
+MAX_RUN = 255
+MAX_COMPRESS_LEN = 128  # Longer text isn't compressed, bounds the time per message. Covers both chat text fields
+
+# Picked for chat at a hacker conference: letters and digits by how common they are in English,
+# then common English pairs and words, then conference words. Code n is WORDS[n - 1].
+WORDS = (
+    b" ", b"e", b"t", b"a", b"o", b"i", b"n", b"s", b"h", b"r", b"d", b"l", b"c", b"u", b"m", b"w", b"f",
+    b"g", b"y", b"p", b"b", b"v", b"k", b"j", b"x", b"q", b"z", b"0", b"1", b"2", b"3", b"4", b"5", b"6",
+    b"7", b"8", b"9", b".", b",", b"!", b"?", b"'", b"-", b":", b"/", b"(", b")", b"<", b">", b"+", b"#",
+    b"@", b"*", b"=", b'"', b"_", b"E", b"T", b"A", b"O", b"I", b"N", b"S", b"R", b"L", b"C", b"M", b"F",
+    b"P", b" the ", b"the ", b" the", b"the", b"he ", b"th", b"he", b"in", b"er", b"an", b"re", b"on", b"at",
+    b"en", b"nd", b"es", b"or", b"te", b"of", b"ed", b"is", b"it", b"al", b"ar", b"st", b"to", b"nt", b"ng",
+    b"se", b"ha", b"as", b"ou", b"io", b"le", b"ve", b"co", b"me", b"de", b"ri", b"ro", b"ic", b"ne", b"ea",
+    b"ra", b"ce", b"li", b"ch", b"ll", b"be", b"ma", b"si", b"om", b"ur", b"ca", b"el", b"ta", b"la", b"ns",
+    b"e ", b"s ", b"t ", b"d ", b"y ", b"n ", b"r ", b"o ", b"g ", b"k ", b"l ", b"h ", b"a ", b"m ", b" a ",
+    b" i", b" a", b" s", b" w", b" c", b" b", b" m", b" f", b" p", b" d", b" r", b" l", b" g", b"ing ",
+    b"ing", b"ion", b"ent", b"and ", b" and ", b"ere", b"ter", b"her", b"for ", b" for ", b" to ", b"to ",
+    b" of ", b" in ", b" is ", b"is ", b" on ", b" at ", b"at ", b" it", b"you", b" you", b"with ", b"that ",
+    b"this ", b"have ", b"what ", b"who ", b"where ", b"there", b"here", b"are ", b"was ", b"will ", b"can ",
+    b" my ", b"my ", b"just ", b"does ", b"do ", b"not ", b"out ", b"all ", b"now", b"any", b"one",
+    b"anyone", b"everyone", b"someone", b"thanks", b"please", b"know", b"badge", b"talk", b"hack", b"lora",
+    b"radio", b"solder", b"sao", b"SAO", b"wifi", b"usb", b"firmware", b"python", b"channel", b"room",
+    b"table", b"stage", b"workshop", b"village", b"coffee", b"pizza", b"battery", b"keyboard", b"display",
+    b"signal", b"message", b"chat", b"code", b"bug", b"fix", b"github", b"http", b"://", b".com", b"meet",
+    b"free", b"need", b"lol", b"brb", b":)", b":(", b"<3", b"!!", b"...", b"??", b"00",
+)  # fmt: skip
+
+
+def _build_index(words):
+    """Index the dictionary by first two bytes, longest word first so the first match is the longest.
+    Single byte words go in a separate table, they're the match of last resort."""
+    pairs = {}
+    singles = {}
+    for code, word in enumerate(words, 1):
+        if len(word) == 1:
+            singles[word[0]] = code
+        else:
+            pairs.setdefault(word[0] << 8 | word[1], []).append((word, code))
+    for key, entries in pairs.items():
+        entries.sort(key=lambda entry: -len(entry[0]))
+        pairs[key] = tuple(entries)
+    return pairs, singles
+
+
+_PAIRS, _SINGLES = _build_index(WORDS)
+# Most dictionary words tried at one position, so compress() costs at most this many comparisons per byte
+MAX_CANDIDATES = max(len(entries) for entries in _PAIRS.values())
+
+
+def _flush_raw(out: bytearray, text, start: int, end: int):
+    while start < end:
+        count = min(end - start, MAX_RUN)
+        if count == 1:
+            out.append(CODE_BYTE)
+        else:
+            out.append(CODE_RUN)
+            out.append(count)
+        out.extend(text[start : start + count])
+        start += count
+
+
+def compress(text):
+    """Encode `text` (str or bytes), or return None if that wouldn't make it shorter.
+
+    Greedy longest match against the dictionary. Text over MAX_COMPRESS_LEN bytes or containing a
+    zero byte isn't compressed, callers send it raw.
+    """
+    if isinstance(text, str):
+        text = text.encode()
+    length = len(text)
+    if not length or length > MAX_COMPRESS_LEN or b"\0" in text:
+        return None
+    pairs = _PAIRS
+    singles = _SINGLES
+    out = bytearray()
+    raw_start = 0
+    pos = 0
+    while pos < length:
+        code = 0
+        word_len = 1
+        if pos + 1 < length:
+            for word, word_code in pairs.get(text[pos] << 8 | text[pos + 1], ()):
+                if text.startswith(word, pos):
+                    code = word_code
+                    word_len = len(word)
+                    break
+        if not code:
+            code = singles.get(text[pos], 0)
+        if code:
+            if raw_start < pos:
+                _flush_raw(out, text, raw_start, pos)
+            out.append(code)
+            pos += word_len
+            raw_start = pos
+        else:
+            pos += 1
+        if len(out) >= length:
+            return None  # Already no shorter than the raw text
+    if raw_start < length:
+        _flush_raw(out, text, raw_start, length)
+    if len(out) >= length:
+        return None
+    return bytes(out)
+
+
+def decompress(data) -> bytes:
+    """Decode text from compress(). Raises ValueError if `data` isn't valid encoded text."""
+    words = WORDS
+    out = bytearray()
+    pos = 0
+    length = len(data)
+    while pos < length:
+        code = data[pos]
+        if code == CODE_BYTE:
+            if pos + 1 >= length:
+                raise ValueError("Truncated compressed text")
+            out.append(data[pos + 1])
+            pos += 2
+        elif code == CODE_RUN:
+            if pos + 1 >= length:
+                raise ValueError("Truncated compressed text")
+            end = pos + 2 + data[pos + 1]
+            if end > length:
+                raise ValueError("Truncated compressed text")
+            out.extend(data[pos + 2 : end])
+            pos = end
+        elif code:
+            out.extend(words[code - 1])
+            pos += 1
+        else:
+            raise ValueError("Zero byte in compressed text")
+    return bytes(out)
@@ -0,0 +1,354 @@
+"""Reliable unicast on top of BadgeNet: acknowledgements, retransmission and fragmentation.
+
+A message to one badge is split into fragments that each fit in a frame. The receiver answers
+with a selective ACK, a bitmap of the fragments it has, and the sender resends only the missing
+ones: straight away if an ACK shows a gap. If nothing comes back before the retransmission timeout
+(RTO), only the last unacknowledged fragment is resent, as a probe: the receiver answers it with
+its bitmap, and the gaps are filled from that rather than every fragment going out again. The RTO for each destination follows the round trip times measured to it (the
+smoothed RTT plus four times its variation, as in TCP), doubling on every timeout.
+
+Each destination gets its own message sequence numbers, so the receiver can tell a new message
+from a resent one, and delivers each message once. Reassembly buffers are bounded: at most
+MAX_REASSEMBLIES partial messages are kept, MAX_FRAGMENTS * FRAGMENT_LEN bytes each at worst.
+
+    ok = await send_reliable(destination, MY_PROTOCOL, data)
+    register_reliable_receiver(MY_PROTOCOL, callback)  # callback(source, data)
+"""
+
+import random
+import struct
+import sys
+import time
+import asyncio as aio  # type: ignore
+
+from net.dedup import SeenCache
+from net.net import BROADCAST_ADDRESS, SEND_REJECTED, TX_CLASS_CONTROL, TX_CLASS_LOCAL, BadgeNet, badgenet
+from net.protocols import HEADER_LEN, MAX_FRAME_LEN, NetworkFrame, Protocol
+from net.stats import LatencyStats
+
+FRAGMENT_HEADER = "!BHBBB"  # app port, message seq, fragment index, fragment count, fragment length
+FRAGMENT_LEN = MAX_FRAME_LEN - HEADER_LEN - struct.calcsize(FRAGMENT_HEADER)
+RELIABLE_DATA = Protocol(port=5, name="RELIABLE_DATA", structdef=f"{FRAGMENT_HEADER}{FRAGMENT_LEN}s")
+RELIABLE_ACK = Protocol(port=8, name="RELIABLE_ACK", structdef="!HI")  # message seq, bitmap of fragments received
+
+MAX_FRAGMENTS = 16  # Up to 32 fit in the ACK bitmap
+MAX_MESSAGE_LEN = MAX_FRAGMENTS * FRAGMENT_LEN
+MAX_REASSEMBLIES = 4  # Partial messages being received at once, the oldest is dropped for a new one
+REASSEMBLY_TIMEOUT_MS = 30000  # Partial messages not added to for this long are thrown away
+MAX_IN_FLIGHT = 4  # Messages being sent at once, send_reliable() waits for a free slot
+MAX_PEERS = 16  # Destinations whose sequence numbers and round trip times are remembered
+RELIABLE_TTL = 3
+MAX_RETRIES = 5  # Timeouts before send_reliable() gives up
+INITIAL_RTO_MS = 2000  # Until the first round trip to a destination is measured
+MIN_RTO_MS = 200
+MAX_RTO_MS = 16000
+QUEUE_RETRY_MS = 50  # How often to try again while the transmit queue is full or the airtime budget spent
+# Big messages send many fragments back to back, so the data port gets more than the default budget
+RELIABLE_DUTY_PCT = 10
+RELIABLE_BURST_MS = 2000
+
+
+def message_key(address: int, seq: int) -> int:
+    """Identify a message by the other badge's address and the message seq, folded into 30 bits
+    so the key is a small int on Micropython. Only the 14 bit fold of the address has to tell apart
+    the few badges with a message in flight or just delivered at once."""
+    return ((address ^ address >> 16) & 0x3FFF) << 16 | seq
+
+
+class Peer:
+    """Sequence numbers and round trip time estimate for one destination."""
+
+    def __init__(self):
+        self.next_seq = random.getrandbits(16)  # Random start, so a reboot doesn't look like a resend
+        self.srtt_ms = 0.0
+        self.rttvar_ms = 0.0
+        self.rto_ms = INITIAL_RTO_MS
+        self.last_used = 0
+
+    def rtt_sample(self, rtt_ms: int):
+        if self.srtt_ms:
+            self.rttvar_ms += (abs(self.srtt_ms - rtt_ms) - self.rttvar_ms) / 4
+            self.srtt_ms += (rtt_ms - self.srtt_ms) / 8
+        else:
+            self.srtt_ms = rtt_ms
+            self.rttvar_ms = rtt_ms / 2
+        self.rto_ms = int(min(MAX_RTO_MS, max(MIN_RTO_MS, self.srtt_ms + 4 * self.rttvar_ms)))
+
+    def back_off(self):
+        self.rto_ms = min(MAX_RTO_MS, self.rto_ms * 2)
+
+    def __repr__(self):
+        return f"Peer(seq:{self.next_seq} srtt:{self.srtt_ms:.0f}ms rttvar:{self.rttvar_ms:.0f}ms rto:{self.rto_ms}ms)"
+
+
+class Outgoing:
+    """A message being sent, waiting for its fragments to be acknowledged."""
+
+    def __init__(self, destination: int, seq: int, port: int, fragments: list):
+        self.destination = destination
+        self.seq = seq
+        self.port = port
+        self.fragments = fragments
+        self.complete_mask = (1 << len(fragments)) - 1
+        self.acked = 0  # Bitmap of fragments the receiver has
+        self.sent_ms = 0  # When the last fragment of a first transmission was queued, 0 once sampled or resent
+        self.acked_event = aio.Event()
+
+
+class Reassembly:
+    """Fragments of a message being received."""
+
+    def __init__(self, port: int, count: int):
+        self.port = port
+        self.count = count
+        self.fragments: list = [None] * count
+        self.received = 0  # Bitmap
+        self.updated_ms = time.ticks_ms()
+
+
+class ReliableTransport:
+    """Reliable, fragmenting unicast between two badges over a BadgeNet."""
+
+    def __init__(self, net: BadgeNet):
+        self.net = net
+        self.receive_callbacks: dict[int, list] = {}  # app port: callbacks
+        self.peers: dict[int, Peer] = {}
+        self.outgoing: dict[int, Outgoing] = {}  # message_key(destination, seq): message
+        self.reassemblies: dict[int, Reassembly] = {}  # message_key(source, seq): partial message
+        self.completed = SeenCache(64, 120)  # Messages already delivered, re-ACKed if resent
+        self._slot_free = aio.Event()
+        self._clock = 0
+        self.sent = 0
+        self.failed = 0
+        self.fragments_sent = 0
+        self.retransmits = 0
+        self.delivered = 0
+        self.duplicates = 0  # Resent messages that had already been delivered
+        self.reassembly_drops = 0  # Partial messages dropped to make room or timed out
+        self.send_time = LatencyStats()  # send_reliable() call to complete ACK
+        net.register_receiver(RELIABLE_DATA, self._receive_data)
+        net.register_receiver(RELIABLE_ACK, self._receive_ack)
+        net.airtime.set_port_limit(RELIABLE_DATA.port, RELIABLE_DUTY_PCT, RELIABLE_BURST_MS)
+
+    def register_receiver(self, protocol: Protocol, callback):
+        """Call `callback(source, data)` with each message sent reliably to this badge on `protocol`'s port."""
+        self.receive_callbacks.setdefault(protocol.port, []).append(callback)
+
+    def peer(self, address: int) -> Peer:
+        peer = self.peers.get(address)
+        if peer is None:
+            if len(self.peers) >= MAX_PEERS:
+                oldest = min(self.peers, key=lambda key: self.peers[key].last_used)
+                del self.peers[oldest]
+            peer = Peer()
+            self.peers[address] = peer
+        self._clock += 1
+        peer.last_used = self._clock
+        return peer
+
+    async def send(self, destination: int, protocol: Protocol, data) -> bool:
+        """Send `data` (bytes, or a tuple packed with the protocol's structdef) to one badge.
+        Returns True once the receiver has all of it, False if it never answered."""
+        if destination == BROADCAST_ADDRESS:
+            raise ValueError("Reliable messages need one destination, not BROADCAST_ADDRESS")
+        if isinstance(data, (tuple, list)):
+            data = struct.pack(protocol.structdef, *data)
+        if len(data) > MAX_MESSAGE_LEN:
+            raise ValueError(f"Reliable message too long: {len(data)} bytes vs max of {MAX_MESSAGE_LEN} bytes")
+        while len(self.outgoing) >= MAX_IN_FLIGHT:
+            self._slot_free.clear()
+            await self._slot_free.wait()
+        start = time.ticks_ms()
+        peer = self.peer(destination)
+        seq = peer.next_seq
+        peer.next_seq = (seq + 1) & 0xFFFF
+        fragments = [data[offset : offset + FRAGMENT_LEN] for offset in range(0, len(data), FRAGMENT_LEN)] or [b""]
+        message = Outgoing(destination, seq, protocol.port, fragments)
+        key = message_key(destination, seq)
+        self.outgoing[key] = message
+        try:
+            retries = 0
+            gap_resent = False
+            missing = await self._send_missing(message, True)
+            deadline = time.ticks_add(time.ticks_ms(), self._timeout_ms(peer, missing))
+            while message.acked != message.complete_mask:
+                wait_ms = time.ticks_diff(deadline, time.ticks_ms())
+                if wait_ms > 0:
+                    message.acked_event.clear()
+                    try:
+                        await aio.wait_for_ms(message.acked_event.wait(), wait_ms)
+                    except aio.TimeoutError:
+                        pass
+                    if message.acked == message.complete_mask or time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                        continue
+                    # An ACK with gaps: resend what's missing straight away, but only once per timeout,
+                    # later ACKs are for fragments that were already on their way
+                    if not gap_resent:
+                        gap_resent = True
+                        missing = await self._send_missing(message, False)
+                        deadline = time.ticks_add(time.ticks_ms(), self._timeout_ms(peer, missing))
+                    continue
+                retries += 1
+                if retries > MAX_RETRIES:
+                    self.failed += 1
+                    return False
+                peer.back_off()
+                gap_resent = False
+                await self._send_probe(message)
+                deadline = time.ticks_add(time.ticks_ms(), self._timeout_ms(peer, 1))
+            self.sent += 1
+            self.send_time.add(time.ticks_diff(time.ticks_ms(), start))
+            return True
+        finally:
+            del self.outgoing[key]
+            self._slot_free.set()
+
+    def _timeout_ms(self, peer: Peer, fragments: int) -> int:
+        """The RTO, plus time for fragments still waiting their turn to be sent."""
+        per_fragment_ms = self.net.airtime.time_on_air_ms(MAX_FRAME_LEN) + self.net.transmit_cooldown_ms
+        return int(peer.rto_ms + fragments * per_fragment_ms)
+
+    async def _send_missing(self, message: Outgoing, first: bool) -> int:
+        """Queue every fragment not acknowledged yet. Returns how many.
+        A message can have more fragments than the transmit queue holds, or than the airtime budget
+        allows at once, so each fragment waits until send() takes it."""
+        missing = 0
+        for index in range(len(message.fragments)):
+            if message.acked & (1 << index):
+                continue  # Checked each time round, ACKs can arrive while waiting
+            missing += 1
+            await self._send_fragment(message, index, first)
+        # Karn's rule: only time round trips of fragments sent once
+        message.sent_ms = time.ticks_ms() if first else 0
+        return missing
+
+    async def _send_probe(self, message: Outgoing):
+        """After a timeout, resend only the last fragment not acknowledged yet. The receiver ACKs any
+        fragment that arrives once it has the last one, so this gets its bitmap back, and the gap
+        resend after it only sends what's really missing."""
+        index = len(message.fragments) - 1
+        while message.acked & (1 << index):
+            index -= 1
+        await self._send_fragment(message, index, False)
+        message.sent_ms = 0
+
+    async def _send_fragment(self, message: Outgoing, index: int, first: bool):
+        fragment = message.fragments[index]
+        frame = NetworkFrame().set_fields(
+            protocol=RELIABLE_DATA,
+            destination=message.destination,
+            ttl=RELIABLE_TTL,
+            payload=(message.port, message.seq, index, len(message.fragments), len(fragment), fragment),
+        )
+        # Wait for room rather than have every try counted as a dropped frame.
+        # Resends are flooded, in case the route the first try took has gone.
+        queue = self.net.transmit_queue
+        while queue.full(TX_CLASS_LOCAL) or self.net.send(frame, TX_CLASS_LOCAL, not first) == SEND_REJECTED:
+            await aio.sleep_ms(QUEUE_RETRY_MS)
+        self.fragments_sent += 1
+        if not first:
+            self.retransmits += 1
+
+    def _receive_ack(self, frame: NetworkFrame):
+        if frame.destination != self.net.address:
+            return
+        seq, received = frame.payload
+        message = self.outgoing.get(message_key(frame.source, seq))
+        if message is None:
+            return
+        newly_acked = received & message.complete_mask & ~message.acked
+        if not newly_acked:
+            return  # Nothing new, e.g. a second ACK for the same fragments
+        message.acked |= newly_acked
+        if message.sent_ms:
+            self.peer(frame.source).rtt_sample(time.ticks_diff(time.ticks_ms(), message.sent_ms))
+            message.sent_ms = 0
+        message.acked_event.set()
+
+    def _send_ack(self, destination: int, seq: int, received: int):
+        frame = NetworkFrame().set_fields(
+            protocol=RELIABLE_ACK, destination=destination, ttl=RELIABLE_TTL, payload=(seq, received)
+        )
+        self.net.send(frame, TX_CLASS_CONTROL)
+
+    def _reassembly(self, key: int, port: int, count: int) -> Reassembly | None:
+        reassembly = self.reassemblies.get(key)
+        if reassembly is not None:
+            if reassembly.count != count or reassembly.port != port:
+                return None  # Doesn't match the fragments already received, ignore it
+            return reassembly
+        now = time.ticks_ms()
+        for old_key in [k for k, r in self.reassemblies.items() if time.ticks_diff(now, r.updated_ms) > REASSEMBLY_TIMEOUT_MS]:
+            del self.reassemblies[old_key]
+            self.reassembly_drops += 1
+        if len(self.reassemblies) >= MAX_REASSEMBLIES:
+            oldest = min(self.reassemblies, key=lambda k: time.ticks_diff(self.reassemblies[k].updated_ms, now))
+            del self.reassemblies[oldest]
+            self.reassembly_drops += 1
+        reassembly = Reassembly(port, count)
+        self.reassemblies[key] = reassembly
+        return reassembly
+
+    def _receive_data(self, frame: NetworkFrame):
+        if frame.destination != self.net.address or not frame.payload:
+            return
+        port, seq, index, count, length, data = frame.payload
+        if not 0 < count <= MAX_FRAGMENTS or index >= count or length > FRAGMENT_LEN:
+            return
+        source = frame.source
+        key = message_key(source, seq)
+        complete_mask = (1 << count) - 1
+        if self.completed.get(key):
+            # Already delivered, the ACK must have been lost
+            self.duplicates += 1
+            self._send_ack(source, seq, complete_mask)
+            return
+        reassembly = self._reassembly(key, port, count)
+        if reassembly is None:
+            return
+        reassembly.fragments[index] = data[:length]
+        reassembly.received |= 1 << index
+        reassembly.updated_ms = time.ticks_ms()
+        if reassembly.received == complete_mask:
+            del self.reassemblies[key]
+            self.completed.set(key, 1)
+            self._send_ack(source, seq, complete_mask)
+            self._deliver(source, port, b"".join(reassembly.fragments))
+        elif reassembly.received & (1 << (count - 1)):
+            # Acknowledge once the last fragment is in (or when a resend or probe arrives after it),
+            # the gaps in the bitmap tell the sender what to resend
+            self._send_ack(source, seq, reassembly.received)
+
+    def _deliver(self, source: int, port: int, data: bytes):
+        self.delivered += 1
+        for callback in self.receive_callbacks.get(port, ()):
+            try:
+                callback(source, data)
+            except Exception as ex:
+                print(f"Exception in reliable message callback for port {port}")
+                sys.print_exception(ex)
+
+    def __repr__(self):
+        return (
+            f"ReliableTransport(sent:{self.sent} failed:{self.failed} in flight:{len(self.outgoing)} "
+            f"fragments:{self.fragments_sent} retransmits:{self.retransmits} delivered:{self.delivered} "
+            f"duplicates:{self.duplicates} reassembling:{len(self.reassemblies)} drops:{self.reassembly_drops} "
+            f"send time:{self.send_time})"
+        )
+
+
+# Reliable transport singleton, on the network stack singleton
+transport = ReliableTransport(badgenet)
+
+
+async def send_reliable(destination: int, protocol: Protocol, data) -> bool:
+    """Send a message to one badge and wait until it's acknowledged.
+    `data` is bytes (up to MAX_MESSAGE_LEN), or a tuple packed with the protocol's structdef.
+    Returns True if it got there, False if the destination never answered."""
+    return await transport.send(destination, protocol, data)
+
+
+def register_reliable_receiver(protocol: Protocol, callback):
+    """Register `callback(source, data)` for messages sent with send_reliable() on this protocol's port.
+    Same rules as register_receiver() callbacks: return quickly, don't touch the screen."""
+    transport.register_receiver(protocol, callback)
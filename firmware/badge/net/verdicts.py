@@ -0,0 +1,76 @@
+"""Cache of signature verification results.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+import hashlib
+
+DEFAULT_VERDICT_CACHE_SIZE = 64
+VERDICT_KEY_LEN = 16  # Bytes of SHA-256 kept as the cache key, plenty to make collisions impossible in practice
+
+
+def verdict_key(message, signature) -> bytes:
+    """Cache key for a (message, signature) pair.
+    Signatures from one key are all the same length, so hashing one after the other is unambiguous."""
+    if isinstance(message, str):
+        message = message.encode()
+    digest = hashlib.sha256(signature)
+    digest.update(message)
+    return digest.digest()[:VERDICT_KEY_LEN]
+
+
+class VerdictCache:
+    """Remembers whether recent signatures were valid, evicting the least recently used when full.
+
+    A signed broadcast reaches a badge once per neighbour that relays it, and each copy looks like a
+    new frame to the apps, so this saves verifying the same signature over and over. Micropython
+    dicts aren't ordered, so each entry records when it was last used and eviction searches for the
+    oldest. That's a scan of the whole cache, but only when adding to a full one.
+    """
+
+    def __init__(self, size: int = DEFAULT_VERDICT_CACHE_SIZE):
+        self.size = size
+        self._entries: dict[bytes, list] = {}  # key: [verdict, last used]
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, key: bytes):
+        """The cached verdict for `key`, or None if it isn't known."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._clock += 1
+        entry[1] = self._clock
+        return entry[0]
+
+    def put(self, key: bytes, verdict: bool):
+        entry = self._entries.get(key)
+        self._clock += 1
+        if entry is not None:
+            entry[0] = verdict
+            entry[1] = self._clock
+            return
+        if len(self._entries) >= self.size:
+            oldest_key = None
+            oldest = self._clock
+            for entry_key, entry in self._entries.items():
+                if entry[1] < oldest:
+                    oldest = entry[1]
+                    oldest_key = entry_key
+            del self._entries[oldest_key]
+            self.evicted += 1
+        self._entries[key] = [verdict, self._clock]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f"VerdictCache({len(self._entries)}/{self.size} hits:{self.hits} misses:{self.misses} "
+            f"evicted:{self.evicted})"
+        )
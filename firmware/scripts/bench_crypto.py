@@ -0,0 +1,209 @@
+"""Time signing and verifying signatures, and the verdict cache that saves repeat verifications.
+
+On the badge, with the badge's cryptography module and keys:
+mpremote run scripts/bench_crypto.py
+
+On a computer, signing is timed if the `cryptography` package is installed (pip install
+cryptography). It has the same API as the badge's module, so net.crypto runs unchanged with an
+RSA-1024 and a P-256 key made for the run. Frames of the RSA and elliptic curve signed chat
+protocols are compared too. Without the package only the cache is timed:
+python3 scripts/bench_crypto.py
+"""
+
+import sys
+import time
+
+HOST = sys.implementation.name != "micropython"
+if HOST:
+    import host_env  # noqa: F401  Adds badge/ to the path
+
+    HOST_CRYPTOGRAPHY = host_env.use_host_cryptography()
+
+from net.verdicts import VerdictCache, verdict_key  # noqa: E402
+
+MESSAGE = b"The quick brown fox jumps over the lazy badge".ljust(90, b"\0")  # A SIGNED_TEXT_CHAT text field
+
+
+def timed(label: str, count: int, func, *args):
+    start = time.ticks_us()
+    for _ in range(count):
+        func(*args)
+    elapsed_us = time.ticks_diff(time.ticks_us(), start)
+    print(f"  {label:<40} {elapsed_us / count:10.1f} us/op  ({count} ops)")
+
+
+def host_keys() -> dict:
+    """A new RSA-1024 and P-256 key pair in a temporary directory.
+    Returns Crypto objects by key type, and the directory."""
+    import tempfile
+
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    from net.crypto import KEY_EC, KEY_RSA, Crypto
+
+    key_dir = tempfile.mkdtemp()
+    keys = {
+        KEY_RSA: rsa.generate_private_key(public_exponent=65537, key_size=1024),
+        KEY_EC: ec.generate_private_key(ec.SECP256R1()),
+    }
+    for name, private_key in keys.items():
+        with open(f"{key_dir}/{name}_private.der", "wb") as private_file:
+            private_file.write(
+                private_key.private_bytes(
+                    encoding=serialization.Encoding.DER,
+                    format=serialization.PrivateFormat.TraditionalOpenSSL,
+                    encryption_algorithm=serialization.NoEncryption(),
+                )
+            )
+        with open(f"{key_dir}/{name}_public.der", "wb") as public_file:
+            public_file.write(
+                private_key.public_key().public_bytes(
+                    encoding=serialization.Encoding.DER,
+                    format=serialization.PublicFormat.SubjectPublicKeyInfo,
+                )
+            )
+    return {name: Crypto(name, key_dir) for name in keys}, key_dir
+
+
+def bench_key_loading(key_names, key_dir: str = "/data", count: int = 10):
+    """What starting up with Crypto costs: loading and self checking the keys at construction, as
+    Crypto used to, against constructing it and loading the keys later with the check cached."""
+    import os
+
+    from net.crypto import Crypto
+
+    for key_name in key_names:
+        check_path = f"{key_dir}/{key_name}_selfcheck"
+        print(f"Key loading, {key_name} keys:")
+
+        def eager():
+            try:
+                os.remove(check_path)
+            except OSError:
+                pass
+            Crypto(key_name, key_dir).validate()
+
+        timed("construct + load + self check (before)", count, eager)
+        timed("construct, at boot now", count, Crypto, key_name, key_dir)
+        timed("load with the self check cached", count, lambda: Crypto(key_name, key_dir).validate())
+        crypto = Crypto(key_name, key_dir)
+        crypto.validate()
+        print(f"  {crypto.load_ms}")
+
+
+def bench_signatures(crypto, count: int = 10):
+    from net.crypto import KEY_RSA
+
+    def verify_rebuilding(message, signature):
+        # What Crypto.verify() did before it kept its padding and hash
+        from cryptography import hashes, padding
+
+        try:
+            crypto.public_key.verify(
+                signature,
+                message,
+                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=hashes.SHA256().digest_size),
+                hashes.SHA256(),
+            )
+            return True
+        except:  # noqa: E722
+            return False
+
+    print(f"Signatures, {crypto.key_type} key:")
+    if crypto.private_key is None:
+        print("  no private key on this badge, can't time signing")
+        return None
+    signature = crypto.sign(MESSAGE)
+    bad_signature = bytes(b ^ 0xFF for b in signature)
+    print(f"  {len(signature)} byte signatures")
+    timed("sign", count, crypto.sign, MESSAGE)
+    timed("verify", count, crypto.verify, MESSAGE, signature)
+    if crypto.key_type == KEY_RSA:
+        timed("verify, rebuilding padding each call", count, verify_rebuilding, MESSAGE, signature)
+    timed("verify bad signature", count, crypto.verify, MESSAGE, bad_signature)
+    return signature
+
+
+def bench_airtime(cryptos: dict):
+    """Frames of the chat corpus signed with each key type, in the protocol for its signature size."""
+    import mesh_sim
+    from bench_net import load_chat_corpus
+    from net.crypto import EC_SIGNATURE_LEN, KEY_EC, KEY_RSA
+    from net.protocols import Protocol, ProtocolCodec
+
+    # As in apps/chat.py, which needs the badge hardware to import
+    protocols = {  # key type: protocol, longest text
+        KEY_RSA: (Protocol(port=7, name="SIGNED_TEXT_CHAT", structdef="!H10s128s90s"), 90),
+        KEY_EC: (Protocol(port=9, name="SIGNED_TEXT_CHAT_EC", structdef=f"!H10s{EC_SIGNATURE_LEN}s100s"), 100),
+    }
+    model = mesh_sim.ChannelModel()
+    corpus = [text[:100] for text in load_chat_corpus()]
+    print(f"Signed chat (trimmed), {len(corpus)} messages, SF{model.sf} {model.bw_khz:.0f} kHz:")
+    for name, (protocol, text_len) in protocols.items():
+        codec = ProtocolCodec(protocol, trim=True)
+        frame_len = airtime_ms = cut = 0
+        for i, text in enumerate(corpus):
+            if len(text) > text_len:
+                cut += 1
+                text = text[:text_len]
+            signature = cryptos[name].sign(text.ljust(text_len, b"\0"))
+            frame, _ = codec.encode(3, 0xFFFFFFFF, 0x1234, i, (901, b"k6abc", signature, text))
+            frame_len += len(frame)
+            airtime_ms += model.time_on_air_s(len(frame)) * 1000
+        count = len(corpus)
+        print(
+            f"  {protocol.name:20} {frame_len / count:6.1f} bytes  {airtime_ms / count:5.1f} ms on air per frame, "
+            f"text up to {text_len} bytes ({cut} messages cut short)"
+        )
+
+
+def bench_cache(signature, count: int = 1000):
+    signature = signature or bytes(range(128))
+    cache = VerdictCache()
+    key = verdict_key(MESSAGE, signature)
+    cache.put(key, True)
+    for i in range(cache.size - 1):
+        cache.put(verdict_key(b"%d" % i, signature), True)
+
+    def cached(message, signature):
+        return cache.get(verdict_key(message, signature))
+
+    keys = [verdict_key(b"%d" % i, signature) for i in range(count)]
+    inserted = iter(keys)
+
+    def insert_evicting():
+        cache.put(next(inserted), True)
+
+    print(f"Verdict cache of {cache.size}:")
+    timed("cached verify (digest + lookup)", count, cached, MESSAGE, signature)
+    timed("digest only", count, verdict_key, MESSAGE, signature)
+    timed("insert into full cache (evicts)", count, insert_evicting)
+    print(f"  {cache}")
+
+
+def main():
+    if HOST:
+        if not HOST_CRYPTOGRAPHY:
+            print("No cryptography package here, skipping sign and verify")
+            bench_cache(None)
+            return
+        cryptos, key_dir = host_keys()
+        bench_key_loading(cryptos, key_dir, count=50)
+        signature = None
+        for crypto in cryptos.values():
+            signature = bench_signatures(crypto, count=200) or signature
+        bench_airtime(cryptos)
+        bench_cache(signature)
+        return
+    try:
+        from net.crypto import Crypto
+    except ImportError:
+        print("No badge cryptography module here, skipping sign and verify")
+        bench_cache(None)
+        return
+    bench_key_loading(("supercon",))
+    bench_cache(bench_signatures(Crypto()))
+
+
+if __name__ == "__main__":
+    main()
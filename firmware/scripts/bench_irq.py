@@ -0,0 +1,152 @@
+#!/bin/env python3
+"""Radio interrupt handling: how long from DIO1 rising until LoraRadio has handled the event.
+
+This runs on your computer, not on the badge!
+
+    python3 scripts/bench_irq.py
+
+The real LoraRadio and SX1262 driver run on the fake SPI bus from bench_spi.py. A thread stands in
+for the DIO1 interrupt, announcing a received packet 20 times a second, while the event loop runs
+another task that blocks for a while between awaits, like a signature check or a display refresh
+does on the badge. The interrupt handler only notes the time; the events are read and handled by
+LoraRadio's own task, so the latency is mostly how long the event loop takes to get to it. Bursts
+of interrupts before that task runs are handled in one go.
+
+It also checks channel access while a frame is arriving: LoraRadio.send() has to back off without
+restarting Rx (a SetRx command aborts the reception in progress), and the frame is still received.
+And that asking whether a frame is arriving doesn't touch the radio while it sleeps or duty cycles,
+since any SPI command wakes it.
+"""
+
+import asyncio
+import threading
+import time
+
+import bench_spi
+from net._sx126x import (
+    SX126X_CMD_SET_CAD,
+    SX126X_CMD_SET_RX,
+    SX126X_CMD_SET_TX,
+    SX126X_IRQ_CAD_DONE,
+    SX126X_IRQ_HEADER_VALID,
+    SX126X_IRQ_RX_DONE,
+)
+
+RATE = 20  # Interrupts per second
+DURATION_S = 3.0
+
+
+def host_lora():
+    """A LoraRadio on a fake SPI bus. Returns (lora, bus)."""
+    bus = bench_spi.install_fake_bus()
+    from net import lora as lora_module
+
+    lora_module.time = time  # A simulation run earlier in the process leaves it on simulated time
+    return lora_module.LoraRadio(), bus
+
+
+def interrupts(lora, stop: threading.Event, burst: int):
+    """DIO1 rising RATE times a second, `burst` times in quick succession each time."""
+    while not stop.wait(1 / RATE):
+        for _ in range(burst):
+            lora._irq(None)
+
+
+async def run(block_ms: float, burst: int = 1) -> tuple:
+    """Returns (lora, SPI transactions per handled interrupt)."""
+    lora, bus = host_lora()
+    bus.irq_status = SX126X_IRQ_RX_DONE
+    bus.rx_length = 40
+    await asyncio.sleep(0.01)  # Let the IRQ task start
+    bus.reset_counts()
+    stop = threading.Event()
+    done = False
+
+    async def receiver():
+        while True:
+            await lora.recv()
+            lora.release_rx()
+
+    async def busy():
+        while not done:
+            if block_ms:
+                time.sleep(block_ms / 1000)
+            await asyncio.sleep(0.001)
+
+    tasks = [asyncio.create_task(receiver()), asyncio.create_task(busy())]
+    thread = threading.Thread(target=interrupts, args=(lora, stop, burst))
+    thread.start()
+    await asyncio.sleep(DURATION_S)
+    stop.set()
+    thread.join()
+    done = True
+    await asyncio.sleep(0.05)
+    for task in tasks + [lora.irq_task]:
+        task.cancel()
+    return lora, bus.transactions / max(lora.irq_services, 1)
+
+
+async def receive_during_backoff(backoff_s: float = 0.1) -> tuple:
+    """A frame's header has been received when LoraRadio is asked to send, and the frame finishes
+    `backoff_s` later. Returns (Rx restarts while it was arriving, CADs run while it was arriving,
+    frame received, frame sent)."""
+    lora, bus = host_lora()
+    await asyncio.sleep(0.01)  # Let the IRQ task start
+    bus.irq_status = SX126X_IRQ_HEADER_VALID
+    bus.reset_counts()
+    sender = asyncio.create_task(lora.send(bytes(40)))
+    await asyncio.sleep(backoff_s)
+    restarts, cads = bus.commands[SX126X_CMD_SET_RX], bus.commands[SX126X_CMD_SET_CAD]
+    bus.irq_status = SX126X_IRQ_RX_DONE
+    bus.rx_length = 40
+    lora._irq(None)
+    received = len(await asyncio.wait_for(lora.recv(), 1)) == 40
+    lora.release_rx()
+    # The channel is free now, CAD says so when it's done
+    bus.irq_status = SX126X_IRQ_CAD_DONE
+    while not sender.done():
+        lora._irq(None)
+        await asyncio.sleep(0.001)
+    sent = bus.commands[SX126X_CMD_SET_TX] == 1
+    lora.irq_task.cancel()
+    return restarts, cads, received, sent
+
+
+async def rx_busy_transactions() -> dict:
+    """SPI transactions of one rx_busy() call in each power mode, {mode name: transactions}."""
+    from net.lora import POWER_MODE_NAMES
+
+    lora, bus = host_lora()
+    transactions = {}
+    for mode, name in enumerate(POWER_MODE_NAMES):
+        lora.set_power_mode(mode)
+        bus.reset_counts()
+        lora.rx_busy()
+        transactions[name] = bus.transactions
+    lora.irq_task.cancel()
+    return transactions
+
+
+def main():
+    for block_ms, burst in ((0, 1), (5, 1), (40, 1), (0, 3)):
+        lora, spi_per_service = asyncio.run(run(block_ms, burst))
+        latency = lora.irq_latency
+        label = f"event loop blocking {block_ms:2} ms at a time, {burst} interrupt{'s' if burst > 1 else ''} at once"
+        print(
+            f"  {label:54}: latency mean {latency.mean_ms():5.2f} ms, max {latency.max_ms:5.2f} ms; "
+            f"{lora.irq_count} interrupts in {lora.irq_services} runs, {spi_per_service:.0f} SPI transactions each"
+        )
+    restarts, cads, received, sent = asyncio.run(receive_during_backoff())
+    print(
+        f"  {'sending while a frame arrives':54}: {restarts} Rx restarts and {cads} CADs while it was arriving, "
+        f"frame {'received' if received else 'lost'}, then {'sent' if sent else 'not sent'}"
+    )
+    assert not restarts and not cads, "Backing off from a frame being received restarted Rx"
+    assert received and sent
+    transactions = asyncio.run(rx_busy_transactions())
+    print(f"  {'rx_busy() SPI transactions':54}: " + ", ".join(f"{count} {name}" for name, count in transactions.items()))
+    assert transactions["duty_cycle"] == transactions["sleep"] == 0, "rx_busy() woke up a low power radio"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,751 @@
+#!/bin/env python3
+"""Micro-benchmarks for the badge network stack.
+
+This runs on your computer, not on the badge! Numbers from CPython are only useful to compare
+implementations against each other, the badge is a few hundred times slower.
+
+Examples:
+    # Run every benchmark
+    scripts/bench_net.py
+
+    # Run one benchmark
+    scripts/bench_net.py dedup
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import host_env  # noqa: F401  Must come before importing badge code
+from net.dedup import SeenCache
+from net.net import TX_CLASS_NAMES, TransmitScheduler
+from net.protocols import NetworkFrame, Protocol, ProtocolCodec
+from net import textcodec
+
+CHAT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_corpus.txt")
+
+
+def load_chat_corpus() -> list:
+    """Sample chat lines from a hacker conference, as bytes."""
+    with open(CHAT_CORPUS, "rb") as corpus:
+        return [line.rstrip(b"\n") for line in corpus if line.strip()]
+
+
+def timed(label: str, count: int, func, *args):
+    """Run func(*args) and print the time per operation."""
+    start = time.perf_counter_ns()
+    result = func(*args)
+    elapsed_ns = time.perf_counter_ns() - start
+    print(f"  {label:<40} {elapsed_ns / count:10.0f} ns/op  ({count} ops)")
+    return result
+
+
+def bench_dedup(entries: int = 10000):
+    """Duplicate suppression cache: SeenCache vs the old dict of checksum: (count, timestamp)."""
+    rng = random.Random(1)
+    keys = [rng.getrandbits(64) for _ in range(entries)]
+    misses = [rng.getrandbits(64) for _ in range(entries)]
+
+    print(f"Old dict cache, {entries} entries:")
+    old: dict[int, tuple[int, int]] = {}
+
+    def old_insert():
+        now = int(time.time())
+        for key in keys:
+            count, timestamp = old.get(key, (0, now))
+            old[key] = (count + 1, timestamp)
+
+    def old_lookup(lookup_keys):
+        for key in lookup_keys:
+            old.get(key, (0, 0))[0]
+
+    def old_flush():
+        # Was run every second by BadgeNet.flush_recently_seen()
+        now = int(time.time())
+        return {key: value for key, value in old.items() if now - value[1] < 6000}
+
+    timed("insert", entries, old_insert)
+    timed("lookup hit", entries, old_lookup, keys)
+    timed("lookup miss", entries, old_lookup, misses)
+    timed("flush (once a second)", 1, old_flush)
+
+    for generations in (4, 8):
+        print(f"SeenCache, {entries} entries, {generations} generations:")
+        cache = SeenCache(capacity=entries, generations=generations)
+
+        def new_insert():
+            for key in keys:
+                cache.increment(key)
+
+        def new_lookup(lookup_keys):
+            for key in lookup_keys:
+                cache.get(key)
+
+        # Fill the older generations first, so lookups have to search through them
+        timed("insert", entries, new_insert)
+        timed("lookup hit", entries, new_lookup, keys)
+        timed("lookup miss", entries, new_lookup, misses)
+        print(f"  stored {len(cache)} of {entries} inserted, {cache.evicted} evicted early")
+
+
+def bench_tx_latency(messages: int = 200):
+    """Time from send() to TX_DONE on a badge alone on a simulated channel, and idle event loop wakeups."""
+    import mesh_sim
+
+    idle_s = 60
+    simulation = mesh_sim.Simulation(nodes=1, duration_s=0, drain_s=idle_s)
+    simulation.execute()
+    print(f"Idle badge: {simulation.loop.wakeups()} event loop wakeups in {idle_s} s")
+
+    simulation = mesh_sim.Simulation(nodes=1, rate=0.5, duration_s=messages / 0.5, drain_s=5)
+    # Chatting every 2 s is more than the default airtime budget allows for one port
+    simulation.nodes[0].net.airtime.set_port_limit(mesh_sim.SIM_CHAT.port, 100, 1000)
+    simulation.execute()
+    latency = simulation.nodes[0].net.send_latency
+    print(f"send() to TX_DONE over {latency.count} chat messages:")
+    print(f"  mean {latency.mean_ms():.1f} ms, max {latency.max_ms} ms")
+
+
+def bench_tx_scheduler(messages: int = 10000):
+    """Transmit scheduler push/pop cost, and each class's share of transmissions while all are backlogged."""
+    frame = NetworkFrame()
+    scheduler = TransmitScheduler()
+    classes = len(TX_CLASS_NAMES)
+
+    def push_pop():
+        for i in range(messages):
+            scheduler.push(frame, i % classes)
+            scheduler.pop()
+
+    timed("push + pop", messages, push_pop)
+
+    scheduler = TransmitScheduler(depths=(messages,) * classes)
+    for tx_class in range(classes):
+        for _ in range(messages):
+            scheduler.push(tx_class, tx_class)  # Class number stands in for the frame
+    window = 30
+    order = [scheduler.pop() for _ in range(window)]
+    print(f"  first {window} sent with every class backlogged: {''.join(str(tx_class) for tx_class in order)}")
+    for tx_class, name in enumerate(TX_CLASS_NAMES):
+        print(f"    {tx_class} {name:<8} weight {scheduler.weights[tx_class]}  sent {order.count(tx_class)}")
+
+
+def bench_codec(messages: int = 10000):
+    """Encoding and decoding chat frames, the per-frame protocol work on the send and receive paths."""
+    chat = Protocol(port=6, name="TEXT_CHAT", structdef="!H10s100s")
+    protocols = {chat.port: chat}
+    payload = (901, b"alias", b"The quick brown fox jumps over the lazy badge")
+
+    def encode():
+        for _ in range(messages):
+            NetworkFrame().set_fields(protocol=chat, destination=0xFFFFFFFF, ttl=3, source=0x1234, payload=payload).serialize()
+
+    message = NetworkFrame().set_fields(protocol=chat, destination=0xFFFFFFFF, ttl=3, source=0x1234, payload=payload)
+    message.serialize()
+    frame = bytes(message.frame)
+
+    def decode():
+        for _ in range(messages):
+            NetworkFrame().set_frame(frame).validate_frame().deserialize(protocols)
+
+    received = []
+    for _ in range(messages):
+        message = NetworkFrame().set_frame(frame)
+        message.validated_frame = True  # Leave the CRC out, it's the same work either way
+        received.append(message)
+
+    def decode_payload():
+        for message in received:
+            message.deserialize(protocols)
+
+    timed("encode (set_fields + serialize)", messages, encode)
+    timed("decode (set_frame + validate + deserialize)", messages, decode)
+    timed("decode payload only (deserialize)", messages, decode_payload)
+
+
+def bench_mailbox(bursts: int = 10, burst_len: int = 6, handler_ms: float = 40.0):
+    """A receive handler that blocks for `handler_ms` per message (like an RSA verify), run inline vs in a mailbox.
+    Bursts of frames arrive 5 ms apart, like a flood reaching several neighbours at once. Measures how long
+    each frame waits before its relay is queued, on a badge by itself in simulated time."""
+    import mesh_sim
+    from net.dedup import frame_key
+    from net.net import BROADCAST_ADDRESS, BadgeNet
+
+    signed = Protocol(port=7, name="SIGNED_TEXT_CHAT", structdef="!H10s128s90s")
+    for mailbox_size in (0, 8):
+        loop = mesh_sim.VirtualTimeLoop()
+        mesh_sim.install_virtual_time(loop)
+        radio = mesh_sim.LoopbackRadio(airtime_s=0.005)
+        net = BadgeNet(0x1234)
+        net.relay_window_slots = 0  # Time the handler's hold up, not the relay backoff
+        arrivals = {}
+        delays = []
+        queue_transmit = net._queue_transmit
+
+        def record_relay(message, tx_class):
+            delays.append((loop.time() - arrivals[frame_key(message.frame)]) * 1000)
+            return queue_transmit(message, tx_class)
+
+        net._queue_transmit = record_relay
+
+        def handler(message):
+            loop.busy(handler_ms / 1000)
+
+        async def run():
+            mailbox = net.register_receiver(signed, handler, mailbox_size=mailbox_size)
+            net.init(mesh_sim.SimBadge(radio))
+            for i in range(bursts * burst_len):
+                message = NetworkFrame().set_fields(
+                    protocol=signed, destination=BROADCAST_ADDRESS, ttl=3, source=0x5678, payload=(0, b"", b"", b"%d" % i)
+                )
+                message.serialize()
+                # Arrivals are scheduled ahead, so they land on time even while the handler blocks
+                arrival = 1 + (i // burst_len) * 3 + (i % burst_len) * 0.005
+                loop.call_at(arrival, radio.inject, message.frame)
+                arrivals[frame_key(message.frame)] = arrival
+            await asyncio.sleep(bursts * 3 + 5)
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+            return mailbox
+
+        try:
+            mailbox = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        delays.sort()
+        mode = f"mailbox of {mailbox_size}" if mailbox_size else "inline"
+        print(f"Handler blocking {handler_ms:.0f} ms, {bursts} bursts of {burst_len} frames, {mode}:")
+        print(f"  receive to relay queued: mean {sum(delays) / len(delays):.0f} ms, max {delays[-1]:.0f} ms")
+        print(f"  most frames waiting in the radio: {radio.max_pending}")
+        if mailbox:
+            print(f"  {mailbox}")
+
+
+def bench_rx_drain(bursts: int = 10, burst_len: int = 40, spacing_ms: float = 4.0, frame_ms: float = 8.0):
+    """Bursts of frames arriving faster than the badge handles them (`frame_ms` each), drained one frame
+    per wakeup with a 1 ms sleep after each (the old recv_all()), vs in time sliced batches, with the
+    receive ring fixed or adapting to the bursts. Measures how long frames wait and how late a UI
+    refresh that wants to run every 33 ms gets, on a badge by itself in simulated time."""
+    import mesh_sim
+    from net.dedup import frame_key
+    from net.net import BROADCAST_ADDRESS, BadgeNet
+    from net.rxring import RX_RING_MAX_SLOTS, RX_RING_SLOTS, RxRing
+
+    chat = Protocol(port=6, name="TEXT_CHAT", structdef="!H10s100s")
+
+    async def old_recv_all(net):
+        while True:
+            frame = await net.badge.lora.recv()
+            net._receive_frame(frame)
+            net.badge.lora.release_rx()
+            await asyncio.sleep(0.001)
+
+    for label, slice_ms, max_slots in (
+        ("one frame per wakeup, 1 ms sleep, 16 buffers", None, RX_RING_SLOTS),
+        ("slices of 20 ms, 16 buffers", 20, RX_RING_SLOTS),
+        ("slices of 20 ms, adaptive ring", 20, RX_RING_MAX_SLOTS),
+        ("no time limit, adaptive ring", 10000, RX_RING_MAX_SLOTS),
+    ):
+        loop = mesh_sim.VirtualTimeLoop()
+        mesh_sim.install_virtual_time(loop)
+        ring = RxRing(RX_RING_SLOTS, max_slots=max_slots)
+        radio = mesh_sim.LoopbackRadio(airtime_s=0.005, rx_ring=ring)
+        net = BadgeNet(0x1234)
+        net.relay_window_slots = 0
+        arrivals = {}
+        waits = []
+        ui_late = []
+        receive_frame = net._receive_frame
+
+        def timed_receive(frame, *args):
+            loop.busy(frame_ms / 1000)  # The badge's CPU time for a frame
+            key = frame_key(frame)
+            if key in arrivals:
+                waits.append((loop.time() - arrivals.pop(key)) * 1000)
+            receive_frame(frame, *args)
+
+        net._receive_frame = timed_receive
+
+        def ui(due):
+            # A callback rather than a task: CPython's asyncio takes an extra loop pass to resume a
+            # sleeping task, Micropython's doesn't
+            ui_late.append((loop.time() - due) * 1000)
+            loop.call_at(max(due + 0.033, loop.time()), ui, max(due + 0.033, loop.time()))
+
+        async def run():
+            net.init(mesh_sim.SimBadge(radio))
+            if slice_ms is None:
+                net.lora_rx_task.cancel()
+                asyncio.create_task(old_recv_all(net))
+            else:
+                net.rx_slice_ms = slice_ms
+            loop.call_soon(ui, loop.time())
+            for i in range(bursts * burst_len):
+                message = NetworkFrame().set_fields(
+                    protocol=chat, destination=BROADCAST_ADDRESS, ttl=3, source=0x5678, payload=(0, b"", b"%d" % i)
+                )
+                message.serialize()
+                arrival = 1 + (i // burst_len) * 3 + (i % burst_len) * spacing_ms / 1000
+                loop.call_at(arrival, radio.inject, message.frame)
+                arrivals[frame_key(message.frame)] = arrival
+            await asyncio.sleep(bursts * 3 + 5)
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        waits.sort()
+        print(f"{label}:")
+        print(
+            f"  {len(waits)}/{bursts * burst_len} frames handled, waited mean {sum(waits) / len(waits):.0f} ms, "
+            f"p95 {waits[len(waits) * 95 // 100]:.0f} ms; UI up to {max(ui_late):.0f} ms late; "
+            f"{ring.overruns} dropped, ring grew to {ring.max_slots_used}; most frames per slice {max(net.rx_batch_max, 1)}"
+        )
+
+
+def bench_relay_suppression(nodes: int = 300, duration_s: float = 60.0, seeds: tuple = (1, 2, 3)):
+    """Flood test: every chat message relayed by every badge that hears it, vs relays held back by
+    signal strength and cancelled once other badges are heard repeating them."""
+    import mesh_sim
+
+    settings = (("relay immediately", 0, 1), ("hold, cancel after 1 copy", None, 1), ("hold, cancel after 2 copies", None, 2))
+    print(f"{nodes} badges, {duration_s:.0f} s of chat, mean of seeds {seeds}:")
+    for label, window, copies in settings:
+        results = [
+            mesh_sim.Simulation(
+                nodes=nodes, duration_s=duration_s, seed=seed, relay_window=window, relay_copies=copies
+            ).execute()
+            for seed in seeds
+        ]
+
+        def mean(key):
+            return sum(result[key] for result in results) / len(results)
+
+        print(
+            f"  {label:<28} transmissions/message {mean('transmissions_per_message'):6.1f}  "
+            f"delivery {mean('delivery_ratio'):.3f}  latency p50 {mean('latency_p50_ms'):4.0f} ms "
+            f"p95 {mean('latency_p95_ms'):5.0f} ms  channel busy {mean('channel_busy_pct'):4.1f}%"
+        )
+
+
+def check_bad_containers():
+    """Containers that pass their checksum but can't be unpacked, one cut short without being trimmed
+    and one with a frame running past its end, are dropped and counted. The badge keeps receiving."""
+    import mesh_sim
+    from net.crc16 import crc16_xmodem
+    from net.net import BROADCAST_ADDRESS, BadgeNet
+    from net.protocols import AGGREGATE_PROTO, FLAG_TRIMMED, MAX_FRAME_LEN
+
+    chat = mesh_sim.SIM_CHAT
+
+    def chat_frame(text: bytes) -> bytes:
+        message = NetworkFrame().set_fields(
+            protocol=chat, destination=BROADCAST_ADDRESS, ttl=1, source=0x5678, payload=(901, b"", text)
+        )
+        return bytes(message.serialize())
+
+    def container(payload: bytes, length: int | None = None) -> bytes:
+        frame = bytearray(
+            NetworkFrame()
+            .set_fields(protocol=AGGREGATE_PROTO, destination=BROADCAST_ADDRESS, ttl=0, source=0x5678, payload=payload)
+            .serialize()
+        )
+        if length is not None:
+            # Cut it short and mark it as full length, with a checksum that matches
+            frame = frame[:length]
+            frame[4] &= ~FLAG_TRIMMED
+            frame[5] = length
+        checksum = crc16_xmodem(memoryview(frame)[5:])
+        frame[2], frame[3] = checksum >> 8, checksum & 0xFF
+        return bytes(frame)
+
+    inner = chat_frame(b"inside")
+    overrun = bytearray(inner)
+    overrun[5] = MAX_FRAME_LEN  # Claims to run on past the end of the container
+    loop = mesh_sim.VirtualTimeLoop()
+    mesh_sim.install_virtual_time(loop)
+    radio = mesh_sim.LoopbackRadio(airtime_s=0.005)
+    net = BadgeNet(0x1234)
+    received = []
+
+    async def run():
+        net.register_receiver(chat, lambda message: received.append(message.payload[2].rstrip(b"\0")))
+        net.init(mesh_sim.SimBadge(radio))
+        for frame in (container(inner, 40), container(bytes(overrun)), chat_frame(b"after")):
+            radio.inject(frame)
+            await asyncio.sleep(0.1)
+        alive = not net.lora_rx_task.done()
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+        return alive
+
+    try:
+        alive = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    print(f"Bad containers: {net.containers_dropped} of 2 dropped, receive task {'running' if alive else 'dead'}, "
+          f"next frame {'received' if received == [b'after'] else 'lost'}")
+    assert net.containers_dropped == 2 and alive and received == [b"after"]
+
+
+def bench_aggregation(nodes: int = 300, duration_s: float = 60.0, seeds: tuple = (1, 2, 3), burst: int = 4):
+    """Burst test: badges sending several short messages at once, each frame on its own vs packed
+    into containers. Frames are trimmed in both, full length chat frames are too long to share one."""
+    import mesh_sim
+
+    check_bad_containers()
+    print(f"{nodes} badges, {duration_s:.0f} s of bursts of {burst} short messages, mean of seeds {seeds}:")
+    for label, aggregate in (("one frame per transmission", False), ("containers", True)):
+        results = [
+            mesh_sim.Simulation(
+                nodes=nodes, rate=0.25, duration_s=duration_s, seed=seed, burst=burst, aggregate=aggregate, trim=True
+            ).execute()
+            for seed in seeds
+        ]
+
+        def mean(key):
+            return sum(result[key] for result in results) / len(results)
+
+        print(
+            f"  {label:<28} transmissions/message {mean('transmissions_per_message'):6.1f}  "
+            f"delivery {mean('delivery_ratio'):.3f}  latency p95 {mean('latency_p95_ms'):5.0f} ms  "
+            f"channel busy {mean('channel_busy_pct'):4.1f}%  frames/container "
+            f"{mean('frames_aggregated') / max(1, mean('containers_sent')):.1f}"
+        )
+
+
+def bench_routing(nodes: int = 300, duration_s: float = 60.0, seeds: tuple = (1, 2, 3)):
+    """Unicast replies to chat messages (like PONGs answering PINGs), flooded vs routed back along
+    the way the message came, and routed to direct neighbours as well (ROUTE_MIN_HOPS 0)."""
+    import mesh_sim
+    from net import net
+
+    default_min_hops = net.ROUTE_MIN_HOPS
+    print(f"{nodes} badges, {duration_s:.0f} s of chat, each message answered by a unicast, mean of seeds {seeds}:")
+    for label, route, min_hops in (
+        ("flooded", False, default_min_hops),
+        ("routed", True, default_min_hops),
+        ("routed, direct too", True, 0),
+    ):
+        net.ROUTE_MIN_HOPS = min_hops
+        results = [
+            mesh_sim.Simulation(nodes=nodes, duration_s=duration_s, seed=seed, replies=True, route=route).execute()
+            for seed in seeds
+        ]
+
+        def mean(key):
+            return sum(result[key] for result in results) / len(results)
+
+        print(
+            f"  {label:<18} relays/reply {mean('relays_per_reply'):6.1f}  reply delivery {mean('reply_delivery_ratio'):.3f}  "
+            f"routed {mean('routed_sent') / mean('replies'):4.0%}  chat delivery {mean('delivery_ratio'):.3f}  "
+            f"channel busy {mean('channel_busy_pct'):4.1f}%"
+        )
+    net.ROUTE_MIN_HOPS = default_min_hops
+
+
+def bench_low_power(nodes: int = 300, duration_s: float = 60.0, seeds: tuple = (1, 2, 3)):
+    """What a low power mesh costs: every badge sending LoRaRadio.LOW_POWER_PREAMBLE symbols of
+    preamble so duty cycled receivers catch their frames, against the normal preamble."""
+    import mesh_sim
+
+    print(f"{nodes} badges, {duration_s:.0f} s of chat, mean of seeds {seeds}:")
+    for label, preamble in (("normal preamble, 16", 16), ("low power mesh, 64", 64)):
+        model = mesh_sim.ChannelModel(preamble=preamble)
+        results = [
+            mesh_sim.Simulation(nodes=nodes, duration_s=duration_s, seed=seed, model=model).execute() for seed in seeds
+        ]
+
+        def mean(key):
+            return sum(result[key] for result in results) / len(results)
+
+        print(
+            f"  {label:<20} chat frame {model.time_on_air_s(60) * 1000:4.1f} ms on air  delivery {mean('delivery_ratio'):.3f}  "
+            f"latency p50 {mean('latency_p50_ms'):4.0f} ms p95 {mean('latency_p95_ms'):5.0f} ms  "
+            f"channel busy {mean('channel_busy_pct'):4.1f}%"
+        )
+
+
+def bench_csma(nodes: int = 300, duration_s: float = 60.0, seeds: tuple = (1, 2, 3)):
+    """Channel access backoff: a window that never grows (10 ms, close to the old retry loop) against
+    binary exponential backoff up to the default cap of 40 ms and a bigger one."""
+    import mesh_sim
+
+    print(f"{nodes} badges, {duration_s:.0f} s of chat, mean of seeds {seeds}:")
+    for label, max_backoff_ms in (("fixed 10 ms window", 10), ("exponential to 40 ms", 40), ("exponential to 320 ms", 320)):
+        results = [
+            mesh_sim.Simulation(nodes=nodes, duration_s=duration_s, seed=seed, max_backoff_ms=max_backoff_ms).execute()
+            for seed in seeds
+        ]
+
+        def mean(key):
+            return sum(result[key] for result in results) / len(results)
+
+        print(
+            f"  {label:<22} CADs {mean('cad'):7.0f}  busy {100 * mean('cad_busy_ratio'):4.1f}%  "
+            f"access delay {mean('access_delay_mean_ms'):5.1f} ms  delivery {mean('delivery_ratio'):.3f}  "
+            f"latency p95 {mean('latency_p95_ms'):4.0f} ms  collisions {mean('rx_collisions'):6.0f}"
+        )
+
+
+def bench_reliable(messages: int = 40, losses: tuple = (0.0, 0.1, 0.3)):
+    """send_reliable() end to end between two badges over a loopback link that loses frames at random,
+    in simulated time. Checks every message arrives once and intact."""
+    import mesh_sim
+    from net.net import BadgeNet
+    from net.transport import MAX_MESSAGE_LEN, ReliableTransport
+
+    test_protocol = Protocol(port=42, name="RELIABLE_TEST", structdef="!10s")
+    for loss in losses:
+        loop = mesh_sim.VirtualTimeLoop()
+        mesh_sim.install_virtual_time(loop)
+        rng = random.Random(1)
+        radios = (mesh_sim.LoopbackRadio(airtime_s=0.02), mesh_sim.LoopbackRadio(airtime_s=0.02))
+        radios[0].link(radios[1], loss)
+        nets = (BadgeNet(0x1111), BadgeNet(0x2222))
+        sender, receiver = ReliableTransport(nets[0]), ReliableTransport(nets[1])
+        received = []
+        receiver.register_receiver(test_protocol, lambda source, data: received.append(data))
+        sizes = [rng.choice((10, 200, 1000, MAX_MESSAGE_LEN)) for _ in range(messages)]
+        payloads = [bytes(rng.getrandbits(8) for _ in range(size)) for size in sizes]
+
+        async def run():
+            for net, radio in zip(nets, radios):
+                net.init(mesh_sim.SimBadge(radio))
+            results = [await sender.send(0x2222, test_protocol, payload) for payload in payloads]
+            await asyncio.sleep(5)  # Let the last ACKs land
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+            return results
+
+        try:
+            results = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        ok = sum(results)
+        intact = sum(1 for data in received if data in payloads) == len(received)
+        print(f"{messages} messages of {min(sizes)}-{max(sizes)} bytes, {loss:.0%} of frames lost:")
+        print(f"  acknowledged {ok}/{messages}, delivered {len(received)} (intact: {intact}), "
+              f"{sender.fragments_sent} fragments sent, {sender.retransmits} resent, "
+              f"{receiver.duplicates} duplicate messages re-ACKed")
+        print(f"  send time mean {sender.send_time.mean_ms():.0f} ms, max {sender.send_time.max_ms} ms, "
+              f"{sender.peers[0x2222]}")
+
+
+def bench_crc(repeats: int = 20000):
+    """CRC-16/XMODEM of 16-250 byte frames with each implementation this Python has, and with the
+    libs.crc Calculator protocols.py used before. The viper one only exists on Micropython."""
+    from libs.crc import Calculator, Crc16
+    from net import crc16
+
+    calculator = Calculator(Crc16.xmodem)
+    implementations = [(name, crc16.BACKENDS[name]) for name in crc16.BACKEND_ORDER if name in crc16.BACKENDS]
+    implementations.append(("libs.crc Calculator", calculator.checksum))
+    print(f"crc16_xmodem() uses {crc16.CRC16_BACKEND}, available: {', '.join(crc16.BACKENDS)}")
+    rng = random.Random(1)
+    for length in (16, 64, 128, 250):
+        frame = memoryview(bytes(rng.getrandbits(8) for _ in range(length + 5)))[5:]  # As frames are checked
+        expected = crc16.crc16_xmodem(frame)
+        for name, crc_function in implementations:
+            assert crc_function(frame) == expected, f"{name} disagrees"
+
+            def run(crc_function=crc_function):
+                for _ in range(repeats):
+                    crc_function(frame)
+
+            timed(f"{length:3} bytes, {name}", repeats, run)
+
+
+def bench_frame_trim():
+    """Frame length and time on air for the chat corpus, with the payload padding sent vs trimmed."""
+    import mesh_sim
+
+    model = mesh_sim.ChannelModel()
+    corpus = load_chat_corpus()
+    aliases = (b"", b"wrencher", b"bob", b"k6abc")
+    protocols = (
+        (Protocol(port=6, name="TEXT_CHAT", structdef="!H10s100s"), lambda i, text: (901, aliases[i % 4], text)),
+        (
+            Protocol(port=7, name="SIGNED_TEXT_CHAT", structdef="!H10s128s90s"),
+            lambda i, text: (901, aliases[i % 4], bytes(random.Random(i).getrandbits(8) for _ in range(128)), text[:90]),
+        ),
+    )
+    print(f"{len(corpus)} chat messages, mean {sum(len(text) for text in corpus) / len(corpus):.0f} bytes of text, "
+          f"SF{model.sf} {model.bw_khz:.0f} kHz:")
+    for protocol, payload in protocols:
+        fixed = ProtocolCodec(protocol, trim=False)
+        trimmed = ProtocolCodec(protocol, trim=True)
+        fixed_len = fixed_ms = trimmed_len = trimmed_ms = 0
+        for i, text in enumerate(corpus):
+            for codec in (fixed, trimmed):
+                frame, _ = codec.encode(3, 0xFFFFFFFF, 0x1234, i, payload(i, text))
+                airtime_ms = model.time_on_air_s(len(frame)) * 1000
+                if codec is fixed:
+                    fixed_len += len(frame)
+                    fixed_ms += airtime_ms
+                else:
+                    trimmed_len += len(frame)
+                    trimmed_ms += airtime_ms
+        count = len(corpus)
+        print(f"  {protocol.name}:")
+        print(f"    padded   {fixed_len / count:6.1f} bytes  {fixed_ms / count:5.1f} ms on air per frame")
+        print(f"    trimmed  {trimmed_len / count:6.1f} bytes  {trimmed_ms / count:5.1f} ms on air per frame, "
+              f"{100 * (1 - trimmed_ms / fixed_ms):.0f}% less airtime on every hop")
+
+
+def bench_text_codec():
+    """Compression ratio and speed of net.textcodec on the chat corpus, and what it saves on air."""
+    import mesh_sim
+
+    model = mesh_sim.ChannelModel()
+    corpus = load_chat_corpus()
+    compressed = [textcodec.compress(text) for text in corpus]
+    raw_len = sum(len(text) for text in corpus)
+    sent_len = sum(len(packed or text) for text, packed in zip(corpus, compressed))
+    for text, packed in zip(corpus, compressed):
+        assert packed is None or textcodec.decompress(packed) == text
+    print(f"{len(corpus)} chat messages, {raw_len} bytes of text:")
+    print(f"  encoded {sent_len} bytes, {100 * sent_len / raw_len:.0f}% of raw, "
+          f"{sum(packed is None for packed in compressed)} messages left raw")
+    print("  The dictionary was picked with this corpus in mind, expect real chat to compress a bit less.")
+    rounds = 100
+    timed("compress", rounds * len(corpus), lambda: [textcodec.compress(text) for _ in range(rounds) for text in corpus])
+    packed = [packed for packed in compressed if packed]
+    timed("decompress", rounds * len(packed), lambda: [textcodec.decompress(data) for _ in range(rounds) for data in packed])
+    # Every position tries the most dictionary words, sharing a first pair with the longest list
+    worst = b"th" * (textcodec.MAX_COMPRESS_LEN // 2)
+    timed(f"compress worst case, {len(worst)} bytes", rounds, lambda: [textcodec.compress(worst) for _ in range(rounds)])
+    print(f"  at most {textcodec.MAX_CANDIDATES} dictionary comparisons per byte, "
+          f"{textcodec.MAX_CANDIDATES * textcodec.MAX_COMPRESS_LEN} per message")
+
+    chat = ProtocolCodec(Protocol(port=6, name="TEXT_CHAT", structdef="!H10s100s"), trim=True)
+    raw_ms = packed_ms = 0
+    for i, (text, packed) in enumerate(zip(corpus, compressed)):
+        frame, _ = chat.encode(3, 0xFFFFFFFF, 0x1234, i, (901, b"wrencher", text))
+        raw_ms += model.time_on_air_s(len(frame)) * 1000
+        # 0x8000 is CHAT_COMPRESSED from apps/chat.py, which needs LVGL to import
+        frame, _ = chat.encode(3, 0xFFFFFFFF, 0x1234, i, (901 | 0x8000, b"wrencher", packed or text))
+        packed_ms += model.time_on_air_s(len(frame)) * 1000
+    print(f"  TEXT_CHAT frames (trimmed), SF{model.sf} {model.bw_khz:.0f} kHz: raw {raw_ms / len(corpus):.1f} ms, "
+          f"compressed {packed_ms / len(corpus):.1f} ms on air per frame, "
+          f"{100 * (1 - packed_ms / raw_ms):.0f}% less airtime on every hop")
+
+
+def bench_neighbors(neighbors: int = 500, updates: int = 100000, nodes: int = 100, duration_s: float = 120.0):
+    """Cost and memory of the neighbour table, and how well it tells direct neighbours from the rest
+    in a simulated hall, against the links the simulated channel actually has."""
+    import tracemalloc
+    import mesh_sim
+    from net.neighbors import DEFAULT_NEIGHBOR_TABLE_SIZE, NeighborTable
+
+    rng = random.Random(1)
+    addresses = [rng.getrandbits(32) for _ in range(neighbors)]
+    for size, badge_kb in ((DEFAULT_NEIGHBOR_TABLE_SIZE, 6), (neighbors, 46)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        table = NeighborTable(size)
+        for seq, address in enumerate(addresses[:size]):
+            table.heard(address, seq & 0xFF, 3, -80.0, 5.0)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print(f"{size} neighbours: {used / 1024:.1f} KiB on CPython ({used / size:.0f} bytes each), "
+              f"about {badge_kb}KB on the badge (see net/neighbors.py)")
+    heard = [(rng.choice(addresses), rng.getrandbits(8), rng.randrange(4)) for _ in range(updates)]
+    timed("heard(), known badge", updates, lambda: [table.heard(a, s, t, -80.0, 5.0) for a, s, t in heard])
+    timed("rssi() + prr() + hops()", updates,
+          lambda: [(table.rssi(a), table.prr(a), table.hops(a)) for a, _, _ in heard])
+    strangers = [rng.getrandbits(32) for _ in range(1000)]
+    timed("heard(), new badge in a full table", len(strangers), lambda: [table.heard(a, 0, 3, -80.0, 5.0) for a in strangers])
+    print(f"  {table}")
+
+    sim = mesh_sim.Simulation(nodes=nodes, duration_s=duration_s, seed=1)
+    sim.execute()
+    # A link is direct if its mean signal is strong enough to demodulate
+    model = sim.model
+    decodable_dbm = model.noise_floor_dbm + model.demod_snr_db
+    right = wrong = missed = 0
+    rssi_error = []
+    for node in sim.nodes:
+        links = {sim.nodes[j].net.address: rssi for j, rssi in sim.channel.links[node.index]}
+        table = node.net.neighbors
+        for other in sim.nodes:
+            address = other.net.address
+            if address not in table:
+                continue
+            direct = links.get(address, -999.0) >= decodable_dbm
+            if table.hops(address) == 0:
+                if direct:
+                    right += 1
+                    rssi_error.append(abs(table.rssi(address) - links[address]))
+                else:
+                    wrong += 1
+            elif direct:
+                missed += 1
+    known = sum(len(node.net.neighbors) for node in sim.nodes)
+    print(f"{nodes} badges, {duration_s:.0f} s of chat: {known / nodes:.0f} badges in each table, "
+          f"{(right + wrong) / nodes:.1f} of them direct")
+    print(f"  direct neighbours: {right} right, {wrong} really further, {missed} direct ones taken for further; "
+          f"RSSI within {sorted(rssi_error)[len(rssi_error) // 2]:.1f} dB of the link's mean (median)")
+
+
+def bench_rx_alloc():
+    """Memory and time per received frame on the receive path, see bench_rx_alloc.py."""
+    import bench_rx_alloc
+
+    bench_rx_alloc.main()
+
+
+def bench_spi():
+    """SPI calls per startTransmit() and readData() in the radio driver, see bench_spi.py."""
+    import bench_spi
+
+    bench_spi.main()
+
+
+def bench_irq():
+    """Radio interrupt to handled latency with the event loop busy, see bench_irq.py."""
+    import bench_irq
+
+    bench_irq.main()
+
+
+BENCHMARKS = {
+    "dedup": bench_dedup,
+    "tx_scheduler": bench_tx_scheduler,
+    "rx_alloc": bench_rx_alloc,
+    "spi": bench_spi,
+    "irq": bench_irq,
+    "codec": bench_codec,
+    "crc": bench_crc,
+    "frame_trim": bench_frame_trim,
+    "text_codec": bench_text_codec,
+    "neighbors": bench_neighbors,
+    "mailbox": bench_mailbox,
+    "rx_drain": bench_rx_drain,
+    "tx_latency": bench_tx_latency,
+    "relay_suppression": bench_relay_suppression,
+    "aggregation": bench_aggregation,
+    "reliable": bench_reliable,
+    "routing": bench_routing,
+    "low_power": bench_low_power,
+    "csma": bench_csma,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("BadgeNet benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run, default all: {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark {name}, pick from: {', '.join(BENCHMARKS)}")
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name]()
+        print()
@@ -0,0 +1,215 @@
+#!/bin/env python3
+"""Heap allocations on the badgenet receive path, per received frame.
+
+This runs on your computer, not on the badge, under either CPython or the unix port of
+Micropython, which allocates the same way the badge does:
+
+    python3 scripts/bench_rx_alloc.py
+    micropython scripts/bench_rx_alloc.py
+
+It replays a mix of frames through the same steps the radio's RX_DONE handler and
+BadgeNet.recv_all() take (read the packet out of the radio, queue it, validate, duplicate check,
+relay copy, address check, decode) and reports how much heap each frame churns through, three ways:
+the baseline, with frames read into new buffers and queued as bytes, as the driver used to, and a
+new NetworkFrame for each one (and each relay); the same with NetworkFrames from the frame pool; and
+frames read into the RxRing, with the pool, as the firmware does now. The rest of the receive path
+is today's code in all three, so the baseline is the old buffer handling, not the old firmware.
+On Micropython that is exact: the garbage collector is turned off and gc.mem_alloc() counts every
+byte allocated. CPython frees most objects immediately, so there it reports the peak extra memory
+in use while handling a frame (from tracemalloc), for the whole receive path and for reading and
+queueing the frame alone. Those don't stand in for the badge: a memoryview is about 180 bytes on
+CPython and 16 on Micropython, so the ring's views weigh more there than the copies they replace.
+"""
+
+import gc
+import sys
+import time
+
+# No host_env here, it needs CPython. The modules used below don't need any of its stand-ins.
+SCRIPTS_DIR = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+sys.path.insert(0, SCRIPTS_DIR + "/../badge")
+
+from net.dedup import SeenCache, frame_key  # noqa: E402
+from net import protocols  # noqa: E402
+from net.protocols import FramePool, NetworkFrame, Protocol  # noqa: E402
+from net.rxring import RxRing  # noqa: E402
+
+MY_ADDRESS = 0x12345678
+BROADCAST_ADDRESS = 0xFFFFFFFF
+CHAT = Protocol(port=6, name="TEXT_CHAT", structdef="!H10s100s")
+PING = Protocol(port=1, name="PING", structdef="!IB")
+PROTOCOLS = {CHAT.port: CHAT, PING.port: PING}
+RATE = 20  # Frames per second, a busy channel
+FREE_HEAP = 100 * 1024  # Collections happen about every time this much has been allocated
+
+
+def make_frames(count: int) -> list:
+    """A flood as a badge hears it: each new message followed by copies relayed by neighbours."""
+    frames = []
+    for i in range(count):
+        if i % 4 == 0:
+            message = NetworkFrame().set_fields(
+                protocol=PING, destination=BROADCAST_ADDRESS, ttl=3, source=0x1000 + i, payload=(0x1000 + i, i & 0xFF)
+            )
+        else:
+            message = NetworkFrame().set_fields(
+                protocol=CHAT,
+                destination=BROADCAST_ADDRESS,
+                ttl=3,
+                source=0x1000 + i,
+                payload=(901, b"alias", b"Hello from the benchmark %d" % i),
+            )
+        message.serialize()
+        frame = bytes(message.frame)
+        frames.append(frame)
+        frames.append(frame)  # The same message relayed back by a neighbour
+    return frames
+
+
+def read_copied(frame, queue: list):
+    """What the RX_DONE handler did: read into a new buffer, queue a bytes copy of it."""
+    data = bytearray(len(frame))
+    data_mv = memoryview(data)
+    data_mv[:] = frame  # The SPI read
+    queue.append(bytes(data))
+    return queue.pop(0)
+
+
+def read_ring(frame, ring: RxRing):
+    """Read into the next ring buffer and take a view of it, as LoraRadio does now."""
+    buf = ring.reserve()
+    buf[: len(frame)] = frame  # The SPI read
+    ring.commit(len(frame))
+    return ring.pop()
+
+
+def receive(frame, seen: SeenCache, relays: list):
+    """The steps BadgeNet.recv_all() takes for one frame. Every frame is a broadcast, as if an app
+    listens on every port, so each new one is delivered (and copied out of a ring buffer)."""
+    pool = protocols.frame_pool
+    message = pool.acquire().set_frame(frame).validate_frame()
+    if seen.increment(frame_key(message.frame)) == 0:
+        relay = message.check_for_retransmit(MY_ADDRESS)
+        if relay is not None:
+            relays.append(relay)
+        if message.check_for_me(MY_ADDRESS, BROADCAST_ADDRESS) and hasattr(message, "own_frame"):
+            message.own_frame()
+        message.deserialize(PROTOCOLS)
+    else:
+        pool.release(message)
+
+
+def measure(frames: list, ring: RxRing | None = None, pooled: bool = True) -> tuple:
+    """Returns (bytes allocated per frame, microseconds per frame), reading frames into `ring` if given.
+    Without `pooled`, an empty pool stands in for the frame pool, so every frame allocates a NetworkFrame."""
+    shared_pool = protocols.frame_pool
+    if not pooled:
+        protocols.frame_pool = FramePool(0)
+    try:
+        return _measure(frames, ring)
+    finally:
+        protocols.frame_pool = shared_pool
+
+
+def _measure(frames: list, ring: RxRing | None) -> tuple:
+    pool = protocols.frame_pool
+    relays = []
+    queue = []
+
+    def run(step=None):
+        seen = SeenCache(capacity=4096)
+        for frame in frames:
+            if step:
+                step()
+            if ring is None:
+                receive(read_copied(frame, queue), seen, relays)
+            else:
+                receive(read_ring(frame, ring), seen, relays)
+                ring.release()
+            # send_all() releases relays once they're transmitted
+            while relays:
+                pool.release(relays.pop())
+
+    gc.collect()
+    if hasattr(gc, "mem_alloc"):
+        gc.disable()
+        start_alloc = gc.mem_alloc()
+        start = time.ticks_us()
+        run()
+        elapsed_us = time.ticks_diff(time.ticks_us(), start)
+        allocated = gc.mem_alloc() - start_alloc
+        gc.enable()
+        return allocated / len(frames), elapsed_us / len(frames)
+
+    import tracemalloc
+
+    start = time.perf_counter_ns()
+    run()
+    elapsed_us = (time.perf_counter_ns() - start) / 1000
+    peaks = []
+
+    def frame_peak():
+        # Peak of the previous frame, then start measuring the next one
+        current, peak = tracemalloc.get_traced_memory()
+        if peaks:
+            peaks[-1] = peak - peaks[-1]
+        peaks.append(current)
+        tracemalloc.reset_peak()
+
+    tracemalloc.start()
+    run(frame_peak)
+    frame_peak()
+    tracemalloc.stop()
+    peaks.pop()
+    return sum(peaks) / len(frames), elapsed_us / len(frames)
+
+
+def measure_handoff(frames: list, ring: RxRing | None = None) -> float:
+    """CPython only: peak extra memory per frame of just reading it and handing it to BadgeNet.
+    The whole receive path's peak is set by decoding, after the handoff's buffers are gone."""
+    import tracemalloc
+
+    queue = []
+    total = 0
+    tracemalloc.start()
+    for frame in frames:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        if ring is None:
+            view = read_copied(frame, queue)
+        else:
+            view = read_ring(frame, ring)
+            ring.release()
+        total += tracemalloc.get_traced_memory()[1] - before
+        del view
+    tracemalloc.stop()
+    return total / len(frames)
+
+
+def main(messages: int = 500):
+    frames = make_frames(messages)
+    ring = RxRing()
+    paths = (
+        ("baseline: new buffers, new frames", None, False),
+        ("new buffers, frame pool", None, True),
+        ("RxRing, frame pool", ring, True),
+    )
+    for _, frame_ring, pooled in paths:
+        measure(frames[:50], frame_ring, pooled)  # Warm up caches and the pool
+    micropython = hasattr(gc, "mem_alloc")
+    unit = "heap allocated" if micropython else "peak extra memory (tracemalloc)"
+    print(f"  {len(frames)} frames, half of them duplicates, {unit} per received frame:")
+    for label, frame_ring, pooled in paths:
+        allocated, elapsed_us = measure(frames, frame_ring, pooled)
+        line = f"  {label:34} {allocated:4.0f} bytes, {elapsed_us:5.1f} us"
+        if micropython:
+            # The collector runs when the free heap is used up, so the allocation rate sets how often
+            gc_interval_s = FREE_HEAP / (allocated * RATE) if allocated else float("inf")
+            line += f"; at {RATE} frames/s a collection every {gc_interval_s:.0f} s per {FREE_HEAP // 1024} KB free"
+        else:
+            line += f" (reading and queueing the frame alone: {measure_handoff(frames, frame_ring):.0f} bytes)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
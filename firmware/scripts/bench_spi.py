@@ -0,0 +1,223 @@
+#!/bin/env python3
+"""SPI traffic of the SX126x driver, one call per byte vs a whole command per transaction.
+
+This runs on your computer, not on the badge!
+
+    python3 scripts/bench_spi.py
+
+The real driver (`badge/net/sx126x.py`) talks to FakeSX126xSPI, a stand-in for the badge's
+`SPI.Device` with just enough of an SX126x behind it to answer the commands startTransmit() and
+readData() send: a 256 byte data buffer, registers, and fixed replies to the GET_* commands. It
+counts the Python level SPI calls, chip select transactions and bytes on the bus, which are the
+same on the badge. Times are CPython's, the badge is a few hundred times slower.
+"""
+
+import collections
+import sys
+import time
+import types
+
+import host_env  # noqa: F401  Must come before importing badge code
+from net import sx126x
+from net._sx126x import (
+    SX126X_CMD_GET_IRQ_STATUS,
+    SX126X_CMD_GET_PACKET_STATUS,
+    SX126X_CMD_GET_PACKET_TYPE,
+    SX126X_CMD_GET_RX_BUFFER_STATUS,
+    SX126X_CMD_READ_BUFFER,
+    SX126X_CMD_READ_REGISTER,
+    SX126X_CMD_WRITE_BUFFER,
+    SX126X_CMD_WRITE_REGISTER,
+    SX126X_IRQ_RX_DONE,
+    SX126X_PACKET_TYPE_LORA,
+    SX126X_STATUS_DATA_AVAILABLE,
+    SX126X_STATUS_MODE_STDBY_RC,
+)
+from net.protocols import MAX_FRAME_LEN
+from net.sx1262 import SX1262
+
+STATUS = SX126X_STATUS_MODE_STDBY_RC | SX126X_STATUS_DATA_AVAILABLE
+CS_PIN = 17  # As LoraRadio wires the radio
+
+
+class FakeChipSelect:
+    """The radio's chip select pin, telling the bus where transactions start and end."""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._value = 1
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        if self._value and not value:
+            self.bus.transactions += 1
+            self.bus._mosi = bytearray()
+        self._value = value
+
+
+class FakePin:
+    """Any other pin. BUSY always reads low, so the driver never waits."""
+
+    IN = 0
+    OUT = 1
+    IRQ_RISING = 1
+
+    def __init__(self, pin, mode=IN):
+        self.pin = pin
+
+    def value(self, value=None):
+        return 0
+
+    def irq(self, trigger=None, handler=None):
+        pass
+
+
+class FakeSX126xSPI:
+    """Host stand-in for SPI.Device with an SX126x on the other end, counting the traffic."""
+
+    def __init__(self):
+        self.cs = FakeChipSelect(self)
+        self.buffer = bytearray(256)
+        self.registers = {}
+        self.rx_length = 0
+        self.irq_status = SX126X_IRQ_RX_DONE
+        self.calls = 0
+        self.transactions = 0
+        self.bytes = 0
+        self.commands = collections.Counter()  # Transactions per command opcode
+        self._mosi = bytearray()
+
+    def reset_counts(self):
+        self.calls = 0
+        self.transactions = 0
+        self.bytes = 0
+        self.commands.clear()
+
+    def _reply(self, opcode: int, pos: int) -> int:
+        """What the radio sends back while receiving byte `pos` of the transaction."""
+        mosi = self._mosi
+        if opcode == SX126X_CMD_WRITE_BUFFER:
+            if pos >= 2:
+                self.buffer[(mosi[1] + pos - 2) & 0xFF] = mosi[pos]
+            return STATUS
+        if opcode == SX126X_CMD_READ_BUFFER:
+            return STATUS if pos < 3 else self.buffer[(mosi[1] + pos - 3) & 0xFF]
+        if opcode == SX126X_CMD_WRITE_REGISTER:
+            if pos >= 3:
+                self.registers[(mosi[1] << 8 | mosi[2]) + pos - 3] = mosi[pos]
+            return STATUS
+        if opcode == SX126X_CMD_READ_REGISTER:
+            return STATUS if pos < 4 else self.registers.get((mosi[1] << 8 | mosi[2]) + pos - 4, 0)
+        replies = {
+            SX126X_CMD_GET_PACKET_TYPE: (SX126X_PACKET_TYPE_LORA,),
+            SX126X_CMD_GET_RX_BUFFER_STATUS: (self.rx_length, 0),
+            SX126X_CMD_GET_IRQ_STATUS: (self.irq_status >> 8, self.irq_status & 0xFF),
+            SX126X_CMD_GET_PACKET_STATUS: (180, 40, 170),
+        }.get(opcode, ())
+        if pos < 2 or pos - 2 >= len(replies):
+            return STATUS
+        return replies[pos - 2]
+
+    def _exchange(self, byte: int) -> int:
+        self._mosi.append(byte)
+        pos = len(self._mosi) - 1
+        if pos == 0:
+            self.commands[byte] += 1
+            return STATUS
+        return self._reply(self._mosi[0], pos)
+
+    # The machine.SPI methods the driver uses
+
+    def write(self, buf):
+        self.calls += 1
+        self.bytes += len(buf)
+        for byte in buf:
+            self._exchange(byte)
+
+    def read(self, nbytes, write=0x00):
+        self.calls += 1
+        self.bytes += nbytes
+        return bytes(self._exchange(write) for _ in range(nbytes))
+
+    def readinto(self, buf, write=0x00):
+        self.calls += 1
+        self.bytes += len(buf)
+        for i in range(len(buf)):
+            buf[i] = self._exchange(write)
+
+    def write_readinto(self, write_buf, read_buf):
+        self.calls += 1
+        self.bytes += len(write_buf)
+        for i in range(len(write_buf)):
+            read_buf[i] = self._exchange(write_buf[i])
+
+
+def install_fake_bus() -> FakeSX126xSPI:
+    """Point the driver at a new FakeSX126xSPI and have it run its Micropython code paths.
+    Radios created after this talk to the returned bus."""
+    bus = FakeSX126xSPI()
+
+    class Pin(FakePin):
+        def __new__(cls, pin, mode=FakePin.IN):
+            return bus.cs if pin == CS_PIN else super().__new__(cls)
+
+    machine_spi = types.SimpleNamespace(Bus=lambda **kwargs: None, Device=lambda **kwargs: bus)
+    for name, value in (
+        ("implementation", types.SimpleNamespace(name="micropython")),
+        ("SPI", machine_spi),
+        ("Pin", Pin),
+        ("sleep_ms", lambda ms: None),
+        ("sleep_us", lambda us: None),
+        ("ticks_ms", time.ticks_ms),
+        ("ticks_diff", time.ticks_diff),
+    ):
+        setattr(sx126x, name, value)
+    return bus
+
+
+def host_radio() -> tuple:
+    """The real SX1262 driver on a FakeSX126xSPI. Returns (radio, bus)."""
+    bus = install_fake_bus()
+    radio = SX1262(spi_host=2, sck=8, mosi=3, miso=9, cs=CS_PIN, irq=16, rst=18, gpio=15)
+    return radio, bus
+
+
+def measure(radio, bus, bulk: bool, frame: bytes, repeats: int) -> dict:
+    """SPI calls, transactions and bytes per startTransmit() and readData() of `frame`, and time per call."""
+    radio._spiBulk = bulk
+    received = bytearray(len(frame))
+    received_mv = memoryview(received)
+    results = {}
+    for name, operation in (
+        ("startTransmit", lambda: radio.startTransmit(frame, len(frame))),
+        ("readData", lambda: radio.readData(received_mv, len(frame))),
+    ):
+        bus.reset_counts()
+        start = time.perf_counter_ns()
+        for _ in range(repeats):
+            operation()
+        elapsed_us = (time.perf_counter_ns() - start) / 1000 / repeats
+        results[name] = (bus.calls / repeats, bus.transactions / repeats, bus.bytes / repeats, elapsed_us)
+    assert received == frame, "readData() didn't return the frame startTransmit() wrote"
+    return results
+
+
+def main(repeats: int = 200):
+    radio, bus = host_radio()
+    for length in (40, MAX_FRAME_LEN):
+        frame = bytes(i & 0xFF for i in range(length))
+        bus.rx_length = length
+        for label, bulk in (("call per byte", False), ("bulk", True)):
+            for name, (calls, transactions, nbytes, elapsed_us) in measure(radio, bus, bulk, frame, repeats).items():
+                print(
+                    f"  {length:3} byte frame, {label:13} {name:13}: {calls:5.0f} SPI calls, "
+                    f"{transactions:2.0f} transactions, {nbytes:4.0f} bytes, {elapsed_us:7.1f} us"
+                )
+
+
+if __name__ == "__main__":
+    if sys.implementation.name != "cpython":
+        print("Run this with CPython, it replaces parts of the driver with host stand-ins")
+    else:
+        main()
@@ -0,0 +1,46 @@
+"""Generate elliptic curve (P-256) keys for autheticated messaging, with 64 byte signatures
+
+This must be run on the badge!
+mpremote run scripts/generate_ec_keys.py
+
+net.crypto.Crypto tells the key type from the DER files, copy these to /data/supercon_*.der to
+sign with them.
+"""
+
+from cryptography import ec, serialization
+
+from net.crypto import Crypto
+
+
+# Generate Keys
+print("Generating P-256 Key")
+private_key = ec.generate_private_key(ec.SECP256R1())
+public_key = private_key.public_key()
+
+private_key_der = private_key.private_bytes(
+    encoding=serialization.Encoding.DER,
+    format=serialization.PrivateFormat.TraditionalOpenSSL,
+    encryption_algorithm=serialization.NoEncryption(),
+)
+public_key_der = public_key.public_bytes(
+    encoding=serialization.Encoding.DER,
+    format=serialization.PublicFormat.SubjectPublicKeyInfo,
+)
+
+print("private_key DER", private_key_der)
+
+print("public_key DER", public_key_der)
+
+with open("/data/ec_private.der", "wb") as private_file:
+    private_file.write(private_key_der)
+
+with open("/data/ec_public.der", "wb") as public_file:
+    public_file.write(public_key_der)
+
+# Test the keys, loaded the way the badge does
+
+crypto = Crypto("ec")
+plaintext = b"Supercon will be so much fun!"
+signature = crypto.sign(plaintext)
+print(f"Key type: {crypto.key_type}, Sig: {signature}, len: {len(signature)}")
+print(f"Verified: {crypto.verify(plaintext, signature)}")
@@ -0,0 +1,146 @@
+"""Make the badge firmware importable from CPython on a host computer.
+
+This runs on your computer, not on the badge!
+
+The network stack (`badge/net/`) is written for Micropython and imports a few modules and
+builtins that don't exist in CPython (`machine`, `const()`, `sys.print_exception`,
+`asyncio.ThreadSafeFlag`, `time.ticks_ms()`, the badge's pins in `hardware.board`, ...). Importing this module adds `badge/` to the import path and
+installs minimal host stand-ins for those, so host-side tools like the mesh simulator can run
+the real network stack code.
+
+    import host_env  # Must be imported before anything from badge/
+    from net.net import BadgeNet
+"""
+
+import asyncio
+import builtins
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+import types
+
+BADGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "badge")
+if BADGE_DIR not in sys.path:
+    sys.path.insert(0, BADGE_DIR)
+
+
+def _const(value):
+    return value
+
+
+def _print_exception(exc, file=sys.stderr):
+    traceback.print_exception(type(exc), exc, exc.__traceback__, file=file)
+
+
+class ThreadSafeFlag:
+    """Host version of Micropython's asyncio.ThreadSafeFlag.
+    Multiple set() calls before a wait() only wake the waiter once, same as on the badge.
+    Like on the badge, set() may be called from another thread (standing in for an interrupt)."""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._loop = None
+        self._thread = None
+
+    def set(self):
+        if self._loop is not None and threading.get_ident() != self._thread:
+            self._loop.call_soon_threadsafe(self._event.set)
+        else:
+            self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.get_ident()
+        await self._event.wait()
+        self._event.clear()
+
+
+def _sleep_ms(ms):
+    return asyncio.sleep(ms / 1000)
+
+
+def _wait_for_ms(awaitable, timeout_ms):
+    return asyncio.wait_for(awaitable, timeout_ms / 1000)
+
+
+def _ticks_ms():
+    return time.monotonic_ns() // 1000000
+
+
+def _ticks_us():
+    return time.monotonic_ns() // 1000
+
+
+def _ticks_diff(end, start):
+    return end - start
+
+
+def _ticks_add(ticks, delta):
+    return ticks + delta
+
+
+class _HostPin:
+    """A `machine.Pin` output that goes nowhere."""
+
+    def value(self, value=None):
+        return 0
+
+
+def _unique_id():
+    return bytes(random.getrandbits(8) for _ in range(6))
+
+
+if not hasattr(builtins, "const"):
+    builtins.const = _const
+if not hasattr(sys, "print_exception"):
+    sys.print_exception = _print_exception
+if not hasattr(asyncio, "ThreadSafeFlag"):
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+if not hasattr(asyncio, "sleep_ms"):
+    asyncio.sleep_ms = _sleep_ms
+if not hasattr(asyncio, "wait_for_ms"):
+    asyncio.wait_for_ms = _wait_for_ms
+
+if not hasattr(time, "ticks_ms"):
+    time.ticks_ms = _ticks_ms
+    time.ticks_us = _ticks_us
+    time.ticks_diff = _ticks_diff
+    time.ticks_add = _ticks_add
+
+if "machine" not in sys.modules:
+    machine = types.ModuleType("machine")
+    machine.unique_id = _unique_id
+    sys.modules["machine"] = machine
+
+if "hardware.board" not in sys.modules:
+    # The real board module sets up every pin of the badge, net/lora.py only needs the RF switch
+    board = types.ModuleType("hardware.board")
+    board.RF_SW = _HostPin()
+    hardware = types.ModuleType("hardware")
+    hardware.board = board
+    sys.modules["hardware"] = hardware
+    sys.modules["hardware.board"] = board
+
+
+def use_host_cryptography() -> bool:
+    """Make the badge's `cryptography` module layout (`from cryptography import hashes, ec, ...`)
+    importable from the `cryptography` package on PyPI, which has the same key and signature API
+    under `cryptography.hazmat`. Returns False if it isn't installed."""
+    try:
+        import cryptography
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa, utils
+    except ImportError:
+        return False
+    for name, module in (("hashes", hashes), ("serialization", serialization), ("ec", ec),
+                         ("padding", padding), ("rsa", rsa), ("utils", utils)):
+        setattr(cryptography, name, module)
+        sys.modules[f"cryptography.{name}"] = module
+    return True
+
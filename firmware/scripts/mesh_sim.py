@@ -0,0 +1,923 @@
+#!/bin/env python3
+"""Host-side BadgeNet mesh simulator.
+
+This runs on your computer, not on the badge!
+
+Runs many real `net.net.BadgeNet` stacks (and their `NetworkFrame`s) in one CPython process,
+each on the real `net.lora.LoraRadio` driving a simulated SX1262 that shares a simulated RF channel. The channel models
+time-on-air from SF/BW/CR/preamble, log-distance path loss with shadowing and fading, the
+receiver noise floor, collisions with the capture effect, half-duplex radios and CAD.
+Simulated time only advances when every badge is waiting, so it runs faster than real time.
+
+Examples:
+    # 300 badges in a 50x30m hall, one chat message every 2 seconds somewhere in the hall
+    scripts/mesh_sim.py --nodes 300 --rate 0.5
+
+    # Compare stack changes: same seed, machine readable results
+    scripts/mesh_sim.py --nodes 1000 --duration 60 --seed 4 --json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import random
+import selectors
+import struct
+import time
+
+import host_env  # noqa: F401  Must come before importing badge code
+from net import airtime as airtime_module
+from net import dedup as dedup_module
+from net import lora as lora_module
+from net import mailbox as mailbox_module
+from net import neighbors as neighbors_module
+from net import net as net_module
+from net import protocols as protocols_module
+from net import transport as transport_module
+from net._sx126x import ERR_CRC_MISMATCH, ERR_NONE, SX126X_IRQ_ALL, SX126X_IRQ_CAD_DETECTED, SX126X_IRQ_CAD_DONE
+from net.lora import LoraRadio
+from net.net import BROADCAST_ADDRESS, SEND_REJECTED, TX_CLASS_NAMES, BadgeNet
+from net.protocols import NetworkFrame, Protocol
+from net.rxring import RxRing
+from net.sx1262 import SX1262
+
+# Same layout as TEXT_CHAT in apps/chat.py, which can't be imported on the host (needs LVGL)
+SIM_CHAT = Protocol(port=6, name="TEXT_CHAT", structdef="!H10s100s")
+# Same layout as PING in apps/net_tools.py, sent in a tight loop by a misbehaving badge
+SIM_PING = Protocol(port=1, name="PING", structdef="!IB")
+# Unicast answer to a chat message, like a PONG answering a PING
+SIM_REPLY = Protocol(port=42, name="SIM_REPLY", structdef="!I")
+REPLY_DELAY_S = 1.0
+
+# Minimum SNR the SX126x can demodulate at each spreading factor (datasheet table 13-79)
+DEMOD_SNR_DB = {5: -2.5, 6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+# Radio states
+RADIO_RX = 0
+RADIO_STANDBY = 1
+RADIO_TX = 2
+
+
+def time_on_air_s(length: int, sf: int, bw_khz: float, cr: int, preamble: int, crc: bool = True) -> float:
+    """LoRa time on air of a `length` byte explicit-header packet.
+    Same calculation as SX126X.getTimeOnAir(), `cr` is the 4/x coding rate denominator [5, 8]."""
+    symbol_s = (1 << sf) / (bw_khz * 1000)
+    low_data_rate = symbol_s >= 0.016
+    sf_coeff1 = 6.25 if sf in (5, 6) else 4.25
+    sf_coeff2 = 0 if sf in (5, 6) else 8
+    sf_divisor = 4 * (sf - 2) if low_data_rate else 4 * sf
+    bit_count = max(8 * length + 16 * crc - 4 * sf + sf_coeff2 + 20, 0)
+    payload_symbols = math.ceil(bit_count / sf_divisor) * cr
+    return (preamble + 8 + sf_coeff1 + payload_symbols) * symbol_s
+
+
+class _VirtualSelector(selectors._BaseSelectorImpl):
+    """Selector that never waits, "blocking" for the timeout moves the simulation clock instead."""
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+        self.wakeups = 0
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("Simulation stalled: nothing is scheduled to run.")
+        if timeout > 0:
+            self.wakeups += 1
+        self.now += timeout
+        return []
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Asyncio event loop running on simulated time. Sleeps complete instantly in wall clock time."""
+
+    def __init__(self):
+        self._virtual_selector = _VirtualSelector()
+        super().__init__(self._virtual_selector)
+
+    def time(self):
+        return self._virtual_selector.now
+
+    def wakeups(self) -> int:
+        """How many times the loop went idle and then woke up again for a timer."""
+        return self._virtual_selector.wakeups
+
+    def busy(self, seconds: float):
+        """Let time pass without running anything else, like blocking code holding up the badge's CPU.
+        Only meaningful with one badge on the loop, since it holds up every task."""
+        self._virtual_selector.now += seconds
+
+
+class VirtualTime:
+    """Stand-in for Micropython's `time` module inside the badge code, driven by the simulation clock."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def time(self) -> int:
+        # Micropython on the ESP32 only has 1 second resolution on time.time()
+        return int(self._loop.time())
+
+    def ticks_ms(self) -> int:
+        return int(self._loop.time() * 1000)
+
+    def ticks_us(self) -> int:
+        return int(self._loop.time() * 1000000)
+
+    def ticks_diff(self, end: int, start: int) -> int:
+        return end - start
+
+    def ticks_add(self, ticks: int, delta: int) -> int:
+        return ticks + delta
+
+
+# Badge modules that import `time` and need to run on the simulation clock
+TIMED_MODULES = [
+    airtime_module, dedup_module, lora_module, mailbox_module, neighbors_module, net_module, protocols_module, transport_module
+]
+
+
+def install_virtual_time(loop: asyncio.AbstractEventLoop):
+    virtual_time = VirtualTime(loop)
+    for module in TIMED_MODULES:
+        module.time = virtual_time
+
+
+class ChannelModel:
+    """Physical layer settings of the simulated hall. Defaults match the badge's LoraRadio settings."""
+
+    def __init__(
+        self,
+        sf: int = 7,
+        bw_khz: float = 500.0,
+        cr: int = 5,
+        preamble: int = 16,
+        tx_power_dbm: float = 9.0,
+        path_loss_1m_db: float = 40.0,
+        path_loss_exponent: float = 2.7,
+        shadowing_db: float = 4.0,
+        fading_db: float = 2.0,
+        noise_figure_db: float = 6.0,
+        capture_db: float = 6.0,
+        cad_symbols: int = 2,
+        cad_detect_preamble: float = 0.99,
+        cad_detect_payload: float = 0.8,
+    ):
+        self.sf = sf
+        self.bw_khz = bw_khz
+        self.cr = cr
+        self.preamble = preamble
+        self.tx_power_dbm = tx_power_dbm
+        self.path_loss_1m_db = path_loss_1m_db
+        self.path_loss_exponent = path_loss_exponent
+        self.shadowing_db = shadowing_db
+        self.fading_db = fading_db
+        self.capture_db = capture_db
+        self.cad_detect_preamble = cad_detect_preamble
+        self.cad_detect_payload = cad_detect_payload
+        self.symbol_s = (1 << sf) / (bw_khz * 1000)
+        self.noise_floor_dbm = -174 + 10 * math.log10(bw_khz * 1000) + noise_figure_db
+        self.demod_snr_db = DEMOD_SNR_DB[sf]
+        # Preamble plus sync word, after this a receiver is locked on and can't switch packets
+        self.sync_s = (preamble + 4.25) * self.symbol_s
+        # CAD listens for cad_symbols and needs about one more to process
+        self.cad_s = (cad_symbols + 1) * self.symbol_s
+
+    def time_on_air_s(self, length: int) -> float:
+        return time_on_air_s(length, self.sf, self.bw_khz, self.cr, self.preamble)
+
+    def mean_rssi_dbm(self, distance_m: float) -> float:
+        path_loss = self.path_loss_1m_db + 10 * self.path_loss_exponent * math.log10(max(distance_m, 0.5))
+        return self.tx_power_dbm - path_loss
+
+
+class Transmission:
+    __slots__ = ("sender", "frame", "start", "sync_end", "end", "aborted", "handle")
+
+    def __init__(self, sender, frame: bytes, start: float, sync_end: float, end: float):
+        self.sender = sender
+        self.frame = frame
+        self.start = start
+        self.sync_end = sync_end
+        self.end = end
+        self.aborted = False
+        self.handle = None
+
+
+class Channel:
+    """Shared RF channel that every SimSX1262 transmits into and hears from."""
+
+    def __init__(self, model: ChannelModel, positions: list, rng: random.Random):
+        self.model = model
+        self.rng = rng
+        self.radios: list = [None] * len(positions)  # SimSX1262 of each position, see SimSX1262.attach()
+        self.stats: collections.Counter = collections.Counter()
+        self.airtime_s = 0.0  # Sum of every transmission's time on air
+        self.busy_s = 0.0  # Time at least one transmission was on air
+        self._on_air = 0
+        self._busy_since = 0.0
+        # Ignore links so weak they can neither be received nor interfere
+        floor_dbm = model.noise_floor_dbm + model.demod_snr_db - model.capture_db - 3 * model.fading_db
+        self.links: list[list[tuple[int, float]]] = [[] for _ in positions]
+        for i, (xi, yi) in enumerate(positions):
+            for j in range(i + 1, len(positions)):
+                xj, yj = positions[j]
+                rssi = model.mean_rssi_dbm(math.hypot(xi - xj, yi - yj))
+                rssi += rng.gauss(0, model.shadowing_db)
+                if rssi >= floor_dbm:
+                    self.links[i].append((j, rssi))
+                    self.links[j].append((i, rssi))
+
+    def transmit(self, sender, frame: bytes) -> Transmission:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        model = self.model
+        tx = Transmission(sender, frame, now, now + model.sync_s, now + model.time_on_air_s(len(frame)))
+        self.stats["transmissions"] += 1
+        if not self._on_air:
+            self._busy_since = now
+        self._on_air += 1
+        gauss = self.rng.gauss
+        fading_db = model.fading_db
+        for j, rssi in self.links[sender.index]:
+            self.radios[j]._signal_start(tx, rssi + gauss(0, fading_db))
+        tx.handle = loop.call_at(tx.end, self._finish, tx)
+        return tx
+
+    def abort(self, tx: Transmission):
+        """The sender's radio left TX mode before the packet was finished."""
+        tx.aborted = True
+        tx.handle.cancel()
+        self.stats["tx_aborted"] += 1
+        self._finish(tx)
+
+    def _finish(self, tx: Transmission):
+        now = asyncio.get_running_loop().time()
+        self.airtime_s += now - tx.start
+        self._on_air -= 1
+        if not self._on_air:
+            self.busy_s += now - self._busy_since
+        for j, _ in self.links[tx.sender.index]:
+            self.radios[j]._signal_end(tx)
+        tx.sender._tx_done(tx)
+
+
+class SimSX1262(SX1262):
+    """Simulated SX1262 on a shared Channel, in place of the driver under the real net.lora.LoraRadio.
+    Answers the driver calls LoraRadio makes the way the chip does: receiving, transmitting and CAD
+    are states, their events latch in the IRQ status, and DIO1 rising calls LoraRadio's interrupt
+    handler. Going to standby or starting Rx again drops a packet that's being received."""
+
+    def __init__(self, spi_host=None, sck=None, mosi=None, miso=None, cs=None, irq=None, rst=None, gpio=None):
+        # No bus or pins to set up, so the driver's __init__ isn't called
+        self._callbackFunction = self._dummyFunction
+        self._rxMode = self.RX_CONTINUOUS
+        self._senderPreambleLength = 0
+        self.blocking = False
+        self.channel: Channel | None = None
+        self.state = RADIO_STANDBY
+        self._irq_status = 0
+        self._dio1_mask = 0
+        self._signals: dict[Transmission, float] = {}  # Everything currently on air at this antenna
+        self._locked: Transmission | None = None  # Packet currently being demodulated
+        self._locked_rssi = 0.0
+        self._locked_ok = False
+        self._tx: Transmission | None = None
+        self._cad: asyncio.TimerHandle | None = None
+        self._rx_frame = b""  # Last packet received, until the next one ends
+        self._rx_ok = False
+        self._rx_rssi = 0.0
+
+    def attach(self, channel: "Channel", index: int, rng: random.Random):
+        self.channel = channel
+        self.model = channel.model
+        self.rng = rng
+        self.index = index
+        channel.radios[index] = self
+
+    # Physical layer, called by the Channel
+
+    def _strongest_other(self, tx: Transmission) -> float:
+        return max((rssi for other, rssi in self._signals.items() if other is not tx), default=-math.inf)
+
+    def _try_lock(self, tx: Transmission, rssi: float):
+        if rssi - self.model.noise_floor_dbm < self.model.demod_snr_db:
+            return
+        if rssi - self._strongest_other(tx) < self.model.capture_db:
+            self.channel.stats["rx_collisions"] += 1
+            return
+        self._locked = tx
+        self._locked_rssi = rssi
+        self._locked_ok = True
+
+    def _signal_start(self, tx: Transmission, rssi: float):
+        self._signals[tx] = rssi
+        if self.state != RADIO_RX:
+            if rssi - self.model.noise_floor_dbm >= self.model.demod_snr_db:
+                self.channel.stats["rx_missed_not_listening"] += 1
+            return
+        locked = self._locked
+        if locked is None:
+            self._try_lock(tx, rssi)
+        elif rssi - self._locked_rssi >= self.model.capture_db and tx.start < locked.sync_end:
+            # Capture effect: a much stronger packet arriving during the preamble steals the receiver
+            self.channel.stats["rx_collisions"] += 1
+            self._locked = None
+            self._try_lock(tx, rssi)
+        elif self._locked_rssi - rssi < self.model.capture_db and self._locked_ok:
+            self.channel.stats["rx_collisions"] += 1
+            self._locked_ok = False
+
+    def _signal_end(self, tx: Transmission):
+        rssi = self._signals.pop(tx)
+        if self._locked is not tx:
+            return
+        self._locked = None
+        # A packet the sender cut short ends in a CRC error, like a collision
+        self._rx_frame = tx.frame
+        self._rx_ok = self._locked_ok and not tx.aborted
+        self._rx_rssi = rssi
+        self._latch(self.RX_DONE)
+
+    def _leave_rx(self, state: int):
+        if self._locked is not None:
+            self.channel.stats["rx_aborted"] += 1
+            self._locked = None
+        self.state = state
+
+    def _enter_rx(self):
+        self.state = RADIO_RX
+        # Packets still in their preamble can be picked up, anything further along is missed
+        now = asyncio.get_running_loop().time()
+        candidates = [(rssi, tx) for tx, rssi in self._signals.items() if now < tx.sync_end]
+        if candidates:
+            rssi, tx = max(candidates, key=lambda candidate: candidate[0])
+            self._try_lock(tx, rssi)
+
+    def _tx_done(self, tx: Transmission):
+        if self._tx is tx:
+            self._tx = None
+            self.state = RADIO_STANDBY
+            self._latch(self.TX_DONE)
+
+    def _cad_detects(self, at: float, signals) -> bool:
+        model = self.model
+        for tx, rssi in signals:
+            if rssi - model.noise_floor_dbm < model.demod_snr_db:
+                continue
+            detect = model.cad_detect_preamble if at < tx.sync_end else model.cad_detect_payload
+            if self.rng.random() < detect:
+                return True
+        return False
+
+    def _cad_done(self):
+        self._cad = None
+        now = asyncio.get_running_loop().time()
+        detected = self._cad_detects(now, list(self._signals.items()))
+        self._latch(SX126X_IRQ_CAD_DONE | (SX126X_IRQ_CAD_DETECTED if detected else 0))
+
+    # IRQ status and DIO1
+
+    def _latch(self, events: int):
+        was_pending = self.irqPending()
+        self._irq_status |= events
+        if not was_pending and self.irqPending():
+            self._callbackFunction(None)
+
+    def _operation(self, dio1_mask: int):
+        """Standby, then route `dio1_mask` to DIO1 and clear the IRQ status, as the driver does before every operation."""
+        self.standby()
+        self._dio1_mask = dio1_mask
+        self._irq_status = 0
+
+    def getIrqStatus(self) -> int:
+        status = self._irq_status
+        if self._locked is not None and asyncio.get_running_loop().time() >= self._locked.sync_end:
+            status |= self.HEADER_VALID
+        return status
+
+    def clearIrqStatus(self, clearIrqParams=SX126X_IRQ_ALL):
+        self._irq_status &= ~clearIrqParams
+        return ERR_NONE
+
+    def irqPending(self) -> bool:
+        return bool(self._irq_status & self._dio1_mask)
+
+    # Driver calls LoraRadio makes
+
+    def begin(self, **settings):
+        return ERR_NONE
+
+    def setPaConfig(self, *settings):
+        return ERR_NONE
+
+    def setFrequency(self, freq, calibrate=True):
+        return ERR_NONE
+
+    def setTxPreambleLength(self, length):
+        # Time on air comes from the channel model's preamble
+        return ERR_NONE
+
+    def setDeferredCallback(self, callback):
+        self._callbackFunction = callback
+        return self._startReceive()
+
+    def _startReceive(self):
+        # Duty cycled Rx is received like continuous Rx, the simulation doesn't model the wake ups
+        if self._rxMode == self.RX_SLEEP:
+            return self.standby()
+        return self.startReceive()
+
+    def standby(self, mode=None):
+        if self._cad is not None:
+            self._cad.cancel()
+            self._cad = None
+        if self._tx is not None:
+            tx = self._tx
+            self._tx = None
+            self.channel.abort(tx)
+        self._leave_rx(RADIO_STANDBY)
+        return ERR_NONE
+
+    def startReceive(self, timeout=None):
+        # SetRx restarts the receiver, even when it was already receiving
+        self._operation(self.RX_DONE)
+        self._enter_rx()
+        return ERR_NONE
+
+    def startChannelScan(self):
+        self._operation(SX126X_IRQ_CAD_DONE | SX126X_IRQ_CAD_DETECTED)
+        self._cad = asyncio.get_running_loop().call_later(self.model.cad_s, self._cad_done)
+        return ERR_NONE
+
+    def recvInto(self, buf) -> tuple:
+        length = min(len(self._rx_frame), len(buf))
+        buf[:length] = self._rx_frame[:length]
+        ok = self._rx_ok
+        self._startReceive()
+        if ok:
+            self.channel.stats["rx_frames"] += 1
+        return length, ERR_NONE if ok else ERR_CRC_MISMATCH
+
+    def getPacketSignal(self) -> tuple:
+        return self._rx_rssi, self._rx_rssi - self.model.noise_floor_dbm
+
+    def send(self, data):
+        self._operation(self.TX_DONE)
+        self.state = RADIO_TX
+        self._tx = self.channel.transmit(self, bytes(data))
+        return len(data), ERR_NONE
+
+    def getTimeOnAir(self, length: int) -> int:
+        return int(self.model.time_on_air_s(length) * 1e6)
+
+
+class SimBadge:
+    """Just the parts of hardware.badge.Badge that BadgeNet uses."""
+
+    def __init__(self, lora: LoraRadio, send_cooldown_ms: int = 1):
+        self.lora = lora
+        self.send_cooldown_ms = send_cooldown_ms
+
+
+class LoopbackRadio:
+    """LoraRadio stand-in with no channel at all, for exercising one badge's network stack by itself.
+    Frames are handed to the badge with inject(), and everything it transmits is recorded in `sent`.
+    Connect two with link() to have each receive what the other sends, losing a fraction of frames.
+    Received frames wait in an unbounded queue, or in `rx_ring` like on the badge if one is given."""
+
+    def __init__(self, airtime_s: float = 0.05, rx_ring: RxRing | None = None):
+        self.airtime_s = airtime_s
+        self.rx_ring = rx_ring
+        self.sent: list = []  # (time, frame)
+        self.peer: LoopbackRadio | None = None
+        self.loss = 0.0
+        self.rng = random.Random(0)
+        self.tx_done_callback = None
+        self._rx_queue: collections.deque = collections.deque()
+        self._message_ready = asyncio.Event()
+        self.max_pending = 0  # Most frames ever waiting for recv()
+
+    def inject(self, frame: bytes):
+        if self.rx_ring is not None:
+            buf = self.rx_ring.reserve()
+            if buf is None:
+                return
+            buf[: len(frame)] = frame
+            self.rx_ring.commit(len(frame))
+        else:
+            self._rx_queue.append(frame)
+        self.max_pending = max(self.max_pending, self.rx_pending())
+        self._message_ready.set()
+
+    async def recv(self) -> bytes | memoryview | None:
+        while not self.rx_pending():
+            if self.rx_ring is not None:
+                self.rx_ring.adapt()
+            self._message_ready.clear()
+            await self._message_ready.wait()
+        if self.rx_ring is not None:
+            return self.rx_ring.pop()
+        return self._rx_queue.popleft()
+
+    def release_rx(self):
+        if self.rx_ring is not None:
+            self.rx_ring.release()
+
+    def rx_overruns(self) -> int:
+        return self.rx_ring.overruns if self.rx_ring is not None else 0
+
+    def rx_pending(self) -> int:
+        if self.rx_ring is not None:
+            return self.rx_ring.pending()
+        return len(self._rx_queue)
+
+    def rx_busy(self) -> bool:
+        return False
+
+    def link(self, peer: "LoopbackRadio", loss: float = 0.0, seed: int = 0):
+        """Deliver frames both ways between this radio and `peer`, dropping `loss` of them at random."""
+        self.peer, peer.peer = peer, self
+        self.loss = peer.loss = loss
+        self.rng = random.Random(seed)
+        peer.rng = random.Random(seed + 1)
+
+    async def send(self, packet: bytes):
+        loop = asyncio.get_running_loop()
+        self.sent.append((loop.time(), bytes(packet)))
+        loop.call_later(self.airtime_s, self._tx_done)
+        if self.peer is not None and self.rng.random() >= self.loss:
+            loop.call_later(self.airtime_s, self.peer.inject, bytes(packet))
+
+    def _tx_done(self):
+        if self.tx_done_callback:
+            self.tx_done_callback()
+
+    def time_on_air_us(self, length: int) -> int:
+        return int(self.airtime_s * 1e6)
+
+    def get_rssi(self) -> float:
+        return -60.0
+
+    def get_snr(self) -> float:
+        return 10.0
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+class SimNode:
+    def __init__(self, index: int, address: int, channel: Channel, rng: random.Random):
+        self.index = index
+        self.channel = channel
+        self.rng = rng
+        self.radio: LoraRadio | None = None  # Made by start(), it needs the event loop running
+        self.badge: SimBadge | None = None
+        self.net = BadgeNet(address)
+
+    def start(self):
+        """Bring up the badge's LoraRadio, on a SimSX1262, and its network stack."""
+        driver = lora_module.SX1262
+        lora_module.SX1262 = SimSX1262
+        try:
+            self.radio = LoraRadio()
+        finally:
+            lora_module.SX1262 = driver
+        self.radio.radio.attach(self.channel, self.index, self.rng)
+        self.badge = SimBadge(self.radio)
+        self.net.init(self.badge)
+
+
+class Simulation:
+    """A hall full of badges chatting with each other."""
+
+    def __init__(
+        self,
+        nodes: int = 300,
+        width_m: float = 50.0,
+        height_m: float = 30.0,
+        rate: float = 0.5,
+        rogue_rate: float = 0.0,
+        ttl: int = 3,
+        duration_s: float = 120.0,
+        drain_s: float = 20.0,
+        seed: int = 1,
+        model: ChannelModel | None = None,
+        relay_copies: int | None = None,
+        relay_window: int | None = None,
+        burst: int = 1,
+        aggregate: bool | None = None,
+        trim: bool = False,
+        replies: bool = False,
+        route: bool | None = None,
+        max_backoff_ms: int | None = None,
+    ):
+        self.loop = VirtualTimeLoop()
+        install_virtual_time(self.loop)
+        self.rng = random.Random(seed)
+        random.seed(seed)  # BadgeNet's relay backoff and LoraRadio's channel access backoff use the random module
+        lora_module.print = _quiet  # LoraRadio prints a line as it starts and a ">" for every frame sent
+        self.model = model or ChannelModel()
+        protocols_module.TRIM_PAYLOADS = trim  # Shared by every badge in the simulation
+        self.rate = rate
+        self.burst = burst
+        self.replies = replies
+        self.rogue_rate = rogue_rate
+        self.rogue_sent = 0
+        self.rogue_rejected = 0
+        self.utilisation_samples: list[float] = []  # Mean of what the badges think channel utilisation is
+        self.ttl = ttl
+        self.duration_s = duration_s
+        self.drain_s = drain_s
+        positions = [(self.rng.uniform(0, width_m), self.rng.uniform(0, height_m)) for _ in range(nodes)]
+        self.channel = Channel(self.model, positions, self.rng)
+        addresses = self.rng.sample(range(1, BROADCAST_ADDRESS), nodes)
+        self.nodes = [
+            SimNode(i, address, self.channel, random.Random(self.rng.getrandbits(32)))
+            for i, address in enumerate(addresses)
+        ]
+        self.max_backoff_ms = max_backoff_ms
+        for node in self.nodes:
+            if relay_copies is not None:
+                node.net.relay_cancel_copies = relay_copies
+            if relay_window is not None:
+                node.net.relay_window_slots = relay_window
+            if aggregate is not None:
+                node.net.aggregate_frames = aggregate
+            if route is not None:
+                node.net.route_unicasts = route
+        self.originated: dict[int, tuple[int, float]] = {}  # msg_id: (node index, send time)
+        self.deliveries: dict[int, dict[int, float]] = {}  # msg_id: {node index: receive time}
+        self.replies_sent: dict[int, float] = {}  # msg_id: send time of the reply to it
+        self.replies_delivered: dict[int, float] = {}  # msg_id: receive time
+        self.wall_s = 0.0
+
+    def _receiver(self, node: SimNode):
+        def receive(message: NetworkFrame):
+            msg_id = int.from_bytes(message.payload[1][:4], "big")
+            if msg_id in self.originated:
+                self.deliveries[msg_id].setdefault(node.index, asyncio.get_running_loop().time())
+
+        return receive
+
+    def _reply_receiver(self, message: NetworkFrame):
+        self.replies_delivered.setdefault(message.payload[0], asyncio.get_running_loop().time())
+
+    async def reply(self, msg_id: int):
+        """One of the badges that got a message answers its sender directly."""
+        await asyncio.sleep(REPLY_DELAY_S)
+        receivers = sorted(self.deliveries[msg_id])
+        if not receivers:
+            return
+        node = self.nodes[self.rng.choice(receivers)]
+        origin = self.nodes[self.originated[msg_id][0]]
+        self.replies_sent[msg_id] = asyncio.get_running_loop().time()
+        node.net.send(
+            NetworkFrame().set_fields(protocol=SIM_REPLY, destination=origin.net.address, ttl=self.ttl, payload=(msg_id,))
+        )
+
+    text = b"Simulated chat message"
+    burst_text = b"ok"  # Bursts are of short messages, like game moves or acknowledgements
+
+    def originate(self, node: SimNode, text: bytes = text):
+        msg_id = len(self.originated)
+        self.originated[msg_id] = (node.index, asyncio.get_running_loop().time())
+        self.deliveries[msg_id] = {}
+        node.net.send(
+            NetworkFrame().set_fields(
+                protocol=SIM_CHAT,
+                destination=BROADCAST_ADDRESS,
+                ttl=self.ttl,
+                payload=(901, struct.pack("!I", msg_id), text),
+            )
+        )
+
+    async def traffic(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.rate))
+            if loop.time() >= self.duration_s:
+                return
+            node = self.rng.choice(self.nodes)
+            for _ in range(self.burst):
+                self.originate(node, self.burst_text if self.burst > 1 else self.text)
+                if self.replies:
+                    asyncio.create_task(self.reply(len(self.originated) - 1))
+
+    async def rogue_traffic(self):
+        """The first badge sends PINGs as fast as `rogue_rate`, like an app stuck in a loop."""
+        node = self.nodes[0]
+        while asyncio.get_running_loop().time() < self.duration_s:
+            status = node.net.send(
+                NetworkFrame().set_fields(protocol=SIM_PING, destination=BROADCAST_ADDRESS, ttl=self.ttl, payload=(node.net.address, 0))
+            )
+            if status == SEND_REJECTED:
+                self.rogue_rejected += 1
+            else:
+                self.rogue_sent += 1
+            await asyncio.sleep(1 / self.rogue_rate)
+
+    async def sample_utilisation(self, interval_s: float = 5.0):
+        while asyncio.get_running_loop().time() < self.duration_s:
+            await asyncio.sleep(interval_s)
+            self.utilisation_samples.append(
+                sum(node.net.airtime.channel_utilisation_pct() for node in self.nodes) / len(self.nodes)
+            )
+
+    async def run(self):
+        for node in self.nodes:
+            node.net.register_receiver(SIM_CHAT, self._receiver(node))
+            node.net.register_receiver(SIM_REPLY, self._reply_receiver)
+            node.start()
+            if self.max_backoff_ms is not None:
+                node.radio.csma_max_backoff_ms = self.max_backoff_ms
+        asyncio.create_task(self.sample_utilisation())
+        if self.rogue_rate:
+            asyncio.create_task(self.rogue_traffic())
+        await self.traffic()
+        await asyncio.sleep(self.duration_s + self.drain_s - asyncio.get_running_loop().time())
+
+    def execute(self):
+        loop = self.loop
+        start = time.perf_counter()
+        try:
+            loop.run_until_complete(self.run())
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            loop.close()
+        self.wall_s = time.perf_counter() - start
+        return self.results()
+
+    def results(self) -> dict:
+        receivers = len(self.nodes) - 1
+        messages = len(self.originated)
+        latencies = []
+        delivered = 0
+        for msg_id, (_, sent) in self.originated.items():
+            for node_index, received in self.deliveries[msg_id].items():
+                latencies.append(received - sent)
+            delivered += len(self.deliveries[msg_id])
+        latencies.sort()
+
+        def percentile(fraction: float) -> float:
+            if not latencies:
+                return math.nan
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+        stats = self.channel.stats
+        sim_s = self.duration_s + self.drain_s
+        cad = sum(node.radio.cad_attempts for node in self.nodes)
+        cad_busy = sum(node.radio.cad_busy for node in self.nodes)
+        accesses = sum(node.radio.access_delay.count for node in self.nodes)
+        access_delay_ms = sum(node.radio.access_delay.total_ms for node in self.nodes)
+        tx_queue_drops = {
+            f"tx_queue_drops_{name}": sum(node.net.transmit_queue.drops[tx_class] for node in self.nodes)
+            for tx_class, name in enumerate(TX_CLASS_NAMES)
+        }
+        return {
+            "nodes": len(self.nodes),
+            "simulated_s": sim_s,
+            "wall_s": round(self.wall_s, 2),
+            "speedup": round(sim_s / self.wall_s, 2) if self.wall_s else math.inf,
+            "messages": messages,
+            "deliveries": delivered,
+            "delivery_ratio": delivered / (messages * receivers) if messages and receivers else math.nan,
+            "latency_mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else math.nan,
+            "latency_p50_ms": percentile(0.5),
+            "latency_p95_ms": percentile(0.95),
+            "latency_max_ms": latencies[-1] * 1000 if latencies else math.nan,
+            "transmissions": stats["transmissions"],
+            "transmissions_per_message": stats["transmissions"] / messages if messages else math.nan,
+            "airtime_s": round(self.channel.airtime_s, 3),
+            "channel_busy_pct": 100 * self.channel.busy_s / sim_s,
+            "badge_utilisation_pct": (
+                sum(self.utilisation_samples) / len(self.utilisation_samples) if self.utilisation_samples else math.nan
+            ),
+            "airtime_per_delivery_ms": 1000 * self.channel.airtime_s / delivered if delivered else math.nan,
+            "airtime_per_message_ms": 1000 * self.channel.airtime_s / messages if messages else math.nan,
+            "rx_frames": stats["rx_frames"],
+            "rx_collisions": stats["rx_collisions"],
+            "rx_missed_not_listening": stats["rx_missed_not_listening"],
+            "rx_aborted": stats["rx_aborted"],
+            "rx_queue_overflow": sum(node.radio.rx_overruns() for node in self.nodes),
+            "rx_batch_max": max(node.net.rx_batch_max for node in self.nodes),
+            "rx_ring_slots_max": max(node.radio._rx_ring.max_slots_used for node in self.nodes),
+            "tx_aborted": stats["tx_aborted"],
+            "relays_held": sum(node.net.relays_held for node in self.nodes),
+            "relays_cancelled": sum(node.net.relays_cancelled for node in self.nodes),
+            "relay_hold_drops": sum(node.net.relay_hold_drops for node in self.nodes),
+            "containers_sent": sum(node.net.containers_sent for node in self.nodes),
+            "frames_aggregated": sum(node.net.frames_aggregated for node in self.nodes),
+            "replies": len(self.replies_sent),
+            "reply_delivery_ratio": len(self.replies_delivered) / len(self.replies_sent) if self.replies_sent else math.nan,
+            "unicast_relays": sum(node.net.unicast_relays for node in self.nodes),
+            "relays_per_reply": (
+                sum(node.net.unicast_relays for node in self.nodes) / len(self.replies_sent) if self.replies_sent else math.nan
+            ),
+            "routed_sent": sum(node.net.routed_sent for node in self.nodes),
+            "route_drops": sum(node.net.route_drops for node in self.nodes),
+            "neighbors_mean": sum(len(node.net.neighbors) for node in self.nodes) / len(self.nodes),
+            "direct_neighbors_mean": sum(len(node.net.neighbors.addresses(max_hops=0)) for node in self.nodes) / len(self.nodes),
+            "cad": cad,
+            "cad_busy": cad_busy,
+            "cad_busy_ratio": cad_busy / cad if cad else math.nan,
+            "cad_errors": sum(node.radio.cad_errors for node in self.nodes),
+            "access_delay_mean_ms": access_delay_ms / accesses if accesses else math.nan,
+            **tx_queue_drops,
+            "airtime_refused_local": sum(
+                bucket.refused for node in self.nodes for bucket in node.net.airtime.port_buckets.values()
+            ),
+            "airtime_refused_relay": sum(node.net.airtime.relay_bucket.refused for node in self.nodes),
+            "rogue_sent": self.rogue_sent,
+            "rogue_rejected": self.rogue_rejected,
+        }
+
+
+def print_results(results: dict):
+    width = max(len(key) for key in results)
+    for key, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.3f}"
+        print(f"{key:<{width}}  {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("BadgeNet mesh simulator")
+    parser.add_argument("--nodes", type=int, default=300, help="Number of badges in the hall.")
+    parser.add_argument("--width", type=float, default=50.0, help="Hall width in meters.")
+    parser.add_argument("--height", type=float, default=30.0, help="Hall depth in meters.")
+    parser.add_argument("--rate", type=float, default=0.5, help="Chat messages per second sent across the whole hall.")
+    parser.add_argument("--rogue-rate", type=float, default=0.0, help="PINGs per second sent by one misbehaving badge.")
+    parser.add_argument("--ttl", type=int, default=3, help="TTL of chat messages (chat_ttl config).")
+    parser.add_argument("--duration", type=float, default=120.0, help="Simulated seconds of chat traffic.")
+    parser.add_argument("--drain", type=float, default=20.0, help="Simulated seconds to let relays finish after traffic stops.")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed, for repeatable comparisons.")
+    parser.add_argument("--sf", type=int, default=7, help="LoRa spreading factor.")
+    parser.add_argument("--bw", type=float, default=500.0, help="LoRa bandwidth in kHz.")
+    parser.add_argument("--cr", type=int, default=5, help="LoRa coding rate denominator, 4/x.")
+    parser.add_argument("--preamble", type=int, default=16, help="LoRa preamble length in symbols.")
+    parser.add_argument("--tx-power", type=float, default=9.0, help="Transmit power in dBm.")
+    parser.add_argument("--path-loss-exponent", type=float, default=2.7, help="Log-distance path loss exponent.")
+    parser.add_argument("--shadowing", type=float, default=4.0, help="Shadowing standard deviation in dB per link.")
+    parser.add_argument(
+        "--relay-copies", type=int, help="Cancel a held relay after hearing this many repeats (relay_cancel_copies)."
+    )
+    parser.add_argument(
+        "--relay-window", type=int, help="Relay backoff in frame times, 0 relays immediately (relay_window_slots)."
+    )
+    parser.add_argument("--burst", type=int, default=1, help="Short messages each badge sends at once, 1 for normal chat.")
+    parser.add_argument(
+        "--aggregate", action="store_true", help="Pack waiting frames into containers (aggregate_frames)."
+    )
+    parser.add_argument(
+        "--trim", action="store_true", help="Send frames without their trailing zero bytes (TRIM_PAYLOADS)."
+    )
+    parser.add_argument(
+        "--replies", action="store_true", help="A badge that got each chat message answers its sender with a unicast."
+    )
+    parser.add_argument("--route", action="store_true", help="Route unicasts instead of flooding them (route_unicasts).")
+    parser.add_argument(
+        "--max-backoff", type=int, help="Cap in ms on the channel access backoff window (csma_max_backoff_ms)."
+    )
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    simulation = Simulation(
+        nodes=args.nodes,
+        width_m=args.width,
+        height_m=args.height,
+        rate=args.rate,
+        rogue_rate=args.rogue_rate,
+        ttl=args.ttl,
+        duration_s=args.duration,
+        drain_s=args.drain,
+        seed=args.seed,
+        relay_copies=args.relay_copies,
+        relay_window=args.relay_window,
+        burst=args.burst,
+        aggregate=True if args.aggregate else None,
+        trim=args.trim,
+        replies=args.replies,
+        route=True if args.route else None,
+        max_backoff_ms=args.max_backoff,
+        model=ChannelModel(
+            sf=args.sf,
+            bw_khz=args.bw,
+            cr=args.cr,
+            preamble=args.preamble,
+            tx_power_dbm=args.tx_power,
+            path_loss_exponent=args.path_loss_exponent,
+            shadowing_db=args.shadowing,
+        ),
+    )
+    results = simulation.execute()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)